@@ -0,0 +1,117 @@
+import argparse
+import os
+import time
+
+import numpy as np
+
+from dlfm_code import io, sweep, tester
+from experimentation_code import ann, cache, feature_bank
+
+NPROBES = [1, 2, 4, 8]
+
+
+def _number(value):
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+def neighbor_recall(index, bank, folds, k_neighbor, nprobe):
+    # the test recordings of each fold are searched among its training
+    # recordings, as in the mode recognition experiment
+    recalls, compared = [], []
+    for _, fold in folds:
+        queries = bank.pdf[bank.mask([ts['source'] for ts in
+                                      fold['testing']])]
+        fold_recall, fold_compared = ann.recall(
+            index, bank.pdf, queries, k_neighbor, nprobe,
+            bank.mask(fold['training']['sources']))
+        recalls.append(fold_recall)
+        compared.append(fold_compared)
+    return float(np.mean(recalls)), float(np.mean(compared))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Tests the multi models with the approximate nearest '
+                    'neighbor index and reports the neighbor recall, the '
+                    'test time and the accuracy gap against the exact '
+                    'search for each number of probed lists.')
+    parser.add_argument('--data-folder', default=os.path.join('.', 'data'))
+    parser.add_argument('--annotation-file', default=None,
+                        help='defaults to DATA_FOLDER/'
+                             'otmm_makam_recognition_dataset/'
+                             'annotations.json')
+    parser.add_argument('--pitch-store-folder', default=None,
+                        help='defaults to DATA_FOLDER/pitch_store')
+    parser.add_argument('--distribution-type', default='pcd')
+    parser.add_argument('--step-size', type=_number, default=7.5)
+    parser.add_argument('--kernel-width', type=_number, default=15.0)
+    parser.add_argument('--dis-measure', default='bhat',
+                        choices=sorted(ann.TRANSFORMS))
+    parser.add_argument('--k-neighbor', type=int, default=15)
+    parser.add_argument('--min-peak-ratio', type=_number, default=0.15)
+    parser.add_argument('--experiment-types', nargs='+',
+                        default=sweep.EXPERIMENT_TYPES)
+    parser.add_argument('--nprobes', type=int, nargs='+', default=NPROBES,
+                        help='numbers of lists to probe')
+    parser.add_argument('--output', default=None,
+                        help='report file, defaults to '
+                             'DATA_FOLDER/testing/ann_report.json')
+    args = parser.parse_args(argv)
+    annotation_file = args.annotation_file or os.path.join(
+        args.data_folder, 'otmm_makam_recognition_dataset',
+        'annotations.json')
+    pitch_store_folder = args.pitch_store_folder or os.path.join(
+        args.data_folder, 'pitch_store')
+
+    folds = io.load_folds(args.data_folder)
+    bank = feature_bank.load(os.path.abspath(io.get_folder(
+        os.path.join(args.data_folder, 'features'), args.distribution_type,
+        args.step_size, args.kernel_width)))
+    tic = time.perf_counter()
+    index = tester.load_ann_index(args.data_folder, args.distribution_type,
+                                  args.step_size, args.kernel_width,
+                                  args.dis_measure)
+    print(u'{0:d} rows in {1:d} lists, loaded in {2:.2f} s'.format(
+        index.num_rows, index.num_lists, time.perf_counter() - tic))
+
+    report = {'num_rows': index.num_rows, 'num_lists': index.num_lists,
+              'nprobes': {}}
+    for nprobe in args.nprobes:
+        recall, compared = neighbor_recall(index, bank, folds,
+                                           args.k_neighbor, nprobe)
+        report['nprobes'][str(nprobe)] = {
+            'recall': recall, 'compared': compared, 'experiments': {}}
+
+    print(u'{0:>8s}  {1:>8s}  {2:>8s}  {3:<6s}  {4:>9s}  {5:>9s}  '
+          u'{6:>6s}  {7:>8s}'.format('nprobe', 'recall', 'compared',
+                                     'exp.', 'accuracy', 'gap', 'time',
+                                     'speedup'))
+    for experiment_type in args.experiment_types:
+        comparisons = tester.compare_search(
+            args.step_size, args.kernel_width, args.distribution_type,
+            'multi', experiment_type, args.dis_measure, args.k_neighbor,
+            args.min_peak_ratio, args.data_folder,
+            [{'ann_nprobe': nprobe} for nprobe in args.nprobes],
+            annotation_file, pitch_store_folder)
+        for comp in comparisons:
+            entry = report['nprobes'][str(comp['ann_nprobe'])]
+            entry['experiments'][experiment_type] = comp
+            print(u'{0:>8d}  {1:>8.3f}  {2:>8.3f}  {3:<6s}  {4:>9.4f}  '
+                  u'{5:>+9.4f}  {6:>6.1f}  {7:>7.2f}x'.format(
+                      comp['ann_nprobe'], entry['recall'],
+                      entry['compared'], experiment_type, comp['accuracy'],
+                      comp['accuracy_gap'], comp['test_time'],
+                      comp['exact_test_time'] / comp['test_time']))
+
+    output = args.output or os.path.join(args.data_folder, 'testing',
+                                         'ann_report.json')
+    cache.atomic_dump_json(report, output, indent=4)
+    print(u'Saved {0:s}'.format(output))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,219 @@
+import argparse
+import json
+import os
+import shutil
+
+import numpy as np
+
+from dlfm_code import sweep, tester, trainer
+from experimentation_code import benchmark, distribution, pitch_store, \
+    synthetic
+
+# (step_sizes, kernel_widths, distribution_types) of each grid size
+GRIDS = {
+    'small': ([25.0], [15.0], ['pcd']),
+    'medium': ([15.0, 25.0, 50.0], [0, 15.0, 25.0], ['pd', 'pcd']),
+    'full': (sweep.STEP_SIZES, sweep.KERNEL_WIDTHS,
+             sweep.DISTRIBUTION_TYPES)}
+MIN_PEAK_RATIOS = np.arange(0.05, 1.0, 0.05).round(2).tolist()
+DIS_MEASURE = 'bhat'
+K_NEIGHBOR = 1
+MIN_PEAK_RATIO = 0.15
+RANK = 1
+# the modules, which the workers import to compute
+STARTUP_MODULES = ['dlfm_code.tester', 'dlfm_code.trainer',
+                   'experimentation_code.knn']
+
+
+def get_dataset(work_folder, num_frames, seed, regenerate=False):
+    dataset_folder = os.path.join(work_folder, 'dataset')
+    folds_file = os.path.join(work_folder, 'folds.json')
+    if regenerate or not os.path.exists(folds_file):
+        shutil.rmtree(dataset_folder, ignore_errors=True)
+        return synthetic.generate(dataset_folder, num_frames=num_frames,
+                                  seed=seed, folds_file=folds_file)
+    annotations = json.load(open(os.path.join(dataset_folder,
+                                              'annotations.json')))
+    return annotations, json.load(open(folds_file))
+
+
+def _compute_features(params, annotations, dataset_folder, save_folder,
+                      pitch_store_folder):
+    step_sizes, kernel_widths, distribution_types = params
+    for anno in annotations:
+        trainer.compute_recording_distributions_grid(
+            step_sizes, kernel_widths, distribution_types, anno,
+            dataset_folder, save_folder, True, pitch_store_folder)
+
+
+def _train_single(params, folds, save_folder):
+    for distribution_type, step_size, kernel_width in params:
+        trainer.train_single_folds(step_size, kernel_width,
+                                   distribution_type, folds, save_folder,
+                                   True)
+
+
+def _train_multi(params, folds, save_folder):
+    for distribution_type, step_size, kernel_width in params:
+        for fold in folds:
+            trainer.train_multi(step_size, kernel_width, distribution_type,
+                                fold, save_folder, True)
+
+
+def _test(params, fold_indices, model_type, experiment_type, save_folder,
+          pitch_store_folder):
+    for distribution_type, step_size, kernel_width in params:
+        for fold_idx in fold_indices:
+            res_dict = tester.test(
+                step_size, kernel_width, distribution_type, model_type,
+                fold_idx, experiment_type, DIS_MEASURE, K_NEIGHBOR,
+                MIN_PEAK_RATIO, RANK, save_folder, True, pitch_store_folder)
+            if res_dict['failed']:
+                raise RuntimeError(u'{0:d} samples failed.'.format(
+                    len(res_dict['failed'])))
+
+
+def _evaluate(params, model_type, experiment_type, save_folder,
+              annotation_file):
+    for distribution_type, step_size, kernel_width in params:
+        tester.evaluate(step_size, kernel_width, distribution_type,
+                        model_type, experiment_type, DIS_MEASURE, K_NEIGHBOR,
+                        MIN_PEAK_RATIO, save_folder, annotation_file)
+
+
+def _search_min_peak_ratio(params, save_folder):
+    for distribution_type, step_size, kernel_width in params:
+        tester.search_min_peak_ratios(step_size, kernel_width,
+                                      distribution_type, MIN_PEAK_RATIOS,
+                                      save_folder)
+
+
+def run_startup(recorder, modules):
+    # each module is imported in a new interpreter, as by a new worker
+    heavy = {}
+    for module in modules:
+        wall_time, max_rss, imported = benchmark.measure_startup(module)
+        recorder.add(u'startup[{0:s}]'.format(module), wall_time, max_rss)
+        heavy[module] = sorted(set(imported) & set(benchmark.HEAVY_MODULES))
+    return heavy
+
+
+def run_pipeline(recorder, grid, annotations, folds, dataset_folder,
+                 work_folder, model_types, experiment_types, num_test_folds):
+    # each run starts from scratch in its own folder
+    save_folder = os.path.join(work_folder, grid)
+    shutil.rmtree(save_folder, ignore_errors=True)
+    os.makedirs(save_folder)
+    shutil.copy(os.path.join(work_folder, 'folds.json'), save_folder)
+    pitch_store_folder = os.path.join(save_folder, 'pitch_store')
+    annotation_file = os.path.join(dataset_folder, 'annotations.json')
+    params = distribution.get_param_grid(*GRIDS[grid])
+    fold_indices = [fold_idx for fold_idx, _ in folds][:num_test_folds]
+
+    def run(step, func, *args):
+        recorder.run(u'{0:s}[{1:s}]'.format(step, grid), func, *args)
+
+    run('pitch_store.build', pitch_store.build, annotations, dataset_folder,
+        pitch_store_folder)
+    run('compute_recording_distributions', _compute_features, GRIDS[grid],
+        annotations, dataset_folder, save_folder, pitch_store_folder)
+    if 'single' in model_types:
+        run('train_single', _train_single, params, folds, save_folder)
+    if 'multi' in model_types:
+        run('train_multi', _train_multi, params, folds, save_folder)
+    for model_type in model_types:
+        for experiment_type in experiment_types:
+            name = u'{0:s}/{1:s}'.format(model_type, experiment_type)
+            run('test/' + name, _test, params, fold_indices, model_type,
+                experiment_type, save_folder, pitch_store_folder)
+            run('evaluate/' + name, _evaluate, params, model_type,
+                experiment_type, save_folder, annotation_file)
+    run('search_min_peak_ratio', _search_min_peak_ratio, params, save_folder)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmarks the feature extraction, training, testing '
+                    'and evaluation on a synthetic dataset with the shape '
+                    'of the OTMM makam recognition dataset.')
+    parser.add_argument('--work-folder',
+                        default=os.path.join('.', 'benchmark'))
+    parser.add_argument('--grids', nargs='+', choices=sorted(GRIDS),
+                        default=['small', 'medium'])
+    parser.add_argument('--model-types', nargs='+',
+                        default=sweep.MODEL_TYPES)
+    parser.add_argument('--experiment-types', nargs='+',
+                        default=sweep.EXPERIMENT_TYPES)
+    parser.add_argument('--test-folds', type=int, default=1,
+                        help='number of folds to test')
+    parser.add_argument('--num-frames', type=int,
+                        default=synthetic.NUM_FRAMES,
+                        help='number of frames per synthetic pitch track')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--regenerate', action='store_true',
+                        help='generate the synthetic dataset again')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='number of timed runs')
+    parser.add_argument('--startup-modules', nargs='*',
+                        default=STARTUP_MODULES,
+                        help='modules to measure the cold start of, no '
+                             'value skips the startup benchmark')
+    parser.add_argument('--no-memory', action='store_true',
+                        help='skip the run, which traces the peak memory')
+    parser.add_argument('--output', default=None,
+                        help='results file, defaults to '
+                             'WORK_FOLDER/results.json')
+    parser.add_argument('--baseline', default=None,
+                        help='results file to compare against')
+    parser.add_argument('--tolerance', type=float,
+                        default=benchmark.TOLERANCE,
+                        help='allowed relative increase wrt the baseline')
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.work_folder):
+        os.makedirs(args.work_folder)
+    annotations, folds = get_dataset(args.work_folder, args.num_frames,
+                                     args.seed, args.regenerate)
+    dataset_folder = os.path.join(args.work_folder, 'dataset')
+
+    recorder = benchmark.Recorder()
+    heavy = {}
+    for _ in range(args.repeat):
+        heavy = run_startup(recorder, args.startup_modules)
+    traced = [] if args.no_memory else [True]
+    for trace_memory in [False] * args.repeat + traced:
+        recorder.trace_memory = trace_memory
+        for grid in args.grids:
+            run_pipeline(recorder, grid, annotations, folds, dataset_folder,
+                         args.work_folder, args.model_types,
+                         args.experiment_types, args.test_folds)
+
+    results = recorder.results(benchmark.metadata(
+        grids={grid: len(distribution.get_param_grid(*GRIDS[grid]))
+               for grid in args.grids},
+        num_recordings=len(annotations), num_folds=len(folds),
+        num_test_folds=args.test_folds, num_frames=args.num_frames,
+        seed=args.seed, repeat=args.repeat))
+    output = args.output or os.path.join(args.work_folder, 'results.json')
+    benchmark.save(results, output)
+
+    baseline = None if args.baseline is None else benchmark.load(
+        args.baseline)
+    print(benchmark.report(results, baseline))
+    print(u'Saved {0:s}'.format(output))
+
+    heavy = {module: names for module, names in heavy.items() if names}
+    for module, names in heavy.items():
+        print(u'HEAVY IMPORTS {0:s}: {1:s}'.format(module, ', '.join(names)))
+    if baseline is None:
+        return 1 if heavy else 0
+
+    regressions = benchmark.compare(results, baseline, args.tolerance)
+    for reg in regressions:
+        print(u'REGRESSION {0:s} {1:s}: {2:g} -> {3:g}'.format(
+            reg.name, reg.metric, reg.baseline, reg.value))
+    return 1 if regressions or heavy else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,108 @@
+import argparse
+import os
+
+from dlfm_code import sweep, tester
+from experimentation_code import cache, distance, instrument
+
+COARSE_STEPS = [50.0, 100.0]
+TOP_NS = [1, 3, 5, 10]
+
+
+def _number(value):
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+def _ratio(counts, num, den):
+    return counts[num] / float(counts[den]) if counts.get(den) else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Tests the tonic identification and the joint '
+                    'estimation with the coarse-to-fine search and reports '
+                    'the pruning rate, the changed estimates, the test time '
+                    'and the accuracy gap against the full search for each '
+                    'coarse bin size and number of refined hypotheses.')
+    parser.add_argument('--data-folder', default=os.path.join('.', 'data'))
+    parser.add_argument('--annotation-file', default=None,
+                        help='defaults to DATA_FOLDER/'
+                             'otmm_makam_recognition_dataset/'
+                             'annotations.json')
+    parser.add_argument('--pitch-store-folder', default=None,
+                        help='defaults to DATA_FOLDER/pitch_store')
+    parser.add_argument('--model-type', default='multi',
+                        choices=sweep.MODEL_TYPES)
+    parser.add_argument('--distribution-type', default='pcd')
+    parser.add_argument('--step-size', type=_number, default=7.5)
+    parser.add_argument('--kernel-width', type=_number, default=15.0)
+    parser.add_argument('--dis-measure', default='bhat',
+                        choices=list(distance.DISTANCE_MEASURES))
+    parser.add_argument('--k-neighbor', type=int, default=15)
+    parser.add_argument('--min-peak-ratio', type=_number, default=0.15)
+    parser.add_argument('--experiment-types', nargs='+',
+                        default=['tonic', 'joint'],
+                        choices=['tonic', 'joint'])
+    parser.add_argument('--coarse-steps', type=_number, nargs='+',
+                        default=COARSE_STEPS,
+                        help='bin sizes of the coarse search in cents')
+    parser.add_argument('--top-ns', type=int, nargs='+', default=TOP_NS,
+                        help='numbers of hypotheses to refine')
+    parser.add_argument('--output', default=None,
+                        help='report file, defaults to '
+                             'DATA_FOLDER/testing/coarse_search_report.json')
+    args = parser.parse_args(argv)
+    annotation_file = args.annotation_file or os.path.join(
+        args.data_folder, 'otmm_makam_recognition_dataset',
+        'annotations.json')
+    pitch_store_folder = args.pitch_store_folder or os.path.join(
+        args.data_folder, 'pitch_store')
+    if not instrument.enabled():  # the pruning is counted by the stages
+        instrument.configure()
+
+    report = {}
+    print(u'{0:>7s}  {1:>5s}  {2:<6s}  {3:>7s}  {4:>7s}  {5:>9s}  {6:>9s}  '
+          u'{7:>8s}  {8:>6s}  {9:>8s}'.format(
+              'coarse', 'top', 'exp.', 'pruned', 'fine', 'accuracy', 'gap',
+              'changed', 'time', 'speedup'))
+    for experiment_type in args.experiment_types:
+        comparisons = tester.compare_search(
+            args.step_size, args.kernel_width, args.distribution_type,
+            args.model_type, experiment_type, args.dis_measure,
+            args.k_neighbor, args.min_peak_ratio, args.data_folder,
+            [{'coarse_step': coarse_step, 'top_n': top_n}
+             for coarse_step in args.coarse_steps for top_n in args.top_ns],
+            annotation_file, pitch_store_folder)
+        for comp in comparisons:
+            # the share of the hypotheses, which are pruned, and the full
+            # resolution distances wrt the distances of the full search
+            counts = comp['counts']
+            refined = _ratio(counts, 'refined_hypotheses', 'hypotheses')
+            comp['pruning_rate'] = None if refined is None else 1 - refined
+            comp['fine_distance_ratio'] = _ratio(
+                counts, 'fine_distances', 'coarse_distances')
+            print(u'{0:>7g}  {1:>5d}  {2:<6s}  {3:>7s}  {4:>7s}  {5:>9.4f}  '
+                  u'{6:>+9.4f}  {7:>8d}  {8:>6.1f}  {9:>7.2f}x'.format(
+                      comp['coarse_step'], comp['top_n'], experiment_type,
+                      _percent(comp['pruning_rate']),
+                      _percent(comp['fine_distance_ratio']),
+                      comp['accuracy'], comp['accuracy_gap'],
+                      comp['num_changed'], comp['test_time'],
+                      comp['exact_test_time'] / comp['test_time']))
+        report[experiment_type] = comparisons
+
+    output = args.output or os.path.join(args.data_folder, 'testing',
+                                         'coarse_search_report.json')
+    cache.atomic_dump_json(report, output, indent=4)
+    print(u'Saved {0:s}'.format(output))
+    return 0
+
+
+def _percent(ratio):
+    return '-' if ratio is None else u'{0:.1f}%'.format(100 * ratio)
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,49 @@
+import argparse
+import json
+import os
+
+from experimentation_code import fold_index
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Builds the binary fold index (DATA_FOLDER/folds.idx) '
+                    'of repeated, optionally nested, stratified k-fold, or '
+                    'converts the folds in DATA_FOLDER/folds.json.')
+    parser.add_argument('--data-folder', default=os.path.join('.', 'data'))
+    parser.add_argument('--dataset-folder', default=None,
+                        help='defaults to '
+                             'DATA_FOLDER/otmm_makam_recognition_dataset')
+    parser.add_argument('--from-json', action='store_true',
+                        help='convert DATA_FOLDER/folds.json')
+    parser.add_argument('--n-folds', type=int, default=10)
+    parser.add_argument('--seeds', type=int, nargs='+', default=[1916],
+                        help='random seed of each repetition')
+    parser.add_argument('--nested-folds', type=int, default=None,
+                        help='number of inner folds of each outer fold')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='number of processes to generate the '
+                             'repetitions with')
+    args = parser.parse_args(argv)
+
+    if args.from_json:
+        with open(os.path.join(args.data_folder, 'folds.json')) as f:
+            recordings, folds = fold_index.from_legacy(json.load(f))
+    else:
+        dataset_folder = args.dataset_folder or os.path.join(
+            args.data_folder, 'otmm_makam_recognition_dataset')
+        with open(os.path.join(dataset_folder, 'annotations.json')) as f:
+            recordings = fold_index.recording_table(json.load(f),
+                                                    dataset_folder)
+        folds = fold_index.generate(recordings, args.n_folds, args.seeds,
+                                    args.nested_folds, args.workers)
+
+    index_file = os.path.join(args.data_folder, fold_index.INDEX_FILE)
+    fold_index.save(recordings, folds, index_file)
+    print(u'{0:d} folds of {1:d} recordings saved to {2:s}'.format(
+        len(folds), len(recordings['mbids']), index_file))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,103 @@
+import argparse
+import asyncio
+import os
+
+from dlfm_code import io, sweep, trainer
+from experimentation_code import distribution, ingest, instrument
+
+
+def _number(value):
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+def get_single_model_file(save_folder, step_size, kernel_width,
+                          distribution_type):
+    # the single model of all the recordings; the models of the folds are
+    # trained again by the sweep, so that no fold is trained on the
+    # recordings it tests
+    training_folder = io.get_folder(
+        os.path.join(save_folder, 'training'), 'single', distribution_type,
+        step_size, kernel_width)
+    return os.path.join(training_folder,
+                        io.get_training_filename('single', None))
+
+
+async def _watch(ingestor, inbox, interval, once):
+    async for summary in ingest.watch(ingestor, inbox, interval, once):
+        print(u'{0:d} ingested, {1:d} skipped, {2:d} failed, {3:d} '
+              u'distributions computed, {4:d} single models updated.'.format(
+                  len(summary['ingested']), len(summary['skipped']),
+                  len(summary['failed']), summary['distributions'],
+                  summary['models_updated']))
+        for mbid, error in summary['failed'].items():
+            print(u'{0:s} failed: {1:s}'.format(mbid, error))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Watches an inbox folder for new recordings, i.e. '
+                    'NAME.json annotations with their NAME.pitch files, '
+                    'and adds them to the dataset, the pitch store and the '
+                    'feature banks, and to the single models of all the '
+                    'recordings.')
+    parser.add_argument('--data-folder', default=os.path.join('.', 'data'))
+    parser.add_argument('--dataset-folder', default=None,
+                        help='defaults to '
+                             'DATA_FOLDER/otmm_makam_recognition_dataset')
+    parser.add_argument('--pitch-store-folder', default=None,
+                        help='defaults to DATA_FOLDER/pitch_store')
+    parser.add_argument('--inbox', default=None,
+                        help='defaults to DATA_FOLDER/inbox')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of processes to compute the '
+                             'distributions with, 0 computes them in the '
+                             'main process (default: the number of CPUs)')
+    parser.add_argument('--step-sizes', type=_number, nargs='+',
+                        default=sweep.STEP_SIZES)
+    parser.add_argument('--kernel-widths', type=_number, nargs='+',
+                        default=sweep.KERNEL_WIDTHS)
+    parser.add_argument('--distribution-types', nargs='+',
+                        default=sweep.DISTRIBUTION_TYPES)
+    parser.add_argument('--no-models', action='store_true',
+                        help='do not update the single models of all the '
+                             'recordings')
+    parser.add_argument('--interval', type=float, default=1.0,
+                        help='seconds between the scans of the inbox')
+    parser.add_argument('--once', action='store_true',
+                        help='ingest the recordings in the inbox and exit')
+    parser.add_argument('--events', default=None,
+                        help='JSON lines file to append the time, CPU time, '
+                             'I/O and counts of each batch to')
+    args = parser.parse_args(argv)
+
+    dataset_folder = args.dataset_folder or os.path.join(
+        args.data_folder, 'otmm_makam_recognition_dataset')
+    pitch_store_folder = args.pitch_store_folder or os.path.join(
+        args.data_folder, 'pitch_store')
+    inbox = args.inbox or os.path.join(args.data_folder, 'inbox')
+
+    params = distribution.get_param_grid(
+        args.step_sizes, args.kernel_widths, args.distribution_types)
+    bank_folders = {(dt, ss, kw): trainer.get_feature_folder(
+        args.data_folder, ss, kw, dt) for dt, ss, kw in params}
+    model_files = {} if args.no_models else {
+        (dt, ss, kw): get_single_model_file(args.data_folder, ss, kw, dt)
+        for dt, ss, kw in params}
+    if args.events is not None:
+        instrument.configure(args.events)
+
+    with ingest.Ingestor(dataset_folder, pitch_store_folder, bank_folders,
+                         model_files, args.workers,
+                         io.get_cache_folder(args.data_folder)) as ingestor:
+        try:
+            asyncio.run(_watch(ingestor, inbox, args.interval, args.once))
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -1,6 +1,13 @@
 import os
+import json
 import numbers
 
+from experimentation_code import cache, fold_index, tonic_search
+
+# the single models are binary (see experimentation_code.single_model), the
+# multi models are the MBIDs of the training recordings
+TRAINING_EXTENSIONS = {'single': '.model', 'multi': '.json'}
+
 
 def get_folder(base_folder, *params):
     # convert numbers to string with the dot replaced with underscore
@@ -22,11 +29,54 @@ def get_training_file(save_folder, step_size, kernel_width, distribution_type,
     training_folder = get_folder(
         os.path.join(save_folder, 'training'), model_type,
         distribution_type, step_size, kernel_width)
-    fold_idx = fold_tuple[0]
-    training_file = os.path.join(training_folder,
-                                 u"fold{0:d}.json".format(fold_idx))
+    training_file = os.path.join(
+        training_folder, get_training_filename(model_type, fold_tuple[0]))
 
-    if not os.path.exists(training_folder):
-        os.makedirs(training_folder)
+    # the training tasks of the folds may run concurrently
+    os.makedirs(training_folder, exist_ok=True)
 
     return training_file
+
+
+def get_training_filename(model_type, fold_idx):
+    # a None fold_idx names the model of all the recordings in the feature
+    # bank, which the ingestion keeps up to date (see dlfm_code.ingest)
+    if fold_idx is None:
+        return u'all{0:s}'.format(TRAINING_EXTENSIONS[model_type])
+    return u'fold{0:d}{1:s}'.format(fold_idx, TRAINING_EXTENSIONS[model_type])
+
+
+def get_model_label(model_type, ann_nprobe=None, coarse_step=None,
+                    top_n=tonic_search.TOP_N):
+    # the results of the approximate and the coarse-to-fine searches are
+    # saved apart from the exact
+    label = model_type
+    if ann_nprobe is not None:
+        label += u'-ann{0:d}'.format(ann_nprobe)
+    if coarse_step is not None:
+        label += u'-coarse{0:s}top{1:d}'.format(
+            str(coarse_step).replace('.', '_'), top_n)
+    return label
+
+
+def get_ann_filename(dis_measure):
+    return u'ann--{0:s}.idx'.format(dis_measure)
+
+
+def get_cache_folder(save_folder):
+    return os.path.join(save_folder, 'cache')
+
+
+def get_cache(save_folder):
+    # manifest of the valid artifacts in the save folder
+    return cache.ResultCache(get_cache_folder(save_folder))
+
+
+def load_folds(save_folder):
+    # the outer folds in the format of folds.json; from the binary fold
+    # index if it is built (see dlfm_code.folds)
+    index_file = os.path.join(save_folder, fold_index.INDEX_FILE)
+    if os.path.exists(index_file):
+        return fold_index.FoldIndex(index_file).legacy_folds()
+    with open(os.path.join(save_folder, 'folds.json')) as f:
+        return json.load(f)
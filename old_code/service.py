@@ -0,0 +1,78 @@
+import argparse
+import functools
+import json
+import os
+
+from dlfm_code import tester
+from experimentation_code import service
+
+# the model of all the recordings in the feature bank is served, if the
+# config has no fold or a null fold
+MODEL_PARAMS = ['model_type', 'distribution_type', 'step_size',
+                'kernel_width']
+
+
+def _number(value):
+    # the folder names have 0 kernel width but 15_0 step size
+    value = float(value)
+    return 0 if value == 0 else value
+
+
+def load_model(save_folder, shift_table, config):
+    missing = set(MODEL_PARAMS).difference(config)
+    if missing:
+        raise KeyError(u'The model config misses {0:s}'.format(
+            ', '.join(sorted(missing))))
+    model, _ = tester.load_model(
+        save_folder, config['model_type'], config['distribution_type'],
+        _number(config['step_size']), _number(config['kernel_width']),
+        None if config.get('fold') is None else int(config['fold']),
+        shift_table)
+    return model
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Serves the mode, tonic and joint estimates of the '
+                    'trained models over HTTP.')
+    parser.add_argument('--data-folder', default=os.path.join('.', 'data'))
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--socket', default=None,
+                        help='path of a Unix socket to serve on instead of '
+                             'the host and port')
+    parser.add_argument('--capacity', type=int, default=4,
+                        help='number of models kept in memory')
+    parser.add_argument('--preload', default=None,
+                        help='JSON file with the list of the model configs '
+                             'to load on start')
+    parser.add_argument('--max-batch', type=int, default=64)
+    parser.add_argument('--max-delay', type=float, default=0.002,
+                        help='seconds to wait for concurrent requests to '
+                             'score in the same batch')
+    parser.add_argument('--shift-table', action='store_true')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args(argv)
+
+    recognizer = service.Recognizer(
+        functools.partial(load_model, args.data_folder, args.shift_table),
+        capacity=args.capacity, max_batch=args.max_batch,
+        max_delay=args.max_delay)
+    if args.preload is not None:
+        recognizer.warm(json.load(open(args.preload)))
+
+    address = args.socket or (args.host, args.port)
+    server = service.make_server(recognizer, address, verbose=args.verbose)
+    print(u'Serving on {0}'.format(address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        recognizer.close()
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
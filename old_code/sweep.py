@@ -0,0 +1,314 @@
+import argparse
+import collections
+import functools
+import itertools
+import json
+import os
+
+from dlfm_code import io, tester, trainer
+from experimentation_code import cache, distance, distribution, \
+    instrument, pitch_store, scheduler
+
+STEP_SIZES = [7.5, 15.0, 25.0, 50.0, 100.0]
+KERNEL_WIDTHS = [0, 7.5, 15.0, 25.0, 50.0, 100.0]
+DISTRIBUTION_TYPES = ['pd', 'pcd']
+MODEL_TYPES = ['single', 'multi']
+EXPERIMENT_TYPES = ['tonic', 'mode', 'joint']
+K_NEIGHBORS = [1, 3, 5, 10, 15]
+MIN_PEAK_RATIOS = [0.15]
+
+
+def _is_cached(result_cache, keys):
+    return all(key in result_cache for key in keys)
+
+
+def _run_cached(cache_folder, artifacts, kind, func, *args):
+    # the artifacts are overwritten at their paths, hence their previous keys
+    # are invalid until the task is completed
+    for _, params in artifacts:
+        cache.invalidate(cache_folder, kind, params)
+    result = func(*args)
+    for key, params in artifacts:
+        cache.record(cache_folder, key, kind, params)
+    return result
+
+
+def _is_stored(pitch_store_folder, pitch_hashes):
+    # the store has the current track of each recording
+    stored = pitch_store.get_source_hashes(pitch_store_folder)
+    return all(stored.get(mbid) == pitch_hash
+               for mbid, pitch_hash in pitch_hashes.items())
+
+
+def _test(inputs_key, *args):
+    # an interrupted fold resumes from its results log, unless its inputs
+    # changed
+    res_dict = tester.test(*args, inputs_key=inputs_key)
+    if isinstance(res_dict, dict) and res_dict['failed']:
+        raise RuntimeError(u'{0:d} samples failed.'.format(
+            len(res_dict['failed'])))
+    return res_dict
+
+
+def _config(distribution_type, step_size, kernel_width, **kwargs):
+    config = {'distribution_type': distribution_type,
+              'step_size': step_size, 'kernel_width': kernel_width}
+    config.update(kwargs)
+    return config
+
+
+def build_graph(annotations, folds, dataset_folder, save_folder,
+                step_sizes=STEP_SIZES, kernel_widths=KERNEL_WIDTHS,
+                distribution_types=DISTRIBUTION_TYPES,
+                model_types=MODEL_TYPES, experiment_types=EXPERIMENT_TYPES,
+                dis_measures=distance.DISTANCE_MEASURES,
+                k_neighbors=K_NEIGHBORS, min_peak_ratios=MIN_PEAK_RATIOS,
+                rank=1, overwrite=False, pitch_store_folder=None):
+    # the combinations in which kernel_width is three times less than the
+    # step_size are ignored
+    params = distribution.get_param_grid(step_sizes, kernel_widths,
+                                         distribution_types)
+    graph = scheduler.TaskGraph()
+
+    # each artifact is keyed on its parameters and the keys or the content
+    # hashes of its inputs; the tasks, whose keys are in the cache manifest,
+    # are skipped. the other tasks overwrite their stale outputs
+    result_cache = io.get_cache(save_folder)
+    artifact_params = {}
+
+    def artifact_key(kind, params, inputs):
+        key = cache.artifact_key(kind, params, inputs)
+        artifact_params[key] = params
+        return key
+
+    def add_task(task_key, kind, artifact_keys, func, args, deps,
+                 group=None):
+        artifacts = [(key, artifact_params[key]) for key in artifact_keys]
+        graph.add(
+            task_key, _run_cached,
+            (result_cache.cache_folder, artifacts, kind, func) + args,
+            deps=deps, is_done=None if overwrite else functools.partial(
+                _is_cached, result_cache, artifact_keys), group=group)
+
+    pitch_hashes = {pitch_store.get_mbid(anno): result_cache.hash_input(
+        pitch_store.get_pitch_file(anno, dataset_folder))
+        for anno in annotations}
+
+    # pitch store; the changed pitch tracks are converted again
+    store_deps = []
+    if pitch_store_folder is not None:
+        store_deps = [graph.add(
+            ('pitch_store',), pitch_store.build,
+            (annotations, dataset_folder, pitch_store_folder, overwrite,
+             pitch_hashes), is_done=None if overwrite else functools.partial(
+                 _is_stored, pitch_store_folder, pitch_hashes))]
+
+    # feature extraction; all the distributions of a recording in one task
+    feature_keys = {}
+    for anno in annotations:
+        mbid = pitch_store.get_mbid(anno)
+        inputs = [pitch_hashes[mbid], cache.hash_obj(anno)]
+        for param in params:
+            feature_keys[mbid, param] = artifact_key(
+                'features', _config(*param, mbid=mbid), inputs)
+        add_task(('features', mbid), 'features',
+                 [feature_keys[mbid, param] for param in params],
+                 trainer.compute_recording_distributions_grid,
+                 (step_sizes, kernel_widths, distribution_types, anno,
+                  dataset_folder, save_folder, True, pitch_store_folder),
+                 store_deps)
+
+    test_pitch_hashes = {fold_idx: cache.hash_obj(
+        [pitch_hashes[ts['source']] for ts in fold['testing']])
+        for fold_idx, fold in folds}
+    test_keys = collections.defaultdict(list)
+    # the training and the testing tasks of a configuration share the
+    # feature bank and the models, hence they are routed to the same worker
+    for param, model_type in itertools.product(params, model_types):
+        distribution_type, step_size, kernel_width = param
+        training_artifacts = {fold_idx: artifact_key(
+            'training', _config(*param, model_type=model_type,
+                                fold=fold_idx),
+            [cache.hash_obj(fold)] + [feature_keys[mbid, param] for mbid in
+                                      fold['training']['sources']])
+            for fold_idx, fold in folds}
+
+        # the single models of all folds are trained in one reduction over
+        # the feature bank; the multi models start as soon as the features
+        # of their fold are computed
+        if model_type == 'single':
+            training_key = ('training', model_type) + param
+            training_keys = dict.fromkeys(training_artifacts, training_key)
+            add_task(training_key, 'training',
+                     list(training_artifacts.values()),
+                     trainer.train_single_folds,
+                     (step_size, kernel_width, distribution_type, folds,
+                      save_folder, True),
+                     [('features', mbid) for mbid in sorted(set(
+                         mbid for _, fold in folds
+                         for mbid in fold['training']['sources']))], param)
+        else:
+            training_keys = {}
+            for fold_idx, fold in folds:
+                training_keys[fold_idx] = ('training', model_type) + param + \
+                    (fold_idx,)
+                add_task(training_keys[fold_idx], 'training',
+                         [training_artifacts[fold_idx]], trainer.train_multi,
+                         (step_size, kernel_width, distribution_type,
+                          [fold_idx, fold], save_folder, True),
+                         [('features', mbid)
+                          for mbid in fold['training']['sources']], param)
+
+        for fold_idx, fold in folds:
+            training_key = training_keys[fold_idx]
+            training_artifact = training_artifacts[fold_idx]
+
+            # testing
+            for experiment_type, dis_measure, k_neighbor, min_peak_ratio in \
+                    itertools.product(experiment_types, dis_measures,
+                                      k_neighbors, min_peak_ratios):
+                experiment = (experiment_type, model_type) + param + (
+                    dis_measure, k_neighbor, min_peak_ratio)
+                test_artifact = artifact_key(
+                    'testing', _config(
+                        *param, model_type=model_type,
+                        experiment_type=experiment_type,
+                        dis_measure=dis_measure, k_neighbor=k_neighbor,
+                        min_peak_ratio=min_peak_ratio, rank=rank,
+                        fold=fold_idx),
+                    [training_artifact, test_pitch_hashes[fold_idx]])
+                test_keys[experiment].append(test_artifact)
+                add_task(('testing',) + experiment + (fold_idx,), 'testing',
+                         [test_artifact], _test,
+                         (test_artifact, step_size, kernel_width,
+                          distribution_type, model_type, fold_idx,
+                          experiment_type, dis_measure, k_neighbor,
+                          min_peak_ratio, rank, save_folder, overwrite,
+                          pitch_store_folder),
+                         [training_key] + store_deps, param)
+
+    # evaluation starts as soon as all the folds of an experiment are tested
+    annotation_hash = cache.hash_obj(annotations)
+    evaluation_keys = []
+    for experiment, keys in test_keys.items():
+        experiment_type, model_type, distribution_type, step_size, \
+            kernel_width, dis_measure, k_neighbor, min_peak_ratio = experiment
+        evaluation_artifact = artifact_key(
+            'evaluation', dict(zip(
+                ['experiment_type', 'model_type', 'distribution_type',
+                 'step_size', 'kernel_width', 'dis_measure', 'k_neighbor',
+                 'min_peak_ratio'], experiment)), keys + [annotation_hash])
+        add_task(('evaluation',) + experiment, 'evaluation',
+                 [evaluation_artifact], tester.evaluate,
+                 (step_size, kernel_width, distribution_type, model_type,
+                  experiment_type, dis_measure, k_neighbor, min_peak_ratio,
+                  save_folder, os.path.join(dataset_folder,
+                                            'annotations.json')),
+                 [('testing',) + experiment + (fold_idx,)
+                  for fold_idx, _ in folds])
+        evaluation_keys.append(evaluation_artifact)
+
+    # summary of all the experiments
+    if test_keys:
+        add_task(('summary',), 'summary',
+                 [artifact_key('summary', {}, evaluation_keys)],
+                 tester.summarize,
+                 (save_folder, os.path.join(dataset_folder,
+                                            'annotations.json')),
+                 [('evaluation',) + experiment for experiment in test_keys])
+
+    return graph
+
+
+def _number(value):
+    # keep the integers as in the folder names, e.g. 0 kernel width
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+def _print_result(progress, key, result):
+    print(progress.update(key, result.status))
+    if result.status == scheduler.FAILED:
+        print(u'    {0!r}'.format(result.value))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Runs the feature extraction, training, testing and '
+                    'evaluation of the parameter sweep on a local process '
+                    'pool.')
+    parser.add_argument('--data-folder', default=os.path.join('.', 'data'))
+    parser.add_argument('--dataset-folder', default=None,
+                        help='defaults to '
+                             'DATA_FOLDER/otmm_makam_recognition_dataset')
+    parser.add_argument('--pitch-store-folder', default=None,
+                        help='defaults to DATA_FOLDER/pitch_store')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of processes, 0 runs in the main '
+                             'process (default: the number of CPUs)')
+    parser.add_argument('--step-sizes', type=_number, nargs='+',
+                        default=STEP_SIZES)
+    parser.add_argument('--kernel-widths', type=_number, nargs='+',
+                        default=KERNEL_WIDTHS)
+    parser.add_argument('--distribution-types', nargs='+',
+                        default=DISTRIBUTION_TYPES)
+    parser.add_argument('--model-types', nargs='+', default=MODEL_TYPES)
+    parser.add_argument('--experiment-types', nargs='*',
+                        default=EXPERIMENT_TYPES,
+                        help='no value runs only feature extraction and '
+                             'training')
+    parser.add_argument('--dis-measures', nargs='+',
+                        default=list(distance.DISTANCE_MEASURES))
+    parser.add_argument('--k-neighbors', type=int, nargs='+',
+                        default=K_NEIGHBORS)
+    parser.add_argument('--min-peak-ratios', type=_number, nargs='+',
+                        default=MIN_PEAK_RATIOS)
+    parser.add_argument('--overwrite', action='store_true')
+    parser.add_argument('--events', default=None,
+                        help='JSON lines file to append the time, CPU time, '
+                             'I/O and counts of each stage to')
+    parser.add_argument('--profile-interval', type=float, default=None,
+                        help='seconds between the stack samples of the '
+                             'stages, which are added to the events')
+    args = parser.parse_args(argv)
+
+    dataset_folder = args.dataset_folder or os.path.join(
+        args.data_folder, 'otmm_makam_recognition_dataset')
+    pitch_store_folder = args.pitch_store_folder or os.path.join(
+        args.data_folder, 'pitch_store')
+    annotations = json.load(open(os.path.join(dataset_folder,
+                                              'annotations.json')))
+    folds = io.load_folds(args.data_folder)
+
+    graph = build_graph(
+        annotations, folds, dataset_folder, args.data_folder,
+        step_sizes=args.step_sizes, kernel_widths=args.kernel_widths,
+        distribution_types=args.distribution_types,
+        model_types=args.model_types,
+        experiment_types=args.experiment_types,
+        dis_measures=args.dis_measures, k_neighbors=args.k_neighbors,
+        min_peak_ratios=args.min_peak_ratios, overwrite=args.overwrite,
+        pitch_store_folder=pitch_store_folder)
+    if args.events is not None:
+        instrument.configure(args.events, args.profile_interval)
+    progress = instrument.Progress(len(graph))
+    results = scheduler.run(graph, args.workers, callback=functools.partial(
+        _print_result, progress))
+    io.get_cache(args.data_folder).compact()
+    if args.events is not None:  # the stages of this run
+        print(instrument.report(instrument.summarize(
+            e for e in instrument.read_events(args.events)
+            if e.get('start', 0) >= progress.started)))
+
+    num_failed = sum(r.status in (scheduler.FAILED, scheduler.CANCELLED)
+                     for r in results.values())
+    num_skipped = sum(r.status == scheduler.SKIPPED for r in results.values())
+    print(u'{0:d} tasks, {1:d} skipped, {2:d} failed or cancelled.'.format(
+        len(results), num_skipped, num_failed))
+    return 1 if num_failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -1,364 +1,614 @@
 from __future__ import division
-from fileoperations.fileoperations import get_filenames_in_dir
-from morty.pitchdistribution import PitchDistribution
-from morty.evaluator import Evaluator
-from morty.converter import Converter
-from matplotlib import pyplot as plt
 from dlfm_code import io
-from morty.classifiers.knnclassifier import KNNClassifier
+from experimentation_code import ann, cache, distribution, evaluation, \
+    feature_bank, fold_index, instrument, knn, lru, pitch_store, \
+    results_log, single_model, tonic_search
+import collections
 import os
 import json
 import numpy as np
-import copy
 import shutil
-from sklearn.metrics import confusion_matrix
+import time
 
 
+@instrument.staged('test', 'experiment_type', 'model_type',
+                   'distribution_type', 'step_size', 'kernel_width',
+                   'dis_measure', 'k_neighbor', 'min_peak_ratio', 'fold_idx')
 def test(step_size, kernel_width, distribution_type,
          model_type, fold_idx, experiment_type, dis_measure, k_neighbor,
-         min_peak_ratio, rank, save_folder, overwrite=False):
+         min_peak_ratio, rank, save_folder, overwrite=False,
+         pitch_store_folder=None, shift_table=False, ann_nprobe=None,
+         coarse_step=None, top_n=tonic_search.TOP_N, inputs_key=None):
 
-    # file to save the results
+    if ann_nprobe is not None and model_type != 'multi':
+        raise ValueError('The ANN index is built for the multi models')
+    if coarse_step is not None and experiment_type == 'mode':
+        raise ValueError('The coarse-to-fine search is for the tonic and the '
+                         'joint experiments')
+
+    # MBIDs of the test samples by status
     res_dict = {'saved': [], 'failed': [], 'skipped': []}
     test_folder = os.path.abspath(os.path.join(io.get_folder(
-        os.path.join(save_folder, 'testing', experiment_type), model_type,
+        os.path.join(save_folder, 'testing', experiment_type),
+        io.get_model_label(model_type, ann_nprobe, coarse_step, top_n),
         distribution_type, step_size, kernel_width, dis_measure,
         k_neighbor, min_peak_ratio), 'fold{0:d}'.format(fold_idx)))
-    results_file = os.path.join(test_folder, 'results.json')
-    if not os.path.exists(test_folder):
-        os.makedirs(test_folder)
-    else:
-        if overwrite:
-            shutil.rmtree(test_folder, ignore_errors=True)
-            os.makedirs(test_folder)
-        elif os.path.exists(results_file):
-            return u"{0:s} already has results.".format(test_folder)
+    results_file = os.path.join(test_folder, results_log.RESULTS_FILE)
+    if overwrite:
+        shutil.rmtree(test_folder, ignore_errors=True)
+    os.makedirs(test_folder, exist_ok=True)
+
+    # the results are appended to a log, which is read on restart to skip
+    # the saved samples. the results of other inputs_key, e.g. of a model
+    # trained again, are dropped
+    log = results_log.ResultsLog(test_folder, inputs_key)
+    if os.path.exists(results_file):
+        return u"{0:s} already has results.".format(test_folder)
 
     # load fold
-    fold_file = os.path.join(save_folder, 'folds.json')
-    folds = json.load(open(fold_file))
-    test_fold = []
-    for f in folds:
-        if f[0] == fold_idx:
-            test_fold = f[1]['testing']
-            break
+    test_fold = _load_test_fold(save_folder, fold_idx)
 
     assert len(test_fold) == 100, "There should be 100 samples in the test " \
                                   "fold"
 
     # load training model
-    training_folder = os.path.abspath(io.get_folder(
-        os.path.join(save_folder, 'training'), model_type,
-        distribution_type, step_size, kernel_width))
-
-    model_file = os.path.join(training_folder,
-                              u'fold{0:d}.json'.format(fold_idx))
-    model = json.load(open(model_file))
-    # instantiate the PitchDistributions
-    for i, m in enumerate(model):
-        try:  # filepath given
-            model[i] = json.load(open(os.path.join(save_folder, m)))
-        except (TypeError, AttributeError):  # dict already loaded
-            assert isinstance(m['feature'], dict), "Unknown model."
-        model[i]['feature'] = PitchDistribution.from_dict(
-            model[i]['feature'])
-        try:
-            if any(test_sample['source'] in model[i]['sources']
-                   for test_sample in test_fold):
-                raise RuntimeError('Test data uses training data!')
-        except KeyError:
-            if any(test_sample['source'] == model[i]['source']
-                   for test_sample in test_fold):
-                raise RuntimeError('Test data uses training data!')
-
+    model, model_sources = load_model(
+        save_folder, model_type, distribution_type, step_size, kernel_width,
+        fold_idx, shift_table)
+    if ann_nprobe is not None:
+        model = model.with_ann(
+            load_ann_index(save_folder, distribution_type, step_size,
+                           kernel_width, dis_measure), ann_nprobe)
+    if coarse_step is not None:
+        model = model.with_coarse_search(coarse_step, top_n)
+    if model_sources.intersection(ts['source'] for ts in test_fold):
+        raise RuntimeError('Test data uses training data!')
+
+    # gather the test samples, which are not tested yet
+    pending = []
     for test_sample in test_fold:
         # get MBID from pitch file
         mbid = test_sample['source']
-        save_file = os.path.join(test_folder, u'{0:s}.json'.format(mbid))
-        if not overwrite and os.path.exists(save_file):
-            res_dict['skipped'].append(save_file)
+        if mbid in log.saved:
+            res_dict['skipped'].append(mbid)
             continue
 
-        # instantiate the classifier and evaluator object
-        classifier = KNNClassifier(
-            step_size=step_size, kernel_width=kernel_width,
-            feature_type=distribution_type, model=copy.deepcopy(model))
-
-        # if the model_type is multi and the test data is in the model,
-        # remove it
-        if model_type == 'multi':
-            for i, m in enumerate(classifier.model):
-                if mbid in m:
-                    del classifier.model[i]
-                    break
-
         try:
             # we use the pitch instead of the distribution already computed in
             # the feature extraction. those distributions are normalized wrt
             # tonic to one of the bins centers will exactly correspond to
             # the tonic freq. therefore it would be cheating
-            pitch = np.loadtxt(test_sample['pitch'])
-            if experiment_type == 'tonic':  # tonic identification
-                results = classifier.estimate_tonic(
-                    pitch, test_sample['mode'], min_peak_ratio=min_peak_ratio,
-                    distance_method=dis_measure, k_neighbor=k_neighbor,
-                    rank=rank)
-            elif experiment_type == 'mode':  # mode recognition
-                results = classifier.estimate_mode(
-                    pitch, test_sample['tonic'], distance_method=dis_measure,
-                    k_neighbor=k_neighbor, rank=rank)
-            elif experiment_type == 'joint':  # joint estimation
-                results = classifier.estimate_joint(
-                    pitch, min_peak_ratio=min_peak_ratio,
-                    distance_method=dis_measure, k_neighbor=k_neighbor,
-                    rank=rank)
+            if pitch_store_folder is None:
+                pitch = np.loadtxt(test_sample['pitch'])
             else:
-                raise ValueError("Unknown experiment_type")
+                pitch = pitch_store.load(pitch_store_folder)[mbid]
+            pending.append((test_sample, pitch))
+        except Exception as err:
+            log.append_failure(mbid, repr(err))
+            res_dict['failed'].append(mbid)
+
+    # score all the test samples of the fold in a single call. if it fails,
+    # score the samples one by one to isolate the failing samples
+    errors = [None] * len(pending)
+    try:
+        estimates = _estimate(model, model_type, experiment_type, pending,
+                              dis_measure, k_neighbor, min_peak_ratio, rank)
+    except Exception:
+        estimates = []
+        for i, p in enumerate(pending):
+            try:
+                estimates += _estimate(
+                    model, model_type, experiment_type, [p], dis_measure,
+                    k_neighbor, min_peak_ratio, rank)
+            except Exception as err:
+                estimates.append(None)
+                errors[i] = repr(err)
+
+    for (test_sample, _), results, error in zip(pending, estimates, errors):
+        if results is None:
+            log.append_failure(test_sample['source'], error)
+            res_dict['failed'].append(test_sample['source'])
+        else:  # save results
+            log.append(test_sample['source'], results)
+            res_dict['saved'].append(test_sample['source'])
+
+    instrument.add(models_read=1, pitch_tracks_read=len(pending),
+                   samples=len(pending), failed=len(res_dict['failed']))
+    if not res_dict['failed']:
+        assert len(log.saved) == 100, 'There should have been 100 tested ' \
+                                      'samples.'
+        log.finalize()
+    return res_dict
 
-            # save results
-            json.dump(results, open(save_file, 'w'))
-            res_dict['saved'].append(save_file)
-        except:
-            res_dict['failed'].append(save_file)
 
-    if not res_dict['failed']:
-        computed = get_filenames_in_dir(test_folder, keyword='*.json')[0]
-        assert len(computed) == 100, 'There should have been 100 tested files.'
+# bounded per-process caches; a worker serves all the cheap parameter
+# variants (dis_measure, k_neighbor, min_peak_ratio) of a configuration
+# with a single load of the folds and the model
+MAX_CACHED_FILES = 16
+MAX_CACHED_BANK_MODELS = 4
+_FILES = lru.LRUCache(MAX_CACHED_FILES)
+_BANK_MODELS = lru.LRUCache(MAX_CACHED_BANK_MODELS)
 
-        results = {}
-        for c in computed:
-            mbid = os.path.splitext(os.path.split(c)[-1])[0]
-            results[mbid] = json.load(open(c))
 
-        json.dump(results, open(results_file, 'w'), indent=4)
-        for c in computed:
-            os.remove(c)
-    return res_dict
+def _load_cached(path, load, *args):
+    # reloaded only if the file changes
+    stat = os.stat(path)
+    return _FILES.get((path, stat.st_size, stat.st_mtime_ns) + args,
+                      lambda: load(path, *args))
 
 
-def evaluate(step_size, kernel_width, distribution_type, model_type,
-             experiment_type, dis_measure, k_neighbor, min_peak_ratio,
-             result_folder):
-    test_folder = os.path.abspath(os.path.join(io.get_folder(
-        os.path.join(result_folder, 'testing', experiment_type), model_type,
-        distribution_type, step_size, kernel_width, dis_measure,
-        k_neighbor, min_peak_ratio)))
-    result_files = get_filenames_in_dir(test_folder,
-                                        keyword='*results.json')[0]
-
-    anno_file = './data/otmm_makam_recognition_dataset' \
-                '/annotations.json'
-    annotations = json.load(open(anno_file))
-    makam_labels = np.unique([a['makam'] for a in annotations]).tolist()
-    evaluator = Evaluator()
-
-    tmp_bins = np.arange(0, 1200, step_size)
-    if experiment_type == 'tonic':
-        eval_folds = {'num_correct_tonic': 0, 'tonic_accuracy': 0,
-                      'tonic_deviation_distribution': PitchDistribution(
-                          tmp_bins, np.zeros(np.shape(tmp_bins)),
-                          kernel_width=0, ref_freq=None)}
-    elif experiment_type == 'mode':
-        eval_folds = {'num_correct_mode': 0, 'mode_accuracy': 0,
-                      'confusion_matrix': {
-                          'matrix': np.zeros((len(makam_labels),
-                                              len(makam_labels))),
-                          'labels': makam_labels}
-                      }
-    else:
-        eval_folds = {'num_correct_tonic': 0, 'tonic_accuracy': 0,
-                      'num_correct_mode': 0, 'mode_accuracy': 0,
-                      'num_correct_joint': 0, 'joint_accuracy': 0,
-                      'tonic_deviation_distribution': PitchDistribution(
-                          tmp_bins, np.zeros(np.shape(tmp_bins)),
-                          kernel_width=0, ref_freq=None),
-                      'confusion_matrix': {
-                          'matrix': np.zeros((len(makam_labels),
-                                              len(makam_labels))),
-                          'labels': makam_labels}
-                      }
-
-    for rf in result_files:
-        res = json.load(open(rf))
-        eval_file = os.path.join(os.path.dirname(rf), 'evaluation.json')
-
-        rec_ev = []
-        for aa in annotations:
-            mbid = os.path.split(aa['mbid'])[-1]
-
-            if mbid in res.keys():  # in testing data
-                if experiment_type == 'tonic':
-                    rec_ev.append(evaluator.evaluate_tonic(res[mbid][0][0],
-                                                           aa['tonic'], mbid))
-                    rec_ev[-1]['tonic_eval'] = rec_ev[-1]['tonic_eval'].\
-                        tolist()
-                    rec_ev[-1]['same_octave'] = rec_ev[-1]['same_octave'].\
-                        tolist()
+def _read_json(path):
+    with open(path) as f:
+        return json.load(f)
 
-                elif experiment_type == 'mode':
-                    rec_ev.append(evaluator.evaluate_mode(res[mbid][0][0],
-                                                          aa['makam'], mbid))
 
-                else:
-                    rec_ev.append(evaluator.evaluate_joint(
-                        [res[mbid][0][0][0], aa['tonic']],
-                        [res[mbid][0][0][1], aa['makam']], mbid))
-
-                    rec_ev[-1]['tonic_eval'] = rec_ev[-1]['tonic_eval'].\
-                        tolist()
-                    rec_ev[-1]['same_octave'] = rec_ev[-1]['same_octave'].\
-                        tolist()
-                    try:
-                        rec_ev[-1]['joint_eval'] = rec_ev[-1]['joint_eval'].\
-                            tolist()
-                    except AttributeError:
-                        # TODO: find out why i've put an exception here
-                        pass
-
-        ev = {'per_recording': rec_ev, 'overall': {}}
-        try:
-            ev['overall']['num_correct_tonic'] = sum(re['tonic_eval']
-                                                     for re in rec_ev)
-            ev['overall']['tonic_accuracy'] = (
-                ev['overall']['num_correct_tonic'] / len(rec_ev))
-
-            ev['overall']['tonic_deviation_distribution'] = \
-                PitchDistribution.from_cent_pitch(
-                    [re['cent_diff'] for re in rec_ev], ref_freq=None,
-                    step_size=step_size, kernel_width=0)
-
-            try:  # force to pcd
-                ev['overall']['tonic_deviation_distribution'].to_pcd()
-            except AssertionError:
-                pass
-
-            eval_folds['num_correct_tonic'] += ev['overall'][
-                'num_correct_tonic']
-            eval_folds['tonic_deviation_distribution'].vals +=\
-                ev['overall']['tonic_deviation_distribution'].vals
-
-            ev['overall']['tonic_deviation_distribution'] = \
-                ev['overall']['tonic_deviation_distribution'].to_dict()
-        except KeyError:
-            pass
-        try:
-            ev['overall']['num_correct_mode'] = sum(re['mode_eval']
-                                                    for re in rec_ev)
-            ev['overall']['mode_accuracy'] = (
-                ev['overall']['num_correct_mode'] / len(rec_ev))
+def _load_test_fold(save_folder, fold_idx):
+    # only the rows of the fold are read from the binary fold index
+    index_file = os.path.abspath(os.path.join(save_folder,
+                                              fold_index.INDEX_FILE))
+    if os.path.exists(index_file):
+        return _load_cached(index_file, fold_index.FoldIndex).testing(
+            fold_idx)
 
-            ev['overall']['confusion_matrix'] = {
-                'matrix': confusion_matrix(
-                    [re['annotated_mode'] for re in rec_ev],
-                    [re['estimated_mode'] for re in rec_ev],
-                    labels=makam_labels),
-                'labels': makam_labels}
+    fold_file = os.path.join(save_folder, 'folds.json')
+    folds = _load_cached(os.path.abspath(fold_file), _read_json)
+    for f in folds:
+        if f[0] == fold_idx:
+            return f[1]['testing']
+    return []
 
-            eval_folds['num_correct_mode'] += ev['overall'][
-                'num_correct_mode']
 
-            eval_folds['confusion_matrix']['matrix'] +=\
-                ev['overall']['confusion_matrix']['matrix']
+def _get_bank_model(bank, shift_table=False):
+    # the model is rebuilt only if the bank is reopened, e.g. it has grown
+    key = (bank.bank_folder, shift_table)
+    cached = _BANK_MODELS.peek(key)
+    if cached is not None and cached[0] is not bank:
+        _BANK_MODELS.put(key, (bank, knn.KNNModel.from_bank(
+            bank, shift_table=shift_table)))
+    return _BANK_MODELS.get(key, lambda: (bank, knn.KNNModel.from_bank(
+        bank, shift_table=shift_table)))[1]
 
-            ev['overall']['confusion_matrix']['matrix'] = \
-                ev['overall']['confusion_matrix']['matrix'].astype(int).tolist()
 
-        except KeyError:
-            pass
-        try:
-            ev['overall']['num_correct_joint'] = sum(re['joint_eval']
-                                                     for re in rec_ev)
-            ev['overall']['joint_accuracy'] = (
-                ev['overall']['num_correct_joint'] / len(rec_ev))
-
-            eval_folds['num_correct_joint'] += ev['overall'][
-                'num_correct_joint']
-        except KeyError:
-            pass
-
-        json.dump(ev, open(eval_file, 'w'))
-
-    if experiment_type == 'tonic':
-        eval_folds['tonic_accuracy'] = eval_folds['num_correct_tonic'] / 10
-        eval_folds['tonic_deviation_distribution'] = \
-            eval_folds['tonic_deviation_distribution'].to_dict()
-    elif experiment_type == 'mode':
-        eval_folds['mode_accuracy'] = eval_folds['num_correct_mode'] / 10
-        eval_folds['confusion_matrix']['matrix'] = \
-            eval_folds['confusion_matrix']['matrix'].astype(int).tolist()
+def load_ann_index(save_folder, distribution_type, step_size, kernel_width,
+                   dis_measure):
+    # the ANN index of the multi model of the whole feature bank is saved
+    # next to the multi models; it is rebuilt if the bank has grown
+    training_folder = os.path.abspath(io.get_folder(
+        os.path.join(save_folder, 'training'), 'multi', distribution_type,
+        step_size, kernel_width))
+    bank = feature_bank.load(os.path.abspath(io.get_folder(
+        os.path.join(save_folder, 'features'), distribution_type, step_size,
+        kernel_width)))
+    model = _get_bank_model(bank)
+    index_file = os.path.join(training_folder,
+                              io.get_ann_filename(dis_measure))
+    if os.path.exists(index_file):
+        index = _load_cached(index_file, ann.IVFIndex.load)
+        if index.num_rows == len(model):
+            return index
+    index = ann.IVFIndex.build(model.vals, dis_measure)
+    os.makedirs(training_folder, exist_ok=True)
+    index.save(index_file)
+    instrument.add(ann_indices_built=1)
+    return index
+
+
+def _load_single_model(model_file, distribution_type, step_size,
+                       kernel_width, shift_table):
+    return _to_knn_model(single_model.load(model_file), distribution_type,
+                         step_size, kernel_width, shift_table)
+
+
+def _to_knn_model(model, distribution_type, step_size, kernel_width,
+                  shift_table):
+    model_sources = set(src for srcs in model.sources for src in srcs)
+    return knn.KNNModel(
+        model.vals, model.modes, model.modes, model.bins, distribution_type,
+        step_size, kernel_width, shift_table=shift_table), model_sources
+
+
+def _load_json_single_model(model_file, distribution_type, step_size,
+                            kernel_width, shift_table):
+    model = _read_json(model_file)
+    features = [distribution.from_dict(m['feature']) for m in model]
+    model_sources = set(src for m in model for src in m['sources'])
+    return knn.KNNModel(
+        [f.vals for f in features], [m['mode'] for m in model],
+        [m['mode'] for m in model], features[0].bins, distribution_type,
+        step_size, kernel_width, shift_table=shift_table), model_sources
+
+
+def load_model(save_folder, model_type, distribution_type, step_size,
+               kernel_width, fold_idx, shift_table=False):
+    training_folder = os.path.abspath(io.get_folder(
+        os.path.join(save_folder, 'training'), model_type,
+        distribution_type, step_size, kernel_width))
+    model_file = os.path.join(
+        training_folder, io.get_training_filename(model_type, fold_idx))
+
+    # a None fold_idx loads the model of all the recordings in the feature
+    # bank, e.g. to recognize new recordings
+    if fold_idx is None:
+        bank_folder = os.path.abspath(io.get_folder(
+            os.path.join(save_folder, 'features'), distribution_type,
+            step_size, kernel_width))
+        bank = feature_bank.load(bank_folder)
+        if model_type == 'multi':
+            return _get_bank_model(bank, shift_table), set(bank.mbids)
+        # the single model of the ingestion, unless a row of the bank is
+        # written after it
+        if os.path.exists(model_file) and \
+                os.stat(model_file).st_mtime_ns >= os.stat(os.path.join(
+                    bank_folder, feature_bank.RECORD_FILE)).st_mtime_ns:
+            return _load_cached(model_file, _load_single_model,
+                                distribution_type, step_size, kernel_width,
+                                shift_table)
+        return _to_knn_model(
+            single_model.train_folds(bank, [bank.mbids.tolist()])[0],
+            distribution_type, step_size, kernel_width, shift_table)
+
+    # load the model once into read-only arrays, which are shared by all the
+    # test samples
+    if model_type == 'multi':  # MBIDs of the recordings in the feature bank
+        model_mbids = _load_cached(model_file, _read_json)
+        bank = feature_bank.load(os.path.abspath(io.get_folder(
+            os.path.join(save_folder, 'features'), distribution_type,
+            step_size, kernel_width)))
+        # all the folds share a model of the whole bank; the rows out of
+        # the training set of the fold are masked
+        model = _get_bank_model(bank, shift_table).masked(
+            bank.mask(model_mbids))
+        return model, set(model_mbids)
+    if os.path.exists(model_file):  # a row per mode in a single array
+        return _load_cached(model_file, _load_single_model,
+                            distribution_type, step_size, kernel_width,
+                            shift_table)
+    # JSON models, e.g. in the Zenodo data
+    return _load_cached(
+        os.path.join(training_folder, u'fold{0:d}.json'.format(fold_idx)),
+        _load_json_single_model, distribution_type, step_size, kernel_width,
+        shift_table)
+
+
+def _estimate(model, model_type, experiment_type, samples, dis_measure,
+              k_neighbor, min_peak_ratio, rank):
+    if not samples:
+        return []
+    test_samples, pitches = zip(*samples)
+
+    # if the model_type is multi and the test data is in the model,
+    # leave it out by masking
+    excludes = ([ts['source'] for ts in test_samples]
+                if model_type == 'multi' else None)
+
+    if experiment_type == 'tonic':  # tonic identification
+        return model.estimate_tonic_batch(
+            pitches, [ts['mode'] for ts in test_samples],
+            min_peak_ratio=min_peak_ratio, dis_measure=dis_measure,
+            k_neighbor=k_neighbor, rank=rank, excludes=excludes)
+    elif experiment_type == 'mode':  # mode recognition
+        return model.estimate_mode_batch(
+            pitches, [ts['tonic'] for ts in test_samples],
+            dis_measure=dis_measure, k_neighbor=k_neighbor, rank=rank,
+            excludes=excludes)
+    elif experiment_type == 'joint':  # joint estimation
+        return model.estimate_joint_batch(
+            pitches, min_peak_ratio=min_peak_ratio, dis_measure=dis_measure,
+            k_neighbor=k_neighbor, rank=rank, excludes=excludes)
     else:
-        eval_folds['tonic_accuracy'] = eval_folds['num_correct_tonic'] / 10
-        eval_folds['mode_accuracy'] = eval_folds['num_correct_mode'] / 10
-        eval_folds['joint_accuracy'] = eval_folds['num_correct_joint'] / 10
+        raise ValueError("Unknown experiment_type")
+
+
+ANNOTATION_FILE = './data/otmm_makam_recognition_dataset/annotations.json'
+
+
+def _load_test_samples(result_folder, annotation_file):
+    # the test samples of all folds are the columns of the result arrays. a
+    # recording is tested once in each repetition of repeated folds, hence
+    # a column is a (fold, MBID) pair
+    index = evaluation.AnnotationIndex(json.load(open(annotation_file)))
+    folds = io.load_folds(result_folder)
+    mbids = [ts['source'] for _, f in folds for ts in f['testing']]
+    fold_idx = np.array([fold_idx for fold_idx, f in folds
+                         for _ in f['testing']])
+    return index, mbids, fold_idx
+
+
+def _read_results(test_folders, experiment_type, mbids, fold_idx):
+    # the best estimate of each sample in each test folder; the missing
+    # estimates are NaN tonics and None modes
+    column = {(int(f), mbid): i for i, (f, mbid) in enumerate(
+        zip(fold_idx, mbids))}
+    tonics = np.full((len(test_folders), len(mbids)), np.nan)
+    modes = np.full((len(test_folders), len(mbids)), None, dtype=object)
+    for i, test_folder in enumerate(test_folders):
+        for fold in sorted(set(int(f) for f in fold_idx)):
+            results_file = os.path.join(test_folder, 'fold{0:d}'.format(fold),
+                                        'results.json')
+            if not os.path.exists(results_file):
+                continue
+            for mbid, estimates in json.load(open(results_file)).items():
+                col = column.get((fold, mbid))
+                if not estimates or col is None:
+                    continue
+                if experiment_type == 'tonic':
+                    tonics[i, col] = estimates[0][0]
+                elif experiment_type == 'mode':
+                    modes[i, col] = estimates[0][0]
+                else:
+                    tonics[i, col], modes[i, col] = estimates[0][0]
+    return tonics, modes
+
+
+def _percent(accuracy):
+    # the accuracies in overall_eval.json are percentages, as the number of
+    # correct estimates over 10 folds of 100 samples divided by 10; the
+    # summaries of all the experiments keep the fractions
+    return float(100.0 * accuracy)
 
-        eval_folds['tonic_deviation_distribution'] = \
-            eval_folds['tonic_deviation_distribution'].to_dict()
-        eval_folds['confusion_matrix']['matrix'] = \
-            eval_folds['confusion_matrix']['matrix'].tolist()
 
-    json.dump(eval_folds,
-              open(os.path.join(test_folder, 'overall_eval.json'), 'w'))
+@instrument.staged('evaluate', 'experiment_type', 'model_type',
+                   'distribution_type', 'step_size', 'kernel_width',
+                   'dis_measure', 'k_neighbor', 'min_peak_ratio')
+def evaluate(step_size, kernel_width, distribution_type, model_type,
+             experiment_type, dis_measure, k_neighbor, min_peak_ratio,
+             result_folder, annotation_file=ANNOTATION_FILE, ann_nprobe=None,
+             coarse_step=None, top_n=tonic_search.TOP_N):
+    test_folder = os.path.abspath(os.path.join(io.get_folder(
+        os.path.join(result_folder, 'testing', experiment_type),
+        io.get_model_label(model_type, ann_nprobe, coarse_step, top_n),
+        distribution_type, step_size, kernel_width, dis_measure,
+        k_neighbor, min_peak_ratio)))
+
+    index, mbids, fold_idx = _load_test_samples(result_folder,
+                                                annotation_file)
+    tonics, modes = _read_results([test_folder], experiment_type, mbids,
+                                  fold_idx)
+    ev = evaluation.evaluate(index, experiment_type, mbids, fold_idx,
+                             tonics, modes)
+
+    eval_folds = {}
+    if ev.tonic_correct is not None:
+        eval_folds['num_correct_tonic'] = int(ev.tonic_correct.sum())
+        eval_folds['tonic_accuracy'] = _percent(evaluation.accuracy(
+            ev.tonic_correct, ev.num_samples)[1][0])
+        eval_folds['tonic_deviation_distribution'] = distribution.to_dict(
+            distribution.Distribution(
+                distribution.get_bins(step_size, 'pcd'),
+                evaluation.deviation_histogram(ev.tonic_deviations[0],
+                                               step_size),
+                'pcd', step_size, 0))
+    if ev.mode_correct is not None:
+        eval_folds['num_correct_mode'] = int(ev.mode_correct.sum())
+        eval_folds['mode_accuracy'] = _percent(evaluation.accuracy(
+            ev.mode_correct, ev.num_samples)[1][0])
+        eval_folds['confusion_matrix'] = {
+            'matrix': ev.confusion[0].sum(axis=0).tolist(),
+            'labels': index.mode_labels.tolist()}
+    if ev.joint_correct is not None:
+        eval_folds['num_correct_joint'] = int(ev.joint_correct.sum())
+        eval_folds['joint_accuracy'] = _percent(evaluation.accuracy(
+            ev.joint_correct, ev.num_samples)[1][0])
+
+    cache.atomic_dump_json(eval_folds,
+                           os.path.join(test_folder, 'overall_eval.json'))
+    instrument.add(samples=len(mbids), folds=len(set(fold_idx)))
 
     return u'{0:s} done'.format(test_folder)
 
 
-def search_min_peak_ratio(step_size, kernel_width, distribution_type,
-                          min_peak_ratio):
-    base_folder = os.path.join('data', 'features')
-    feature_folder = os.path.abspath(io.get_folder(
-        base_folder, distribution_type, step_size, kernel_width))
-    files = get_filenames_in_dir(feature_folder, keyword='*pdf.json')[0]
-    evaluator = Evaluator()
-    num_peaks = 0
-    num_tonic_in_peaks = 0
-    for f in files:
-        dd = json.load(open(f))
-        dd['feature'] = PitchDistribution.from_dict(dd['feature'])
+def _test_all_folds(step_size, kernel_width, distribution_type, model_type,
+                    experiment_type, dis_measure, k_neighbor, min_peak_ratio,
+                    save_folder, annotation_file, pitch_store_folder,
+                    fold_indices, options):
+    # tests from scratch and evaluates; returns the test folder, the test
+    # time, the accuracy and the counts of the test stages, which are
+    # collected if the instrumentation is enabled
+    counts = collections.Counter()
+
+    def add_counts(event):
+        if event['stage'] == 'test':
+            counts.update(event['counts'])
+
+    tic = time.perf_counter()
+    instrument.add_listener(add_counts)
+    try:
+        for fold_idx in fold_indices:
+            res_dict = test(step_size, kernel_width, distribution_type,
+                            model_type, fold_idx, experiment_type,
+                            dis_measure, k_neighbor, min_peak_ratio, 1,
+                            save_folder, True, pitch_store_folder, **options)
+            if res_dict['failed']:
+                raise RuntimeError(u'{0:d} samples failed.'.format(
+                    len(res_dict['failed'])))
+    finally:
+        instrument.remove_listener(add_counts)
+    test_time = time.perf_counter() - tic
+
+    evaluate(step_size, kernel_width, distribution_type, model_type,
+             experiment_type, dis_measure, k_neighbor, min_peak_ratio,
+             save_folder, annotation_file, **options)
+    test_folder = os.path.abspath(io.get_folder(
+        os.path.join(save_folder, 'testing', experiment_type),
+        io.get_model_label(model_type, **options), distribution_type,
+        step_size, kernel_width, dis_measure, k_neighbor, min_peak_ratio))
+    accuracy = _read_json(os.path.join(test_folder, 'overall_eval.json'))[
+        experiment_type + '_accuracy'] / 100.0
+    return test_folder, test_time, accuracy, dict(counts)
+
+
+def compare_search(step_size, kernel_width, distribution_type, model_type,
+                   experiment_type, dis_measure, k_neighbor, min_peak_ratio,
+                   save_folder, searches, annotation_file=ANNOTATION_FILE,
+                   pitch_store_folder=None):
+    # tests all the folds with the exact search and with each dict of the
+    # search options (ann_nprobe, coarse_step, top_n), and compares their
+    # accuracies, test times and best estimates
+    index, mbids, fold_idx = _load_test_samples(save_folder,
+                                                annotation_file)
+    args = (step_size, kernel_width, distribution_type, model_type,
+            experiment_type, dis_measure, k_neighbor, min_peak_ratio,
+            save_folder, annotation_file, pitch_store_folder,
+            sorted(set(fold_idx.tolist())))
+    # the first run loads the models and the pitch tracks into the caches,
+    # so it is not timed
+    _test_all_folds(*args, {})
+    exact_folder, exact_time, exact_accuracy, _ = _test_all_folds(
+        *args, {})
+
+    comparisons = []
+    for options in searches:
+        test_folder, test_time, accuracy, counts = _test_all_folds(
+            *args, options)
+        tonics, modes = _read_results([exact_folder, test_folder],
+                                      experiment_type, mbids, fold_idx)
+        comparisons.append(dict(
+            options, accuracy=accuracy, exact_accuracy=exact_accuracy,
+            accuracy_gap=exact_accuracy - accuracy, test_time=test_time,
+            exact_test_time=exact_time,
+            num_changed=_num_changed(tonics, modes, 0, 1),
+            num_samples=len(mbids), counts=counts))
+    return comparisons
+
+
+def _num_changed(tonics, modes, i, j):
+    # number of samples, whose best estimate differs in the rows i and j
+    changed = ((modes[i] != modes[j]) |
+               (np.isnan(tonics[i]) != np.isnan(tonics[j])) |
+               (np.abs(tonics[i] - tonics[j]) > 1e-6))
+    return int(changed.sum())
+
+
+def _parse_param(param):
+    # inverse of io.get_folder for the numeric parameters
+    param = param.replace('_', '.')
+    try:
+        return int(param)
+    except ValueError:
+        return float(param)
+
+
+# the model labels of the exact search; the approximate and the
+# coarse-to-fine searches are labeled e.g. multi-ann8 (see io.get_model_label)
+EXACT_MODEL_LABELS = ('single', 'multi')
+
+
+@instrument.staged('summarize')
+def summarize(result_folder, annotation_file=ANNOTATION_FILE):
+    # evaluate all the tested configurations of each experiment type at
+    # once. the approximate searches are compared to their exact search
+    # apart, as in compare_search
+    index, mbids, fold_idx = _load_test_samples(result_folder,
+                                                annotation_file)
+    overall = {}
+    perfold = {}
+    searches = {}
+    for experiment_type in evaluation.EXPERIMENT_TYPES:
+        experiment_folder = os.path.join(result_folder, 'testing',
+                                         experiment_type)
+        if not os.path.isdir(experiment_folder):
+            continue
+        names = sorted(n for n in os.listdir(experiment_folder)
+                       if os.path.isdir(os.path.join(experiment_folder, n)))
+        if not names:
+            continue
+        exact = [n for n in names
+                 if n.split('--')[0] in EXACT_MODEL_LABELS]
+        approximate = [n for n in names if n not in exact]
+
+        tonics, modes = _read_results(
+            [os.path.join(experiment_folder, n) for n in exact + approximate],
+            experiment_type, mbids, fold_idx)
+        instrument.add(configs=len(names))
+        if approximate:
+            searches[experiment_type] = _compare_searches(
+                index, experiment_type, mbids, fold_idx, exact, approximate,
+                tonics, modes)
+        if not exact:
+            continue
 
-        peak_idx = dd['feature'].detect_peaks(min_peak_ratio=min_peak_ratio)[0]
-        peak_cents = dd['feature'].bins[peak_idx]
-        peak_freqs = Converter.cent_to_hz(peak_cents, dd['tonic'])
+        configs = []
+        for name in exact:
+            model_type, distribution_type, step_size, kernel_width, \
+                dis_measure, k_neighbor, _ = name.split('--')
+            configs.append({
+                'training': model_type, 'distribution': distribution_type,
+                'distance': dis_measure,
+                'bin_size': _parse_param(step_size),
+                'kernel_width': _parse_param(kernel_width),
+                'k_neighbors': int(k_neighbor)})
+
+        ev = evaluation.evaluate(index, experiment_type, mbids, fold_idx,
+                                 tonics[:len(exact)], modes[:len(exact)])
+        overall[experiment_type] = evaluation.summarize_overall(exact, ev)
+        perfold[experiment_type] = evaluation.summarize_perfold(configs, ev)
+
+    testing_folder = os.path.join(result_folder, 'testing')
+    cache.atomic_dump_json(overall, os.path.join(
+        testing_folder, 'evaluation_overall.json'))
+    cache.atomic_dump_json(perfold, os.path.join(
+        testing_folder, 'evaluation_perfold.json'))
+    cache.atomic_dump_json(searches, os.path.join(
+        testing_folder, 'evaluation_search.json'))
+
+    return u'{0:s} summarized.'.format(testing_folder)
+
+
+def _compare_searches(index, experiment_type, mbids, fold_idx, exact,
+                      approximate, tonics, modes):
+    # the rows of tonics and modes are the exact and then the approximate
+    # configurations; each approximate configuration is compared to the
+    # exact one with the same parameters, if it is tested
+    ev = evaluation.evaluate(index, experiment_type, mbids, fold_idx,
+                             tonics, modes)
+    accuracies = {s['param']: s['accuracy'] for s in
+                  evaluation.summarize_overall(exact + approximate, ev)}
+    rows = {name: i for i, name in enumerate(exact)}
+
+    comparisons = []
+    for i, name in enumerate(approximate, len(exact)):
+        label, params = name.split('--', 1)
+        exact_name = u'{0:s}--{1:s}'.format(label.split('-')[0], params)
+        comparison = {'param': name, 'exact_param': exact_name,
+                      'accuracy': accuracies[name], 'exact_accuracy': None,
+                      'accuracy_gap': None, 'num_changed': None,
+                      'num_samples': len(mbids)}
+        if exact_name in rows:
+            comparison.update(
+                exact_accuracy=accuracies[exact_name],
+                accuracy_gap=accuracies[exact_name] - accuracies[name],
+                num_changed=_num_changed(tonics, modes, rows[exact_name], i))
+        comparisons.append(comparison)
+    return comparisons
+
+
+def search_min_peak_ratio(step_size, kernel_width, distribution_type,
+                          min_peak_ratio, save_folder='data'):
+    num_tonic_in_peaks, num_peaks = search_min_peak_ratios(
+        step_size, kernel_width, distribution_type, [min_peak_ratio],
+        save_folder)
+    return int(num_tonic_in_peaks[0]), int(num_peaks[0])
 
-        ev = [evaluator.evaluate_tonic(pp, dd['tonic'])['tonic_eval']
-              for pp in peak_freqs]
 
-        num_tonic_in_peaks += any(ev)
-        num_peaks += len(ev)
+@instrument.staged('search_min_peak_ratio', 'distribution_type', 'step_size',
+                   'kernel_width')
+def search_min_peak_ratios(step_size, kernel_width, distribution_type,
+                           min_peak_ratios, save_folder='data'):
+    # the peaks of all the features are detected once and each ratio is
+    # answered from the cached peak-to-max ratios
+    base_folder = os.path.join(save_folder, 'features')
+    bank = feature_bank.load(os.path.abspath(io.get_folder(
+        base_folder, distribution_type, step_size, kernel_width)))
+    instrument.add(banks_read=1, distributions=len(bank))
 
-    return num_tonic_in_peaks, num_peaks
+    return evaluation.min_peak_ratio_curve(
+        bank.pdf, bank.bins, min_peak_ratios,
+        circular=distribution_type == 'pcd')
 
 
 def plot_min_peak_ratio(min_peak_ratios, ratio_tonic, num_peak,
                         prob_tonic=None, num_exps=None):
-    fig, ax1 = plt.subplots()
-    ax1.plot(min_peak_ratios, ratio_tonic, 'bd-',
-             label='Ratio of the tests with the tonic')
-    if prob_tonic is not None:
-        ax1.plot(min_peak_ratios, prob_tonic, 'b*-',
-                 label='Prior probability of tonic')
-    ax1.set_ylabel('Probability of getting the tonic\namong the '
-                   'detected peaks', color='b')
-    ax1.set_ylim([0, 1])
-    for tl in ax1.get_yticklabels():
-        tl.set_color('b')
-    plt.setp(ax1, xticks=[])
-
-    ax2 = ax1.twinx()
-    ax2.plot(min_peak_ratios, num_peak, 'r.-', label='Total number of peaks')
-    ax2.set_ylabel('# peaks', color='r')
-    for tl in ax2.get_yticklabels():
-        tl.set_color('r')
-
-    plt.setp(ax2, xticks=min_peak_ratios)
-    ax1.set_xticklabels(min_peak_ratios, rotation=-60)
-    ax1.set_xlabel('Minimum Peak Ratio')
-
-    # h1, l1 = ax1.get_legend_handles_labels()
-    # h2, l2 = ax2.get_legend_handles_labels()
-    # ax1.legend(h1 + h2, l1 + l2)
-
-    if num_exps is not None:
-        plt.title(
-            'Results wrt minimum_peak_ratio values computed\nusing '
-            '{0:d} recordings in {1:d} experiments'.format(1000 * num_exps,
-                                                           num_exps))
+    # matplotlib is imported only to plot, not by the workers
+    from experimentation_code import plotting
+    plotting.plot_min_peak_ratio(min_peak_ratios, ratio_tonic, num_peak,
+                                 prob_tonic, num_exps)
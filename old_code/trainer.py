@@ -1,117 +1,122 @@
-import json
 import os
 
-import numpy as np
-from fileoperations.fileoperations import get_filenames_in_dir
-from morty.classifiers.knnclassifier import KNNClassifier
-from morty.pitchdistribution import PitchDistribution
 from dlfm_code import io
+from experimentation_code import cache, distribution, feature_bank, \
+    instrument, pitch_store, single_model
 
 
-def compute_recording_distributions(
-        step_size, kernel_width, distribution_type, anno, dataset_folder,
-        save_folder, overwrite=False):
-    # get mbid
-    mbid = os.path.split(anno['mbid'])[-1]
-
+def get_feature_folder(save_folder, step_size, kernel_width,
+                       distribution_type):
     base_folder = os.path.join(save_folder, 'features')
-    feature_folder = os.path.abspath(io.get_folder(
+    return os.path.abspath(io.get_folder(
         base_folder, distribution_type, step_size, kernel_width))
-    if not os.path.exists(feature_folder):
-        os.makedirs(feature_folder)
-
-    raw_save_file = os.path.join(feature_folder,
-                                 u'{0:s}--hist.json'.format(mbid))
-    norm_save_file = os.path.join(feature_folder,
-                                  u'{0:s}--pdf.json'.format(mbid))
-
-    if not overwrite and os.path.exists(norm_save_file):
-        return norm_save_file + ' skipped.'
-
-    pitch_file = os.path.abspath(os.path.join(
-        dataset_folder, 'data', anno['makam'], mbid + '.pitch'))
-    pitch = np.loadtxt(pitch_file)
-
-    # compute histogram (for single training sample per mode)
-    feature = PitchDistribution.from_hz_pitch(
-        pitch, ref_freq=anno['tonic'], kernel_width=kernel_width,
-        step_size=step_size, norm_type=None)
-    if distribution_type == 'pcd':
-        feature.to_pcd()
 
-    dp = {'feature': feature.to_dict(), 'mode': anno['makam'],
-          'source': anno['mbid'], 'tonic': anno['tonic']}
-    json.dump(dp, open(raw_save_file, 'w'))
 
-    # compute probability density function (for multi training sample per
-    # mode)
-    feature.normalize()
-    dp = {'feature': feature.to_dict(), 'mode': anno['makam'],
-          'source': anno['mbid'], 'tonic': anno['tonic']}
-    json.dump(dp, open(norm_save_file, 'w'))
+def compute_recording_distributions(
+        step_size, kernel_width, distribution_type, anno, dataset_folder,
+        save_folder, overwrite=False, pitch_store_folder=None):
+    return compute_recording_distributions_grid(
+        [step_size], [kernel_width], [distribution_type], anno,
+        dataset_folder, save_folder, overwrite=overwrite,
+        pitch_store_folder=pitch_store_folder)
+
+
+@instrument.staged('features', 'distribution_types', 'step_sizes',
+                   'kernel_widths',
+                   mbid=lambda args: pitch_store.get_mbid(args['anno']))
+def compute_recording_distributions_grid(
+        step_sizes, kernel_widths, distribution_types, anno, dataset_folder,
+        save_folder, overwrite=False, pitch_store_folder=None):
+    # get mbid
+    mbid = os.path.split(anno['mbid'])[-1]
 
-    return norm_save_file + ' computed.'
+    # the histogram (for single training sample per mode) and the
+    # probability density function (for multi training sample per mode) are
+    # appended to the feature bank of each parameter set
+    writers = {}
+    for params in distribution.get_param_grid(
+            step_sizes, kernel_widths, distribution_types):
+        distribution_type, step_size, kernel_width = params
+        writer = feature_bank.FeatureBankWriter(
+            get_feature_folder(save_folder, step_size, kernel_width,
+                               distribution_type),
+            distribution.get_bins(step_size, distribution_type),
+            distribution_type, step_size, kernel_width)
+        if overwrite or mbid not in writer:
+            writers[params] = writer
+
+    if not writers:
+        return mbid + ' skipped.'
+
+    if pitch_store_folder is None:  # the text file is read chunk by chunk
+        pitch = os.path.abspath(os.path.join(
+            dataset_folder, 'data', anno['makam'], mbid + '.pitch'))
+    else:  # zero-copy read from the binary store
+        pitch = pitch_store.load(pitch_store_folder)[mbid]
+
+    # compute all the distributions from a single pass over the pitch track,
+    # without holding the whole track in memory
+    accumulator = distribution.DistributionAccumulator(
+        anno['tonic'], list(writers.keys()))
+    num_frames = 0
+    for chunk in distribution.iter_pitch_chunks(pitch):
+        accumulator.update(chunk)
+        num_frames += len(chunk)
+    distributions = accumulator.distributions()
+
+    for params, writer in writers.items():
+        writer.append(mbid, anno['makam'], anno['tonic'],
+                      distributions[params].vals)
+    instrument.add(recordings=1, frames=num_frames, pitch_tracks_read=1,
+                   banks_written=len(writers))
+
+    return u'{0:s} {1:d} distributions computed.'.format(mbid, len(writers))
 
 
 def train_single(step_size, kernel_width, distribution_type, fold_tuple,
                  save_folder, overwrite=False):
-    training_file = io.get_training_file(
-        save_folder, step_size, kernel_width, distribution_type, 'single',
-        fold_tuple)
-
-    if not overwrite and os.path.exists(training_file):
-        return training_file + ' skipped.'
-
-    # get features
-    base_folder = os.path.join(save_folder, 'features')
-    feature_folder = os.path.abspath(io.get_folder(
-        base_folder, distribution_type, step_size, kernel_width))
-    # get histogram files computed from the audio recordings
-    feature_files = get_filenames_in_dir(feature_folder,
-                                         keyword='*hist.json')[0]
-
-    # initialize temporary model. use dict for easy mapping
-    training = fold_tuple[1]['training']
-    makams = set(training['modes'])
-    tmp_model = {}
-    for makam in makams:
-        tmp_model[makam] = {'mode': makam, 'sources': [], 'feature': None}
-
-    # compute the single distribution from the distribution
-    for ff in feature_files:
-        for i, mbid in enumerate(training['sources']):
-            if mbid in ff:
-                data = json.load(open(ff))
-
-                tmp_model[data['mode']]['sources'].append(mbid)
-                if tmp_model[data['mode']]['feature'] is None:
-                    tmp_model[data['mode']]['feature'] = PitchDistribution.\
-                        from_dict(data['feature'])
-                else:
-                    tmp_model[data['mode']]['feature'] = \
-                        tmp_model[data['mode']]['feature'].merge(
-                            PitchDistribution.from_dict(data['feature']))
-
-    # verify the computed distribution of the modes and normalize features
-    # and collapse the temporary model dict
-    model = []
-    for val in tmp_model.values():
-        assert len(val['sources']) == 45, 'The mode should have been 45 ' \
-                                          'recordings to train'
-        val['feature'].normalize()
-        model.append(val)
-
-    # save the model
-    KNNClassifier.model_to_json(model, training_file)
-
-    return training_file + ' created.'
+    return train_single_folds(step_size, kernel_width, distribution_type,
+                              [fold_tuple], save_folder, overwrite)
 
 
+@instrument.staged('train_single', 'distribution_type', 'step_size',
+                   'kernel_width', num_folds=lambda args: len(args['folds']))
+def train_single_folds(step_size, kernel_width, distribution_type, folds,
+                       save_folder, overwrite=False):
+    training_files = {fold_idx: io.get_training_file(
+        save_folder, step_size, kernel_width, distribution_type, 'single',
+        (fold_idx, fold)) for fold_idx, fold in folds}
+    folds = [(fold_idx, fold) for fold_idx, fold in folds
+             if overwrite or not os.path.exists(training_files[fold_idx])]
+    if not folds:
+        return u'{0:d} single models skipped.'.format(len(training_files))
+
+    # sum the histograms of the training recordings per mode for all the
+    # folds at once
+    bank = feature_bank.load(get_feature_folder(
+        save_folder, step_size, kernel_width, distribution_type))
+    models = single_model.train_folds(
+        bank, [fold['training']['sources'] for _, fold in folds])
+
+    for (fold_idx, fold), model in zip(folds, models):
+        # verify the computed distribution of the modes
+        assert sorted(model.modes) == sorted(set(
+            fold['training']['modes'])), 'All modes should be trained'
+        for sources in model.sources:
+            assert len(sources) == 45, 'The mode should have been 45 ' \
+                                       'recordings to train'
+
+        # save the model; the file is replaced once it is completely written
+        single_model.save(model, training_files[fold_idx])
+    instrument.add(banks_read=1, models_written=len(folds))
+
+    return u'{0:d} single models created.'.format(len(folds))
+
+
+@instrument.staged('train_multi', 'distribution_type', 'step_size',
+                   'kernel_width', fold=lambda args: args['fold_tuple'][0])
 def train_multi(step_size, kernel_width, distribution_type, fold_tuple,
                 save_folder, overwrite=False):
-    if save_folder.endswith('/'):
-        save_folder = save_folder[:-1]
-
     # check if the model is already trained
     training_file = io.get_training_file(
         save_folder, step_size, kernel_width, distribution_type, 'multi',
@@ -120,27 +125,18 @@ def train_multi(step_size, kernel_width, distribution_type, fold_tuple,
     if not overwrite and os.path.exists(training_file):
         return training_file + ' skipped.'
 
-    # get feature files
-    base_folder = os.path.join(save_folder, 'features')
-    feature_folder = io.get_folder(base_folder, distribution_type, step_size,
-                                   kernel_width)
-    # get probability density functions computed from audio recordings
-    feature_files = get_filenames_in_dir(feature_folder,
-                                         keyword='*pdf.json')[0]
-
-    # gather the distribution files of the training model
+    # the model is the probability density functions of the training
+    # recordings in the feature bank; keep the MBIDs for compactness
+    bank = feature_bank.load(get_feature_folder(
+        save_folder, step_size, kernel_width, distribution_type))
     training = fold_tuple[1]['training']
-    model_files = []
-    for ff in feature_files:
-        for i, mbid in enumerate(training['sources']):
-            if mbid in ff:  # keep the filenames for compactness
-                # remove the save_folder for compactness
-                model_files.append(ff.replace(save_folder, '.'))
-
-    assert len(model_files) == 900, 'The model should have 900 recordings ' \
+    model_mbids = [mbid for mbid in training['sources'] if mbid in bank]
+
+    assert len(model_mbids) == 900, 'The model should have 900 recordings ' \
                                     'to train'
 
     # save the model
-    json.dump(model_files, open(training_file, 'w'))
+    cache.atomic_dump_json(model_mbids, training_file)
+    instrument.add(banks_read=1, models_written=1)
 
     return training_file + ' created.'
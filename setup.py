@@ -73,6 +73,7 @@ setup(
     python_requires="==3.7.*",
     install_requires=[
         "essentia>=2.1b5;platform_system=='Linux'",  # audio signal processing
+        "numpy>=1.20",
     ],
     extras_require={
         "development": [
@@ -86,6 +87,9 @@ setup(
         ],
         "demo": {
             "jupyter"
-        }
+        },
+        "plotting": [
+            "matplotlib"  # experimentation_code.plotting
+        ]
     }
 )
@@ -0,0 +1,290 @@
+"""Approximate nearest neighbor index of the "multi" models
+
+The Bhattacharyya distance of two distributions p and q is a monotonic
+function of the Euclidean distance of their square roots:
+
+    -log(sum(sqrt(p * q))) = -log(1 - ||sqrt(p) - sqrt(q)||^2 / 2)
+
+so the nearest neighbors wrt the Bhattacharyya distance are the nearest
+neighbors of the square-rooted distributions in the Euclidean space (i.e.
+wrt the Hellinger distance). The L2 distance is Euclidean as is.
+
+The index is an inverted file: the transformed distributions are clustered
+by k-means, and a query is compared only with the rows in the lists of its
+``nprobe`` nearest centroids. The candidates are then scored with the exact
+distance measure, hence the results are exact whenever the true nearest
+neighbors are among the candidates. ``nprobe`` trades the recall for the
+speed; probing all the lists is exact search.
+
+An index file consists of the 8-byte magic ``MAGIC``, the 8-byte
+little-endian length of the JSON header, the header padded to ``ALIGNMENT``
+bytes, the float64 centroids, the int64 list offsets and the int32 rows of
+the lists.
+"""
+import json
+import os
+
+import numpy as np
+
+from . import distance
+
+MAGIC = b"DLFMANN1"
+ALIGNMENT = 64
+DEFAULT_NPROBE = 8
+NUM_ITER = 10
+TRANSFORMS = {"bhat": np.sqrt, "l2": np.asarray}  # to the Euclidean space
+
+
+def supports(dis_measure):
+    """bool -- True if the index can search for a distance measure"""
+    return dis_measure in TRANSFORMS
+
+
+def _sq_dists(points, centroids):
+    return (np.square(points).sum(axis=1)[:, None] - 2 * points @ centroids.T
+            + np.square(centroids).sum(axis=1)[None, :])
+
+
+def _assign(points, centroids):
+    # chunked to bound the memory of the (points x centroids) distances
+    chunk_size = max(1, distance.MAX_ELEMENTS // max(1, len(centroids)))
+    return np.concatenate([
+        np.argmin(_sq_dists(points[start:start + chunk_size], centroids),
+                  axis=1) for start in range(0, len(points), chunk_size)] +
+        [np.zeros(0, dtype=int)])
+
+
+def kmeans(points, num_clusters, num_iter=NUM_ITER, seed=0):
+    """Clusters points by Lloyd's k-means
+
+    Args:
+        points (numpy.ndarray): (num_points, num_dims) points
+        num_clusters (int): number of clusters
+        num_iter (int, optional): number of iterations. Defaults to NUM_ITER
+        seed (int, optional): random seed of the initial centroids. Defaults
+            to 0
+
+    Returns:
+        numpy.ndarray -- (num_clusters, num_dims) centroids
+    """
+    rnd = np.random.RandomState(seed)
+    centroids = points[rnd.choice(len(points), num_clusters, replace=False)]
+    for _ in range(num_iter):
+        labels = _assign(points, centroids)
+        counts = np.bincount(labels, minlength=num_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, points)
+        # an empty cluster keeps its centroid
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+    return centroids
+
+
+class IVFIndex:
+    """Inverted file index of the rows of a model
+
+    Examples:
+        >>> index = IVFIndex.build(model.vals, "bhat")
+        >>> model = model.with_ann(index, nprobe=8)
+    """
+
+    def __init__(self, centroids, offsets, rows, dis_measure):
+        """Creates an index from its lists
+
+        Args:
+            centroids (numpy.ndarray): (num_lists, num_bins) centroids in the
+                transformed space
+            offsets (numpy.ndarray): (num_lists + 1,) bounds of the lists
+                in rows
+            rows (numpy.ndarray): model rows of the lists, list after list
+            dis_measure (str): distance measure the index searches for
+        """
+        if not supports(dis_measure):
+            raise ValueError("The index does not support {0:s}".format(
+                dis_measure))
+        self.centroids = centroids
+        self.offsets = offsets
+        self.rows = rows
+        self.dis_measure = dis_measure
+
+    @classmethod
+    def build(cls, vals, dis_measure="bhat", num_lists=None,
+              num_iter=NUM_ITER, seed=0):
+        """Clusters the rows of a model into lists
+
+        Args:
+            vals (numpy.ndarray): (num_rows, num_bins) distributions
+            dis_measure (str, optional): distance measure. Defaults to "bhat"
+            num_lists (int, optional): number of lists. Defaults to None,
+                i.e. the square root of the number of rows
+            num_iter (int, optional): k-means iterations. Defaults to
+                NUM_ITER
+            seed (int, optional): random seed. Defaults to 0
+
+        Returns:
+            IVFIndex -- the index
+        """
+        points = TRANSFORMS[dis_measure](np.asarray(vals, dtype=float))
+        if num_lists is None:
+            num_lists = int(np.ceil(np.sqrt(len(points))))
+        num_lists = max(1, min(num_lists, len(points)))
+        centroids = kmeans(points, num_lists, num_iter, seed)
+        labels = _assign(points, centroids)
+        rows = np.argsort(labels, kind="stable")
+        offsets = np.concatenate(
+            [[0], np.cumsum(np.bincount(labels, minlength=num_lists))])
+        return cls(centroids, offsets, rows.astype(np.int32), dis_measure)
+
+    @property
+    def num_lists(self):
+        """int -- number of lists"""
+        return len(self.centroids)
+
+    @property
+    def num_rows(self):
+        """int -- number of indexed model rows"""
+        return len(self.rows)
+
+    def candidates(self, queries, nprobe=DEFAULT_NPROBE, valid=None,
+                   min_candidates=1):
+        """Finds the candidate rows of each query
+
+        The lists are probed from the nearest centroid on. More than nprobe
+        lists are probed if needed to find min_candidates valid rows, e.g.
+        when most of the rows are out of the training set of a fold.
+
+        Args:
+            queries (numpy.ndarray): (num_queries, num_bins) distributions
+            nprobe (int, optional): number of lists to probe. Defaults to
+                DEFAULT_NPROBE
+            valid (numpy.ndarray, optional): boolean mask of the rows to
+                return. Defaults to None, i.e. all
+            min_candidates (int, optional): minimum number of valid
+                candidates. Defaults to 1
+
+        Returns:
+            list -- sorted candidate rows of each query
+        """
+        points = TRANSFORMS[self.dis_measure](
+            np.atleast_2d(np.asarray(queries, dtype=float)))
+        order = np.argsort(_sq_dists(points, self.centroids), axis=1)
+        lists = [self.rows[start:stop] for start, stop in
+                 zip(self.offsets[:-1], self.offsets[1:])]
+        if valid is not None:
+            lists = [rows[valid[rows]] for rows in lists]
+        sizes = np.array([len(rows) for rows in lists])
+
+        candidates = []
+        for probe_order in order:
+            # probe at least nprobe lists and enough lists for the minimum
+            enough = np.searchsorted(np.cumsum(sizes[probe_order]),
+                                     min_candidates) + 1
+            probed = probe_order[:max(nprobe, enough)]
+            candidates.append(np.sort(np.concatenate(
+                [lists[i] for i in probed] + [np.zeros(0, dtype=np.int32)])))
+        return candidates
+
+    def distances(self, queries, vals, dis_measure, nprobe=DEFAULT_NPROBE,
+                  valid=None, min_candidates=1):
+        """Computes the distances of the queries to their candidate rows
+
+        Args:
+            queries (numpy.ndarray): (num_queries, num_bins) distributions
+            vals (numpy.ndarray): (num_rows, num_bins) model distributions
+            dis_measure (str): distance measure
+            nprobe (int, optional): number of lists to probe. Defaults to
+                DEFAULT_NPROBE
+            valid (numpy.ndarray, optional): boolean mask of the rows to
+                compare. Defaults to None, i.e. all
+            min_candidates (int, optional): minimum number of valid
+                candidates. Defaults to 1
+
+        Returns:
+            numpy.ndarray -- (num_queries, num_rows) distances; NaN for the
+            rows, which are not candidates
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=float))
+        dists = np.full((len(queries), len(vals)), np.nan)
+        for i, rows in enumerate(self.candidates(
+                queries, nprobe, valid, min_candidates)):
+            dists[i, rows] = distance.pairwise(queries[i], vals[rows],
+                                               dis_measure)[0]
+        return dists
+
+    def save(self, path):
+        """Saves the index; the file is replaced once completely written"""
+        header = json.dumps({
+            "dis_measure": self.dis_measure,
+            "num_lists": self.num_lists, "num_rows": self.num_rows,
+            "num_bins": int(self.centroids.shape[1])}).encode()
+        offset = len(MAGIC) + 8 + len(header)
+        header += b" " * (-offset % ALIGNMENT)
+
+        tmp_file = "{0:s}.{1:d}.tmp".format(path, os.getpid())
+        with open(tmp_file, "wb") as f:
+            f.write(MAGIC)
+            f.write(np.array(len(header), dtype="<u8").tobytes())
+            f.write(header)
+            f.write(np.ascontiguousarray(self.centroids, "<f8").tobytes())
+            f.write(np.ascontiguousarray(self.offsets, "<i8").tobytes())
+            f.write(np.ascontiguousarray(self.rows, "<i4").tobytes())
+        os.replace(tmp_file, path)
+
+    @classmethod
+    def load(cls, path):
+        """Loads an index
+
+        Args:
+            path (str): path to the index file
+
+        Raises:
+            IOError: if the file is not an index file
+
+        Returns:
+            IVFIndex -- the index
+        """
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise IOError(u"{0:s} is not an index file".format(path))
+            header_len = int(np.frombuffer(f.read(8), dtype="<u8")[0])
+            header = json.loads(f.read(header_len))
+            num_lists = header["num_lists"]
+            centroids = np.frombuffer(
+                f.read(8 * num_lists * header["num_bins"]), dtype="<f8")
+            offsets = np.frombuffer(f.read(8 * (num_lists + 1)), dtype="<i8")
+            rows = np.frombuffer(f.read(4 * header["num_rows"]), dtype="<i4")
+        return cls(centroids.reshape(num_lists, header["num_bins"]), offsets,
+                   rows, header["dis_measure"])
+
+
+def recall(index, vals, queries, k_neighbor, nprobe=DEFAULT_NPROBE,
+           valid=None):
+    """Measures the recall of the k nearest neighbors
+
+    Args:
+        index (IVFIndex): the index
+        vals (numpy.ndarray): (num_rows, num_bins) model distributions
+        queries (numpy.ndarray): (num_queries, num_bins) distributions
+        k_neighbor (int): number of neighbors
+        nprobe (int, optional): number of lists to probe. Defaults to
+            DEFAULT_NPROBE
+        valid (numpy.ndarray, optional): boolean mask of the rows to
+            compare. Defaults to None, i.e. all
+
+    Returns:
+        tuple -- the ratio of the exact k nearest neighbors, which are
+        found by the index, and the mean ratio of the valid rows compared
+    """
+    queries = np.atleast_2d(np.asarray(queries, dtype=float))
+    valid = np.ones(len(vals), dtype=bool) if valid is None else valid
+    exact = distance.pairwise(queries, vals, index.dis_measure)
+    exact[:, ~valid] = np.inf
+    approx = index.distances(queries, vals, index.dis_measure, nprobe,
+                             valid, k_neighbor)
+
+    found = 0
+    for exact_dists, approx_dists in zip(exact, approx):
+        nearest = np.argsort(exact_dists, kind="stable")[:k_neighbor]
+        found += np.sum(~np.isnan(approx_dists[nearest]))
+    compared = np.mean(~np.isnan(approx[:, valid]))
+    return found / float(len(queries) * k_neighbor), float(compared)
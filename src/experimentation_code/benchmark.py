@@ -0,0 +1,298 @@
+"""Timing and peak memory of the pipeline steps, and regression checks
+
+A Recorder measures named steps over several runs. The wall time of a step
+is the minimum over the runs, which is the least noisy estimate. The peak
+memory is the peak of the memory allocated through Python (including the
+NumPy arrays) during the step, traced by tracemalloc. Tracing slows down
+the step, hence the runs, which trace the memory, are not timed.
+
+The results are saved as JSON::
+
+    {"metadata": {"python": ..., "numpy": ..., ...},
+     "benchmarks": {"<step>": {"wall_time": 0.1, "wall_times": [...],
+                               "peak_memory": 1048576}}}
+
+and compared with a saved baseline; a step regresses if it is slower or
+uses more memory than the baseline by more than a relative tolerance and a
+minimum absolute difference, which hides the noise of the very fast steps.
+
+The cold start of a module, i.e. what a worker process pays to import it,
+is measured in a new interpreter (see measure_startup). Its peak memory is
+the peak resident memory of the interpreter, which also lists the heavy
+modules it imports.
+"""
+import collections
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from . import cache
+
+METRICS = ("wall_time", "peak_memory")
+TOLERANCE = 0.25
+MIN_DELTAS = {"wall_time": 0.01, "peak_memory": 1 << 20}  # s, bytes
+
+# the modules, which the computing workers should not import
+HEAVY_MODULES = ("matplotlib", "sklearn", "scipy", "pandas", "morty",
+                 "essentia")
+
+# ru_maxrss is kept across fork and exec, i.e. it would include the memory
+# of the parent; the high-water mark of /proc is of the new interpreter
+_STARTUP_CODE = """import importlib, json, resource, sys
+importlib.import_module(sys.argv[1])
+max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+try:
+    with open("/proc/self/status") as f:
+        max_rss = int([line.split()[1] for line in f
+                       if line.startswith("VmHWM:")][0])
+except (OSError, IndexError):
+    pass
+print(json.dumps({
+    "max_rss": max_rss,
+    "modules": sorted(set(name.split(".")[0] for name in sys.modules))}))
+"""
+
+Regression = collections.namedtuple(
+    "Regression", ["name", "metric", "baseline", "value"])
+
+
+def measure(func, *args, trace_memory=False, **kwargs):
+    """Calls a function and measures it
+
+    Args:
+        func (callable): the function
+        *args: positional arguments of the function
+        trace_memory (bool, optional): measure the peak memory instead of
+            the wall time. Defaults to False
+        **kwargs: keyword arguments of the function
+
+    Returns:
+        tuple -- the result of the function, and the wall time in seconds
+        or the peak memory in bytes
+    """
+    if not trace_memory:
+        tic = time.perf_counter()
+        result = func(*args, **kwargs)
+        return result, time.perf_counter() - tic
+
+    was_tracing = tracemalloc.is_tracing()
+    if was_tracing:
+        tracemalloc.stop()  # resets the peak
+    tracemalloc.start()
+    try:
+        baseline, _ = tracemalloc.get_traced_memory()
+        result = func(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        if was_tracing:
+            tracemalloc.start()
+    return result, peak - baseline
+
+
+def measure_startup(module):
+    """Imports a module in a new interpreter and measures its cold start
+
+    The interpreter is this Python with the sys.path of this process.
+
+    Args:
+        module (str): name of the module, e.g. "dlfm_code.tester"
+
+    Returns:
+        tuple -- the wall time of the interpreter in seconds, its peak
+        resident memory in bytes and the top-level modules it imports
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        path for path in sys.path if path))
+    tic = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, "-c", _STARTUP_CODE, module], env=env, check=True,
+        stdout=subprocess.PIPE).stdout
+    wall_time = time.perf_counter() - tic
+
+    startup = json.loads(output.decode().splitlines()[-1])
+    return wall_time, startup["max_rss"] * 1024, startup["modules"]  # KiB
+
+
+class Recorder:
+    """Collects the measurements of named steps over several runs
+
+    Examples:
+        >>> recorder = Recorder()
+        >>> for run in range(3):
+        ...     recorder.trace_memory = run == 2
+        ...     recorder.run("train_multi", train_multi, *args)
+        >>> results = recorder.results(metadata())
+    """
+
+    def __init__(self, trace_memory=False):
+        """Creates an empty recorder
+
+        Args:
+            trace_memory (bool, optional): measure the peak memory of the
+                next runs instead of the wall time. Defaults to False
+        """
+        self.trace_memory = trace_memory
+        self.wall_times = collections.OrderedDict()
+        self.peak_memory = {}
+
+    def run(self, name, func, *args, **kwargs):
+        """Calls a function and records its measurement under a name
+
+        Args:
+            name (str): name of the step
+            func (callable): the function
+            *args: positional arguments of the function
+            **kwargs: keyword arguments of the function
+
+        Returns:
+            object -- the result of the function
+        """
+        result, value = measure(func, *args, trace_memory=self.trace_memory,
+                                **kwargs)
+        if self.trace_memory:
+            self.add(name, peak_memory=value)
+        else:
+            self.add(name, wall_time=value)
+        return result
+
+    def add(self, name, wall_time=None, peak_memory=None):
+        """Records a measurement taken elsewhere, e.g. in a subprocess
+
+        Args:
+            name (str): name of the step
+            wall_time (float, optional): wall time in seconds. Defaults to
+                None
+            peak_memory (int, optional): peak memory in bytes. Defaults to
+                None
+        """
+        self.wall_times.setdefault(name, [])
+        if wall_time is not None:
+            self.wall_times[name].append(wall_time)
+        if peak_memory is not None:
+            self.peak_memory[name] = max(peak_memory,
+                                         self.peak_memory.get(name, 0))
+
+    def results(self, meta=None):
+        """Summarizes the measurements
+
+        Args:
+            meta (dict, optional): metadata of the runs. Defaults to None
+
+        Returns:
+            dict -- the results, see the module docstring
+        """
+        benchmarks = collections.OrderedDict()
+        for name, wall_times in self.wall_times.items():
+            benchmarks[name] = {
+                "wall_time": min(wall_times) if wall_times else None,
+                "wall_times": wall_times,
+                "peak_memory": self.peak_memory.get(name)}
+        return {"metadata": meta or {}, "benchmarks": benchmarks}
+
+
+def metadata(**kwargs):
+    """Describes the environment of the runs
+
+    Args:
+        **kwargs: other metadata, e.g. the dataset size
+
+    Returns:
+        dict -- the metadata
+    """
+    meta = {"created": datetime.datetime.now().isoformat(),
+            "python": platform.python_version(), "numpy": np.__version__,
+            "platform": platform.platform(), "machine": platform.machine(),
+            "cpu_count": os.cpu_count(), "argv": sys.argv}
+    meta.update(kwargs)
+    return meta
+
+
+def save(results, path):
+    """Saves the results as JSON"""
+    cache.atomic_dump_json(results, path, indent=4)
+
+
+def load(path):
+    """dict -- the results saved in a JSON file"""
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(results, baseline, tolerance=TOLERANCE, min_deltas=None):
+    """Finds the steps, which regress wrt a baseline
+
+    The steps, which are missing in either the results or the baseline, are
+    not compared.
+
+    Args:
+        results (dict): the results
+        baseline (dict): the baseline results
+        tolerance (float, optional): allowed relative increase. Defaults to
+            TOLERANCE
+        min_deltas (dict, optional): allowed absolute increase of each
+            metric. Defaults to MIN_DELTAS
+
+    Returns:
+        list -- the Regressions
+    """
+    min_deltas = dict(MIN_DELTAS, **(min_deltas or {}))
+    regressions = []
+    for name, bench in results["benchmarks"].items():
+        base = baseline["benchmarks"].get(name)
+        if base is None:
+            continue
+        for metric in METRICS:
+            value, base_value = bench.get(metric), base.get(metric)
+            if value is None or base_value is None:
+                continue
+            if (value > base_value * (1 + tolerance) and
+                    value - base_value > min_deltas[metric]):
+                regressions.append(Regression(name, metric, base_value,
+                                              value))
+    return regressions
+
+
+def _format(metric, value):
+    if value is None:
+        return "-"
+    if metric == "wall_time":
+        return "{0:.3f} s".format(value)
+    return "{0:.1f} MiB".format(value / float(1 << 20))
+
+
+def report(results, baseline=None):
+    """Formats the results as a table
+
+    Args:
+        results (dict): the results
+        baseline (dict, optional): the baseline results to show the ratios
+            against. Defaults to None
+
+    Returns:
+        str -- the table
+    """
+    names = list(results["benchmarks"])
+    width = max([len(name) for name in names] + [4])
+    lines = ["{0:<{1:d}}  {2:>20s}  {3:>20s}".format(
+        "step", width, "wall time", "peak memory")]
+    for name in names:
+        bench = results["benchmarks"][name]
+        cells = []
+        for metric in METRICS:
+            cell = _format(metric, bench.get(metric))
+            base = (baseline or {}).get("benchmarks", {}).get(name, {})
+            if bench.get(metric) and base.get(metric):
+                cell += " ({0:.2f}x)".format(
+                    bench[metric] / float(base[metric]))
+            cells.append(cell)
+        lines.append("{0:<{1:d}}  {2:>20s}  {3:>20s}".format(
+            name, width, *cells))
+    return "\n".join(lines)
@@ -0,0 +1,311 @@
+"""Content-addressed cache of the experiment artifacts
+
+Each artifact (features, training model, test results, evaluation) is keyed
+on a hash of its parameters and of the keys or content hashes of its
+inputs. Changing an input, e.g. the pitch track of a recording, changes the
+keys of all the artifacts computed from it and only of those. A key is
+recorded in an append-only manifest (``manifest.jsonl``) after its artifact
+is completely written, so a resumed run finds all the valid artifacts with
+a single read of the manifest.
+
+The artifacts are saved at fixed paths, e.g. a row of a feature bank or a
+model file per fold, which are overwritten when the inputs change. Hence a
+key recorded with its parameters belongs to the slot of the artifact (its
+key without the inputs), and only the last key recorded in a slot is valid.
+A task invalidates the slots of its artifacts before overwriting them, so
+reverting an input, or interrupting the task, does not make the superseded
+keys valid again.
+
+The content hashes of the input files are kept in ``inputs.jsonl`` and
+reused as long as the size and the modification time of a file do not
+change.
+"""
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+
+MANIFEST_FILE = "manifest.jsonl"
+INPUT_FILE = "inputs.jsonl"
+OBJECT_FOLDER = "objects"
+LOCK_FILE = ".lock"
+CHUNK_SIZE = 2 ** 20
+
+
+def hash_obj(obj):
+    """Hashes a JSON-serializable object
+
+    Args:
+        obj (object): the object; dict keys are sorted before hashing
+
+    Returns:
+        str -- hex SHA-256 digest
+    """
+    text = json.dumps(obj, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def hash_file(path):
+    """Hashes the content of a file
+
+    Args:
+        path (str): path to the file
+
+    Returns:
+        str -- hex SHA-256 digest
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def artifact_key(kind, params, inputs=()):
+    """Computes the key of an artifact
+
+    Args:
+        kind (str): type of the artifact, e.g. "training"
+        params (dict): parameters, which the artifact is computed with
+        inputs (iterable, optional): keys or content hashes of the inputs.
+            Defaults to ()
+
+    Returns:
+        str -- hex SHA-256 digest
+    """
+    return hash_obj({"kind": kind, "params": params, "inputs": list(inputs)})
+
+
+def artifact_slot(kind, params):
+    """Computes the slot of an artifact, i.e. its key without the inputs
+
+    The artifacts in a slot are saved at the same path, hence only the last
+    one recorded is valid.
+
+    Args:
+        kind (str): type of the artifact, e.g. "training"
+        params (dict): parameters, which the artifact is computed with
+
+    Returns:
+        str -- hex SHA-256 digest
+    """
+    return artifact_key(kind, params)
+
+
+def atomic_write(path, data):
+    """Writes a file such that it is either complete or absent
+
+    The data is written into a temporary file in the same folder, which then
+    replaces the file.
+
+    Args:
+        path (str): path to the file
+        data (bytes or str): content of the file
+    """
+    tmp_file = "{0:s}.{1:d}.tmp".format(path, os.getpid())
+    mode = "wb" if isinstance(data, bytes) else "w"
+    with open(tmp_file, mode) as f:
+        f.write(data)
+    os.replace(tmp_file, path)
+
+
+def atomic_dump_json(obj, path, **kwargs):
+    """Dumps an object to a JSON file atomically
+
+    Args:
+        obj (object): JSON-serializable object
+        path (str): path to the file
+        **kwargs: arguments of json.dumps
+    """
+    atomic_write(path, json.dumps(obj, **kwargs))
+
+
+@contextlib.contextmanager
+def _lock(cache_folder):
+    with open(os.path.join(cache_folder, LOCK_FILE), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _append(cache_folder, filename, entry):
+    with _lock(cache_folder):
+        with open(os.path.join(cache_folder, filename), "ab") as f:
+            f.write((json.dumps(entry) + "\n").encode())
+
+
+def _entry(key, kind, params, has_value=False):
+    # the keys recorded without parameters have no slot and stay valid
+    return {"key": key, "kind": kind, "params": params,
+            "slot": None if params is None else artifact_slot(kind, params),
+            "has_value": has_value}
+
+
+def record(cache_folder, key, kind, params=None):
+    """Records an artifact, which is saved elsewhere, as valid
+
+    Unlike ResultCache.put, the manifest is not read, hence this is cheap to
+    call from the workers after each task.
+
+    Args:
+        cache_folder (str): folder of the cache
+        key (str): key of the artifact
+        kind (str): type of the artifact
+        params (dict, optional): parameters of the artifact. The key
+            supersedes the keys recorded before with the same kind and
+            parameters. Defaults to None
+    """
+    _append(cache_folder, MANIFEST_FILE, _entry(key, kind, params))
+
+
+def invalidate(cache_folder, kind, params):
+    """Invalidates the keys of a slot, e.g. before overwriting its artifact
+
+    Args:
+        cache_folder (str): folder of the cache
+        kind (str): type of the artifact
+        params (dict): parameters of the artifact
+    """
+    _append(cache_folder, MANIFEST_FILE, _entry(None, kind, params))
+
+
+def _read_jsonl(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, "rb") as f:
+        lines = f.read().splitlines(keepends=True)
+    # an interrupted write may leave an incomplete last line
+    return [json.loads(line) for line in lines if line.endswith(b"\n")]
+
+
+class ResultCache:
+    """Manifest of the valid artifacts and store of small results
+
+    Entries are appended from several processes under a lock file. An
+    instance reads the manifest once, hence the entries appended by other
+    processes afterwards are not visible to it.
+
+    Examples:
+        >>> cache = ResultCache("./data/cache")
+        >>> key = artifact_key("training", params, feature_keys)
+        >>> if key not in cache:
+        ...     train(...)
+        ...     cache.put(key, "training", params)
+    """
+
+    def __init__(self, cache_folder):
+        self.cache_folder = cache_folder
+        os.makedirs(os.path.join(cache_folder, OBJECT_FOLDER), exist_ok=True)
+
+        self._read_manifest()
+        self.input_hashes = {e["path"]: e for e in _read_jsonl(
+            os.path.join(cache_folder, INPUT_FILE))}
+
+    def _read_manifest(self):
+        self.entries = {}
+        self.slots = {}  # the last entry of each slot
+        for entry in _read_jsonl(os.path.join(self.cache_folder,
+                                              MANIFEST_FILE)):
+            self._add(entry)
+
+    def _add(self, entry):
+        if entry["key"] is not None:
+            self.entries[entry["key"]] = entry
+        if entry.get("slot") is not None:
+            self.slots[entry["slot"]] = entry
+
+    def __contains__(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return False
+        # a superseded or invalidated key is not valid
+        slot = entry.get("slot")
+        return slot is None or self.slots[slot]["key"] == key
+
+    def __len__(self):
+        return sum(key in self for key in self.entries)
+
+    def _object_file(self, key):
+        return os.path.join(self.cache_folder, OBJECT_FOLDER, key + ".json")
+
+    def put(self, key, kind, params=None, value=None):
+        """Records an artifact as valid
+
+        Args:
+            key (str): key of the artifact
+            kind (str): type of the artifact
+            params (dict, optional): parameters of the artifact, stored for
+                inspection. Defaults to None
+            value (object, optional): JSON-serializable result to store in
+                the cache. Defaults to None, i.e. the artifact is saved
+                elsewhere
+        """
+        entry = _entry(key, kind, params, value is not None)
+        if value is not None:  # write the object before committing the key
+            atomic_dump_json(value, self._object_file(key))
+        _append(self.cache_folder, MANIFEST_FILE, entry)
+        self._add(entry)
+
+    def get(self, key):
+        """Reads a result stored in the cache
+
+        Args:
+            key (str): key of the artifact
+
+        Raises:
+            KeyError: if the key is not valid or has no stored value
+
+        Returns:
+            object -- the stored value
+        """
+        if key not in self or not self.entries[key]["has_value"]:
+            raise KeyError(key)
+        with open(self._object_file(key)) as f:
+            return json.load(f)
+
+    def hash_input(self, path):
+        """Hashes the content of an input file
+
+        The hash is recomputed only if the size or the modification time
+        of the file changes.
+
+        Args:
+            path (str): path to the file
+
+        Returns:
+            str -- hex SHA-256 digest
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        entry = self.input_hashes.get(path)
+        if (entry is None or entry["size"] != stat.st_size or
+                entry["mtime_ns"] != stat.st_mtime_ns):
+            entry = {"path": path, "size": stat.st_size,
+                     "mtime_ns": stat.st_mtime_ns, "hash": hash_file(path)}
+            _append(self.cache_folder, INPUT_FILE, entry)
+            self.input_hashes[path] = entry
+        return entry["hash"]
+
+    def compact(self):
+        """Rewrites the manifest and the input hashes without duplicates
+
+        The superseded keys are dropped from the manifest. Its entries are
+        read again, since the other processes may have appended to it.
+        """
+        with _lock(self.cache_folder):
+            self._read_manifest()
+            entries = [e for key, e in self.entries.items() if key in self]
+            entries += [e for e in self.slots.values() if e["key"] is None]
+            atomic_write(os.path.join(self.cache_folder, MANIFEST_FILE),
+                         "".join(json.dumps(e) + "\n" for e in entries))
+            self._read_manifest()
+
+            path = os.path.join(self.cache_folder, INPUT_FILE)
+            input_hashes = {e["path"]: e for e in _read_jsonl(path)}
+            input_hashes.update(self.input_hashes)
+            atomic_write(path, "".join(json.dumps(e) + "\n"
+                                       for e in input_hashes.values()))
+            self.input_hashes = input_hashes
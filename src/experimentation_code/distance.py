@@ -0,0 +1,77 @@
+"""Distance and dissimilarity measures between distributions
+
+The measures are computed between every query and every reference
+distribution in a single broadcast over the bins. Each pair is reduced with
+the same elementwise operations regardless of how many pairs are computed
+at once, hence scoring queries one by one or in a batch gives bit-identical
+results.
+"""
+import numpy as np
+
+DISTANCE_MEASURES = ("l1", "l2", "l3", "bhat", "dis_intersect", "dis_corr")
+MAX_ELEMENTS = 2 ** 23  # bound of the temporary (queries x refs x bins) array
+
+
+def _minkowski(degree):
+    def func(queries, refs):
+        diff = np.abs(queries[:, None, :] - refs[None, :, :])
+        if degree == 1:
+            return diff.sum(axis=-1)
+        return (diff ** degree).sum(axis=-1) ** (1.0 / degree)
+    return func
+
+
+def _bhat(queries, refs):
+    coeff = np.sqrt(queries[:, None, :] * refs[None, :, :]).sum(axis=-1)
+    with np.errstate(divide="ignore"):
+        return -np.log(coeff)
+
+
+def _dis_intersect(queries, refs):
+    return 1.0 - np.minimum(queries[:, None, :], refs[None, :, :]).sum(axis=-1)
+
+
+def _dis_corr(queries, refs):
+    queries = queries - queries.mean(axis=-1, keepdims=True)
+    refs = refs - refs.mean(axis=-1, keepdims=True)
+    num = (queries[:, None, :] * refs[None, :, :]).sum(axis=-1)
+    den = np.sqrt((queries ** 2).sum(axis=-1)[:, None] *
+                  (refs ** 2).sum(axis=-1)[None, :])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return 1.0 - num / den
+
+
+_MEASURES = {"l1": _minkowski(1), "l2": _minkowski(2), "l3": _minkowski(3),
+             "bhat": _bhat, "dis_intersect": _dis_intersect,
+             "dis_corr": _dis_corr}
+
+
+def pairwise(queries, refs, dis_measure):
+    """Computes the distance between each query and each reference
+
+    Args:
+        queries (numpy.ndarray): (num_queries, num_bins) distributions
+        refs (numpy.ndarray): (num_refs, num_bins) distributions
+        dis_measure (str): one of DISTANCE_MEASURES
+
+    Raises:
+        ValueError: if the distance measure is unknown
+
+    Returns:
+        numpy.ndarray -- (num_queries, num_refs) distances
+    """
+    try:
+        func = _MEASURES[dis_measure]
+    except KeyError:
+        raise ValueError("Unknown dis_measure: {0:s}".format(dis_measure))
+
+    queries = np.atleast_2d(np.asarray(queries, dtype=float))
+    refs = np.atleast_2d(np.asarray(refs, dtype=float))
+
+    # chunk the queries to bound the memory of the broadcast
+    chunk_size = max(1, MAX_ELEMENTS // max(1, refs.size))
+    dists = np.empty((len(queries), len(refs)))
+    for start in range(0, len(queries), chunk_size):
+        stop = start + chunk_size
+        dists[start:stop] = func(queries[start:stop], refs)
+    return dists
@@ -0,0 +1,544 @@
+"""Pitch (PD) and pitch-class (PCD) distributions computed with NumPy
+
+All the distributions of a recording in a parameter grid are derived from a
+single pass over its pitch track: the track is converted to cents once and
+binned once into a fine histogram, whose resolution divides every requested
+step size. Each coarser histogram is then a reshape-and-sum of the fine one,
+the PCDs are circular foldings and the Gaussian kernels are applied to all
+kernel widths of a step size in one matrix product. The fine histograms are
+accumulated chunk by chunk, so a long or live recording does not have to be
+held in memory (see DistributionAccumulator).
+
+The bins of a PD span the fixed range ``PD_RANGE`` (in cents wrt the
+reference frequency) so that the distributions of all recordings have the
+same shape. The bins of a PCD span [0, 1200) cents. Bins are centered on the
+multiples of the step size, i.e. the reference frequency is a bin center.
+"""
+import collections
+import itertools
+import math
+from fractions import Fraction
+from functools import reduce
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+CENTS_PER_OCTAVE = 1200
+PD_RANGE = (-2400, 4800)  # cents wrt reference frequency, [lo, hi)
+MIN_FREQ = 20.0  # Hz, lower values are treated as unvoiced
+KERNEL_SPAN = 3  # truncate the Gaussian kernels at 3 standard deviations
+
+DISTRIBUTION_TYPES = ("pd", "pcd")
+
+Distribution = collections.namedtuple(
+    "Distribution",
+    ["bins", "vals", "distribution_type", "step_size", "kernel_width"])
+
+
+def get_hz_track(pitch):
+    """Returns the pitch values in Hz of a pitch track
+
+    Args:
+        pitch (numpy.ndarray): pitch values in Hz; either 1D or the
+            (time, pitch, ...) matrix in the .pitch files
+
+    Returns:
+        numpy.ndarray -- 1D pitch values in Hz
+    """
+    pitch = np.asarray(pitch)
+    return pitch[:, 1] if pitch.ndim == 2 else pitch
+
+
+def hz_to_cent(hz_track, ref_freq, min_freq=MIN_FREQ):
+    """Converts a pitch track in Hz to cents wrt a reference frequency
+
+    Args:
+        hz_track (numpy.ndarray): pitch values in Hz
+        ref_freq (float): reference frequency in Hz, e.g. the tonic
+        min_freq (float, optional): values below are discarded as unvoiced.
+            Defaults to MIN_FREQ
+
+    Returns:
+        numpy.ndarray -- pitch values of the voiced frames in cents
+    """
+    hz_track = np.asarray(hz_track, dtype=float)
+    hz_track = hz_track[hz_track > min_freq]
+    return CENTS_PER_OCTAVE * np.log2(hz_track / ref_freq)
+
+
+def cent_to_hz(cent_track, ref_freq):
+    """Converts cent values wrt a reference frequency to Hz
+
+    Args:
+        cent_track (numpy.ndarray): values in cents
+        ref_freq (float): reference frequency in Hz
+
+    Returns:
+        numpy.ndarray -- values in Hz
+    """
+    return ref_freq * 2.0 ** (np.asarray(cent_track) / CENTS_PER_OCTAVE)
+
+
+def is_valid_combination(step_size, kernel_width):
+    """Checks if a (step_size, kernel_width) pair is in the experiments
+
+    Combinations, in which the kernel is narrower than a third of the step
+    size, are not tested since the smoothing is negligible.
+
+    Args:
+        step_size (float): bin size in cents
+        kernel_width (float): standard deviation of the Gaussian kernel
+
+    Returns:
+        bool -- True if the combination is used in the experiments
+    """
+    return kernel_width == 0 or 3 * kernel_width >= step_size
+
+
+def get_param_grid(step_sizes, kernel_widths,
+                   distribution_types=DISTRIBUTION_TYPES):
+    """Expands the distribution parameters into (type, step, kernel) tuples
+
+    Args:
+        step_sizes (list): bin sizes in cents
+        kernel_widths (list): standard deviations of the Gaussian kernels
+        distribution_types (tuple, optional): "pd" and/or "pcd"
+
+    Returns:
+        list -- valid (distribution_type, step_size, kernel_width) tuples
+    """
+    return [(dt, ss, kw) for dt, ss, kw in itertools.product(
+        distribution_types, step_sizes, kernel_widths)
+        if is_valid_combination(ss, kw)]
+
+
+def get_bins(step_size, distribution_type):
+    """Returns the bin centers of a distribution
+
+    Args:
+        step_size (float): bin size in cents
+        distribution_type (str): "pd" or "pcd"
+
+    Returns:
+        numpy.ndarray -- bin centers in cents
+    """
+    if distribution_type == "pd":
+        lo, hi = PD_RANGE
+    elif distribution_type == "pcd":
+        lo, hi = 0, CENTS_PER_OCTAVE
+    else:
+        raise ValueError("Unknown distribution_type: {0:s}".format(
+            distribution_type))
+    return lo + step_size * np.arange(_num_steps(hi - lo, step_size))
+
+
+def _num_steps(span, step_size):
+    num_steps = Fraction(str(span)) / Fraction(str(step_size))
+    if num_steps.denominator != 1:
+        raise ValueError("{0} cents is not a multiple of the step size "
+                         "{1}".format(span, step_size))
+    return int(num_steps)
+
+
+def _fine_resolution(step_sizes):
+    # the bin edges are at odd multiples of half-steps; their greatest
+    # common divisor gives a grid, which includes the edges of all steps
+    half_steps = [Fraction(str(ss)) / 2 for ss in step_sizes]
+    gcd = reduce(lambda a, b: Fraction(
+        math.gcd(a.numerator * b.denominator, b.numerator * a.denominator),
+        a.denominator * b.denominator), half_steps)
+    return gcd
+
+
+def _gaussian_kernels(step_size, kernel_widths):
+    """Stacks the unit-sum Gaussian kernels of a step size into a matrix"""
+    half_lens = [int(np.ceil(KERNEL_SPAN * kw / step_size))
+                 for kw in kernel_widths]
+    half_len = max(half_lens)
+    offsets = step_size * np.arange(-half_len, half_len + 1)
+
+    kernels = np.zeros((len(kernel_widths), len(offsets)))
+    for i, (kw, hl) in enumerate(zip(kernel_widths, half_lens)):
+        if kw == 0:
+            kernels[i, half_len] = 1.0
+        else:
+            support = slice(half_len - hl, half_len + hl + 1)
+            kernels[i, support] = np.exp(
+                -0.5 * (offsets[support] / kw) ** 2)
+            kernels[i] /= kernels[i].sum()
+    return kernels, half_len
+
+
+def smooth(vals, kernels, half_len, circular):
+    """Convolves histograms with a stack of symmetric kernels
+
+    Args:
+        vals (numpy.ndarray): histograms, the last axis is the bins
+        kernels (numpy.ndarray): (num_kernels, 2 * half_len + 1) kernels
+        half_len (int): half length of the kernels
+        circular (bool): wrap around the edges (PCD) or zero-pad (PD)
+
+    Returns:
+        numpy.ndarray -- smoothed histograms with the shape
+        vals.shape[:-1] + (num_kernels, num_bins)
+    """
+    pad_width = [(0, 0)] * (vals.ndim - 1) + [(half_len, half_len)]
+    padded = np.pad(vals, pad_width, mode="wrap" if circular else "constant")
+    windows = sliding_window_view(padded, kernels.shape[1], axis=-1)
+
+    # the kernels are symmetric, so correlation equals convolution
+    smoothed = windows @ kernels.T  # (..., num_bins, num_kernels)
+    return np.swapaxes(smoothed, -1, -2)
+
+
+def compute_distributions(hz_track, ref_freq, params):
+    """Computes all distributions of a pitch track in a parameter grid
+
+    Args:
+        hz_track (numpy.ndarray): pitch values in Hz; either 1D or the
+            (time, pitch, ...) matrix in the .pitch files
+        ref_freq (float): reference frequency in Hz, e.g. the tonic
+        params (list): (distribution_type, step_size, kernel_width) tuples,
+            e.g. as returned by get_param_grid
+
+    Returns:
+        dict -- Distribution per (distribution_type, step_size, kernel_width)
+        tuple. The values are the (smoothed) bin counts, i.e. not normalized
+    """
+    accumulator = DistributionAccumulator(ref_freq, params)
+    accumulator.update(hz_track)
+    return accumulator.distributions()
+
+
+class DistributionAccumulator:
+    """Accumulates the distributions of a pitch track fed in chunks
+
+    Only the fine histograms are kept, hence the memory does not depend on
+    the length of the recording, and a chunk is added in time linear to its
+    length. The distributions are identical to compute_distributions on the
+    whole track and can be read at any point, e.g. to update the estimates
+    during a live performance.
+
+    Examples:
+        >>> accumulator = DistributionAccumulator(tonic, params)
+        >>> for chunk in iter_pitch_chunks("recording.pitch"):
+        ...     accumulator.update(chunk)
+        ...     accumulator.estimate_mode(model)
+    """
+
+    def __init__(self, ref_freq, params):
+        """Creates an empty accumulator
+
+        Args:
+            ref_freq (float): reference frequency in Hz, e.g. the tonic. If
+                the tonic is unknown, any frequency in the pitch range of
+                the recording, e.g. the reference_frequency of the first
+                chunk, can be used to estimate it
+            params (list): (distribution_type, step_size, kernel_width)
+                tuples, e.g. as returned by get_param_grid
+        """
+        self.ref_freq = ref_freq
+        self.params = [(dt, float(ss), float(kw)) for dt, ss, kw in params]
+        self.step_sizes = sorted(set(ss for _, ss, _ in self.params))
+        self.num_frames = 0
+
+        # the fine PD histogram starts half of the largest step below the
+        # lowest bin center
+        self._resolution = _fine_resolution(self.step_sizes)
+        self._max_half_step = Fraction(str(max(self.step_sizes))) / 2
+        min_half_step = Fraction(str(min(self.step_sizes))) / 2
+        self._fine_lo = PD_RANGE[0] - self._max_half_step
+        num_fine = int((PD_RANGE[1] - min_half_step - self._fine_lo) /
+                       self._resolution)
+        num_fine_pc = int(CENTS_PER_OCTAVE / self._resolution)
+        self._fine_hist = np.zeros(num_fine, dtype=np.int64)
+        self._fine_pc_hist = np.zeros(num_fine_pc, dtype=np.int64)
+
+    def update(self, hz_chunk):
+        """Adds the frames of a chunk of the pitch track
+
+        Args:
+            hz_chunk (numpy.ndarray): pitch values in Hz; either 1D or the
+                (time, pitch, ...) matrix in the .pitch files
+        """
+        cents = hz_to_cent(get_hz_track(hz_chunk), self.ref_freq)
+        self.num_frames += len(cents)
+
+        num_fine = len(self._fine_hist)
+        fine_idx = np.floor((cents - float(self._fine_lo)) /
+                            float(self._resolution))
+        fine_idx = fine_idx[(fine_idx >= 0) & (fine_idx < num_fine)]
+        self._fine_hist += np.bincount(fine_idx.astype(int),
+                                       minlength=num_fine)
+
+        # the pitch-class histogram folds all octaves at the fine
+        # resolution; fine bin 0 starts at 0 cents
+        num_fine_pc = len(self._fine_pc_hist)
+        pc_idx = np.floor(np.mod(cents, CENTS_PER_OCTAVE) /
+                          float(self._resolution))
+        self._fine_pc_hist += np.bincount(
+            np.mod(pc_idx.astype(int), num_fine_pc), minlength=num_fine_pc)
+
+    def distributions(self):
+        """Computes the distributions of the frames added so far
+
+        Returns:
+            dict -- Distribution per (distribution_type, step_size,
+            kernel_width) tuple. The values are the (smoothed) bin counts
+        """
+        distributions = {}
+        for ss in self.step_sizes:
+            bins_per_step = int(Fraction(str(ss)) / self._resolution)
+            half = bins_per_step // 2
+
+            coarse = {}
+            # PD: coarse bin j spans
+            # [lo + (j - 1/2) * ss, lo + (j + 1/2) * ss)
+            num_pd = len(get_bins(ss, "pd"))
+            start = int((self._max_half_step - Fraction(str(ss)) / 2) /
+                        self._resolution)
+            coarse["pd"] = self._fine_hist[
+                start:start + num_pd * bins_per_step].reshape(
+                    num_pd, bins_per_step).sum(axis=1)
+            # PCD: bin 0 spans [-ss/2, ss/2), i.e. wraps around 0 cents
+            coarse["pcd"] = np.roll(self._fine_pc_hist, half).reshape(
+                -1, bins_per_step).sum(axis=1)
+
+            for dt in DISTRIBUTION_TYPES:
+                kernel_widths = [kw for dt_, ss_, kw in self.params
+                                 if dt_ == dt and ss_ == ss]
+                if not kernel_widths:
+                    continue
+
+                kernels, half_len = _gaussian_kernels(ss, kernel_widths)
+                smoothed = smooth(coarse[dt].astype(float), kernels,
+                                  half_len, circular=dt == "pcd")
+                bins = get_bins(ss, dt)
+                for kw, vals in zip(kernel_widths, smoothed):
+                    distributions[(dt, ss, kw)] = Distribution(
+                        bins, vals, dt, ss, kw)
+
+        return distributions
+
+    def query(self, model):
+        """Computes the normalized distribution with the parameters of a model
+
+        Args:
+            model (knn.KNNModel): the model; its parameters should be in the
+                params of the accumulator
+
+        Returns:
+            numpy.ndarray -- the normalized distribution
+        """
+        key = (model.distribution_type, float(model.step_size),
+               float(model.kernel_width))
+        if key not in self.params:
+            raise ValueError("{0} is not accumulated".format(key))
+        return normalize(self.distributions()[key].vals)
+
+    def estimate_mode(self, model, **kwargs):
+        """Estimates the mode, when the reference frequency is the tonic
+
+        Args:
+            model (knn.KNNModel): the model
+            **kwargs: arguments of KNNModel.score_modes
+
+        Returns:
+            list -- [mode, distance] pairs
+        """
+        return model.score_modes([self.query(model)], **kwargs)[0]
+
+    def estimate_tonic(self, model, mode, min_peak_ratio=0.15, **kwargs):
+        """Estimates the tonic of the frames added so far with known mode
+
+        Args:
+            model (knn.KNNModel): the model
+            mode (str): mode of the recording
+            min_peak_ratio (float, optional): minimum ratio of a tonic
+                candidate peak to the highest peak. Defaults to 0.15
+            **kwargs: arguments of KNNModel.score_tonics
+
+        Returns:
+            list -- [tonic, distance] pairs
+        """
+        candidates = model.get_peaks(self.query(model), self.ref_freq,
+                                     min_peak_ratio)
+        return model.score_tonics([candidates], [mode], **kwargs)[0]
+
+    def estimate_joint(self, model, min_peak_ratio=0.15, **kwargs):
+        """Jointly estimates the tonic and the mode of the frames added so far
+
+        Args:
+            model (knn.KNNModel): the model
+            min_peak_ratio (float, optional): minimum ratio of a tonic
+                candidate peak to the highest peak. Defaults to 0.15
+            **kwargs: arguments of KNNModel.score_joint
+
+        Returns:
+            list -- [[tonic, mode], distance] pairs
+        """
+        candidates = model.get_peaks(self.query(model), self.ref_freq,
+                                     min_peak_ratio)
+        return model.score_joint([candidates], **kwargs)[0]
+
+
+def iter_pitch_chunks(pitch, chunk_size=4096):
+    """Yields the pitch values of a track in chunks
+
+    Args:
+        pitch (str or numpy.ndarray): path to a .pitch file, which is read
+            chunk by chunk, or pitch values as in get_hz_track, e.g. a
+            memory-mapped track of the pitch store
+        chunk_size (int, optional): number of frames per chunk. Defaults to
+            4096
+
+    Yields:
+        numpy.ndarray -- 1D pitch values in Hz
+    """
+    if isinstance(pitch, str):
+        with open(pitch) as f:
+            while True:
+                lines = list(itertools.islice(f, chunk_size))
+                if not lines:
+                    return
+                yield get_hz_track(np.loadtxt(lines, ndmin=2))
+    else:
+        hz_track = get_hz_track(pitch)
+        for start in range(0, len(hz_track), chunk_size):
+            yield hz_track[start:start + chunk_size]
+
+
+def compute_distribution(hz_track, ref_freq, step_size, kernel_width,
+                         distribution_type):
+    """Computes a single distribution of a pitch track
+
+    Args:
+        hz_track (numpy.ndarray): pitch values in Hz
+        ref_freq (float): reference frequency in Hz, e.g. the tonic
+        step_size (float): bin size in cents
+        kernel_width (float): standard deviation of the Gaussian kernel in
+            cents; 0 for no smoothing
+        distribution_type (str): "pd" or "pcd"
+
+    Returns:
+        Distribution -- the (smoothed) bin counts
+    """
+    key = (distribution_type, float(step_size), float(kernel_width))
+    return compute_distributions(hz_track, ref_freq, [key])[key]
+
+
+def to_dict(dist, ref_freq=None):
+    """Converts a distribution to a JSON-serializable dict
+
+    The dict has the keys of morty's PitchDistribution.to_dict, the format
+    of the JSON features and models in the Zenodo data.
+
+    Args:
+        dist (Distribution): the distribution
+        ref_freq (float, optional): reference frequency in Hz. Defaults to
+            None
+
+    Returns:
+        dict -- the distribution
+    """
+    return {"bins": np.asarray(dist.bins, dtype=float).tolist(),
+            "vals": np.asarray(dist.vals, dtype=float).tolist(),
+            "kernel_width": dist.kernel_width, "ref_freq": ref_freq,
+            "step_size": dist.step_size}
+
+
+def from_dict(pdict):
+    """Reads a distribution from a dict in the format of to_dict
+
+    Args:
+        pdict (dict): the distribution, e.g. a JSON feature in the Zenodo
+            data
+
+    Returns:
+        Distribution -- the distribution; it is a PCD if its bins are in
+        [0, 1200) cents
+    """
+    bins = np.array(pdict["bins"], dtype=float)
+    step_size = pdict.get("step_size") or float(bins[1] - bins[0])
+    is_pcd = bins.min() >= 0 and bins.max() < CENTS_PER_OCTAVE
+    return Distribution(bins, np.array(pdict["vals"], dtype=float),
+                        "pcd" if is_pcd else "pd", step_size,
+                        pdict.get("kernel_width"))
+
+
+def normalize(vals):
+    """Normalizes distributions to unit sum along the last axis
+
+    Args:
+        vals (numpy.ndarray): distribution(s)
+
+    Returns:
+        numpy.ndarray -- probability density function(s)
+    """
+    vals = np.asarray(vals, dtype=float)
+    total = vals.sum(axis=-1, keepdims=True)
+    return np.divide(vals, total, out=np.zeros_like(vals), where=total > 0)
+
+
+def detect_peaks(vals, min_peak_ratio=0.15, circular=False):
+    """Detects the peaks of a distribution
+
+    A peak is a local maximum, which is at least min_peak_ratio times the
+    highest value. The first bin of a plateau is reported.
+
+    Args:
+        vals (numpy.ndarray): values of the distribution
+        min_peak_ratio (float, optional): minimum ratio of a peak to the
+            highest value. Defaults to 0.15
+        circular (bool, optional): wrap around the edges, e.g. for PCDs.
+            Defaults to False
+
+    Returns:
+        numpy.ndarray -- indices of the peaks, sorted by decreasing height
+    """
+    vals = np.asarray(vals, dtype=float)
+    is_peak = local_maxima(vals, circular) & (
+        vals >= min_peak_ratio * vals.max())
+    peak_idx = np.flatnonzero(is_peak)
+    return peak_idx[np.argsort(-vals[peak_idx], kind="stable")]
+
+
+def local_maxima(vals, circular=False):
+    """Marks the positive local maxima of distributions
+
+    The first bin of a plateau is marked. The peaks of any min_peak_ratio
+    are the local maxima, whose ratio to the highest value reaches it.
+
+    Args:
+        vals (numpy.ndarray): (..., num_bins) values of the distributions
+        circular (bool, optional): wrap around the edges, e.g. for PCDs.
+            Defaults to False
+
+    Returns:
+        numpy.ndarray -- boolean mask with the shape of vals
+    """
+    vals = np.asarray(vals, dtype=float)
+    left = np.roll(vals, 1, axis=-1)
+    right = np.roll(vals, -1, axis=-1)
+    if not circular:
+        left[..., 0] = -np.inf
+        right[..., -1] = -np.inf
+    return (vals > left) & (vals >= right) & (vals > 0)
+
+
+def reference_frequency(hz_track, min_freq=MIN_FREQ):
+    """Returns a reference frequency for a recording with unknown tonic
+
+    The median of the voiced frames is used, so that the pitch range of the
+    recording is centered in the PD range.
+
+    Args:
+        hz_track (numpy.ndarray): pitch values in Hz
+        min_freq (float, optional): values below are discarded as unvoiced.
+            Defaults to MIN_FREQ
+
+    Returns:
+        float -- reference frequency in Hz
+    """
+    hz_track = get_hz_track(hz_track).astype(float)
+    return float(np.median(hz_track[hz_track > min_freq]))
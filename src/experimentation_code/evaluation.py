@@ -0,0 +1,336 @@
+"""Vectorized evaluation of tonic identification and mode recognition
+
+The estimates of many configurations are evaluated at once from a
+(num_configs, num_samples) matrix, where each column is a test recording
+and the fold it is tested in. The annotations are looked up through an
+index built once per dataset.
+
+A tonic estimate is correct if it is within TONIC_TOLERANCE cents of the
+annotated tonic, regardless of the octave. The cent deviations are
+octave-wrapped into [-600, 600). The accuracy of a configuration is the
+average of its fold accuracies. Missing estimates (NaN tonics or None modes)
+are counted as wrong.
+"""
+import collections
+
+import numpy as np
+
+from . import distribution
+
+TONIC_TOLERANCE = 20.0  # cents
+EXPERIMENT_TYPES = ("tonic", "mode", "joint")
+
+Evaluation = collections.namedtuple("Evaluation", [
+    "experiment_type", "num_samples", "tonic_correct", "tonic_deviations",
+    "mode_correct", "confusion", "joint_correct"])
+Evaluation.__doc__ = """Evaluation of the estimates of several configurations
+
+Fields, which do not apply to the experiment type, are None.
+
+- num_samples: (num_folds,) number of test samples per fold
+- tonic_correct: (num_configs, num_folds) correct tonic estimates per fold
+- tonic_deviations: (num_configs, num_samples) octave-wrapped deviations
+    of the tonic estimates in cents, NaN if missing
+- mode_correct: (num_configs, num_folds) correct mode estimates per fold
+- confusion: (num_configs, num_folds, num_modes, num_modes) confusion
+    matrices per fold, rows are the annotated and columns are the estimated
+    modes
+- joint_correct: (num_configs, num_folds) samples with both estimates correct
+"""
+
+
+class AnnotationIndex:
+    """Annotations of a dataset as arrays indexed by MBID
+
+    Examples:
+        >>> index = AnnotationIndex(annotations)
+        >>> index.tonics[index.rows(mbids)]
+    """
+
+    def __init__(self, annotations):
+        self.mbids = np.array([anno["mbid"].split("/")[-1]
+                               for anno in annotations])
+        self.modes = np.array([anno["makam"] for anno in annotations])
+        self.tonics = np.array([anno["tonic"] for anno in annotations],
+                               dtype=float)
+        self.mode_labels, self.mode_idx = np.unique(self.modes,
+                                                    return_inverse=True)
+        self.index = {mbid: row for row, mbid in enumerate(self.mbids)}
+
+    def __len__(self):
+        return len(self.mbids)
+
+    def rows(self, mbids):
+        """Looks up the rows of recordings
+
+        Args:
+            mbids (iterable): MBIDs of the recordings
+
+        Raises:
+            KeyError: if an MBID is not annotated
+
+        Returns:
+            numpy.ndarray -- row indices
+        """
+        return np.array([self.index[mbid] for mbid in mbids], dtype=int)
+
+    def mode_indices(self, modes):
+        """Converts mode names to label indices
+
+        Args:
+            modes (numpy.ndarray): mode names; None or unknown names are
+                converted to -1
+
+        Returns:
+            numpy.ndarray -- label indices with the same shape
+        """
+        modes = np.asarray(modes, dtype=object)
+        idx = np.searchsorted(self.mode_labels, modes.astype(str))
+        idx = np.minimum(idx, len(self.mode_labels) - 1)
+        return np.where(self.mode_labels[idx] == modes.astype(str), idx, -1)
+
+
+def cent_deviation(estimated, annotated):
+    """Computes the octave-wrapped deviation of tonic estimates in cents
+
+    Args:
+        estimated (numpy.ndarray): estimated tonics in Hz
+        annotated (numpy.ndarray): annotated tonics in Hz, broadcastable to
+            estimated
+
+    Returns:
+        numpy.ndarray -- deviations in [-600, 600) cents
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cents = distribution.CENTS_PER_OCTAVE * np.log2(
+            np.asarray(estimated, dtype=float) / annotated)
+    return _wrap_octave(cents)
+
+
+def _wrap_octave(cents):
+    half_octave = distribution.CENTS_PER_OCTAVE / 2
+    return np.mod(cents + half_octave,
+                  distribution.CENTS_PER_OCTAVE) - half_octave
+
+
+def deviation_histogram(deviations, step_size):
+    """Counts the tonic deviations in octave-wrapped bins
+
+    The bins are centered at the multiples of the step size in [0, 1200)
+    cents as in a pitch-class distribution.
+
+    Args:
+        deviations (numpy.ndarray): (..., num_samples) deviations in cents,
+            the NaN values are ignored
+        step_size (float): bin width in cents
+
+    Returns:
+        numpy.ndarray -- (..., num_bins) counts
+    """
+    deviations = np.asarray(deviations, dtype=float)
+    num_bins = len(distribution.get_bins(step_size, "pcd"))
+    valid = ~np.isnan(deviations)
+    idx = np.mod(np.round(np.where(valid, deviations, 0) / step_size),
+                 num_bins).astype(int)
+
+    # offset the bins of each histogram to count all in a single bincount
+    lead_shape = deviations.shape[:-1]
+    offsets = np.arange(int(np.prod(lead_shape))).reshape(
+        lead_shape + (1,)) * num_bins
+    counts = np.bincount((idx + offsets)[valid],
+                         minlength=num_bins * offsets.size)
+    return counts.reshape(lead_shape + (num_bins,))
+
+
+def min_peak_ratio_curve(vals, bins, min_peak_ratios, circular=False,
+                         tolerance=TONIC_TOLERANCE):
+    """Counts the tonic candidates of distributions for many peak ratios
+
+    The peaks and their ratios to the highest peak are detected once, and
+    each min_peak_ratio is answered by counting the ratios above it. The
+    distributions are computed wrt the annotated tonic, hence a peak is the
+    tonic if its bin is within the tolerance of 0 cents, in any octave.
+
+    Args:
+        vals (numpy.ndarray): (num_recordings, num_bins) distributions
+        bins (numpy.ndarray): bin centers in cents wrt the tonic
+        min_peak_ratios (numpy.ndarray): thresholds to evaluate
+        circular (bool, optional): wrap around the edges, e.g. for PCDs.
+            Defaults to False
+        tolerance (float, optional): tonic tolerance in cents. Defaults to
+            TONIC_TOLERANCE
+
+    Returns:
+        tuple -- the number of recordings with the tonic among the peaks
+        and the total number of peaks for each min_peak_ratio
+    """
+    vals = np.atleast_2d(np.asarray(vals, dtype=float))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratios = vals / vals.max(axis=1, keepdims=True)
+    ratios = np.where(distribution.local_maxima(vals, circular), ratios,
+                      -np.inf)
+
+    # the recording has the tonic among its peaks, if its highest tonic
+    # peak reaches the threshold
+    is_tonic = np.abs(_wrap_octave(np.asarray(bins, dtype=float))) <= \
+        tolerance
+    tonic_ratios = np.sort(ratios[:, is_tonic].max(axis=1, initial=-np.inf))
+    peak_ratios = np.sort(ratios[np.isfinite(ratios)])
+
+    min_peak_ratios = np.asarray(min_peak_ratios, dtype=float)
+    num_tonic_in_peaks = len(tonic_ratios) - np.searchsorted(
+        tonic_ratios, min_peak_ratios, side="left")
+    num_peaks = len(peak_ratios) - np.searchsorted(
+        peak_ratios, min_peak_ratios, side="left")
+    return num_tonic_in_peaks, num_peaks
+
+
+def _per_fold(correct, fold_idx, num_folds):
+    """Sums the (num_configs, num_samples) booleans per fold"""
+    offsets = np.arange(len(correct))[:, None] * num_folds
+    return np.bincount((fold_idx[None, :] + offsets).ravel(),
+                       weights=correct.ravel(),
+                       minlength=len(correct) * num_folds).reshape(
+                           len(correct), num_folds).astype(int)
+
+
+def evaluate(index, experiment_type, mbids, fold_idx, tonics=None,
+             modes=None, tolerance=TONIC_TOLERANCE):
+    """Evaluates the estimates of several configurations at once
+
+    Args:
+        index (AnnotationIndex): annotations of the dataset
+        experiment_type (str): "tonic", "mode" or "joint"
+        mbids (list): (num_samples,) MBID of each test sample
+        fold_idx (numpy.ndarray): (num_samples,) fold of each test sample
+        tonics (numpy.ndarray, optional): (num_configs, num_samples)
+            estimated tonics in Hz. Required for "tonic" and "joint"
+        modes (numpy.ndarray, optional): (num_configs, num_samples)
+            estimated mode names. Required for "mode" and "joint"
+        tolerance (float, optional): tonic tolerance in cents. Defaults to
+            TONIC_TOLERANCE
+
+    Raises:
+        ValueError: if the experiment type is unknown
+
+    Returns:
+        Evaluation -- the evaluation
+    """
+    if experiment_type not in EXPERIMENT_TYPES:
+        raise ValueError("Unknown experiment_type: {0:s}".format(
+            experiment_type))
+    rows = index.rows(mbids)
+    fold_idx = np.asarray(fold_idx, dtype=int)
+    num_folds = fold_idx.max() + 1
+    num_samples = np.bincount(fold_idx, minlength=num_folds)
+
+    tonic_correct = tonic_deviations = mode_correct = confusion = \
+        joint_correct = None
+    if experiment_type in ("tonic", "joint"):
+        tonic_deviations = cent_deviation(
+            np.asarray(tonics, dtype=float), index.tonics[rows][None, :])
+        tonic_hits = np.abs(tonic_deviations) <= tolerance
+        tonic_correct = _per_fold(tonic_hits, fold_idx, num_folds)
+
+    if experiment_type in ("mode", "joint"):
+        estimated = index.mode_indices(modes)
+        annotated = index.mode_idx[rows]
+        mode_hits = estimated == annotated[None, :]
+        mode_correct = _per_fold(mode_hits, fold_idx, num_folds)
+
+        # count the (config, fold, annotated, estimated) tuples; the
+        # missing estimates are left out of the confusion matrices
+        num_configs, num_labels = len(estimated), len(index.mode_labels)
+        flat = (((np.arange(num_configs)[:, None] * num_folds +
+                  fold_idx[None, :]) * num_labels +
+                 annotated[None, :]) * num_labels + estimated)
+        confusion = np.bincount(
+            flat[estimated >= 0],
+            minlength=num_configs * num_folds * num_labels ** 2).reshape(
+                num_configs, num_folds, num_labels, num_labels)
+
+    if experiment_type == "joint":
+        joint_correct = _per_fold(tonic_hits & mode_hits, fold_idx,
+                                  num_folds)
+
+    return Evaluation(experiment_type, num_samples, tonic_correct,
+                      tonic_deviations, mode_correct, confusion,
+                      joint_correct)
+
+
+def accuracy(correct, num_samples):
+    """Computes the accuracy per fold and the average over the folds
+
+    Args:
+        correct (numpy.ndarray): (num_configs, num_folds) correct estimates
+        num_samples (numpy.ndarray): (num_folds,) number of test samples
+
+    Returns:
+        tuple -- (num_configs, num_folds) fold accuracies and
+        (num_configs,) average accuracies
+    """
+    fold_accuracy = correct / num_samples[None, :]
+    return fold_accuracy, fold_accuracy.mean(axis=1)
+
+
+def summarize_overall(names, evaluation):
+    """Ranks the configurations by their average accuracy
+
+    Args:
+        names (list): name of each configuration
+        evaluation (Evaluation): evaluation of the configurations
+
+    Returns:
+        list -- {"param", "accuracy"} per configuration, sorted by
+        decreasing accuracy. The joint experiments also have the
+        "tonic_accuracy" and "mode_accuracy". The accuracies are fractions
+        between 0 and 1
+    """
+    correct = {"tonic": evaluation.tonic_correct,
+               "mode": evaluation.mode_correct,
+               "joint": evaluation.joint_correct}
+    overall = {key: accuracy(val, evaluation.num_samples)[1].tolist()
+               for key, val in correct.items() if val is not None}
+
+    summary = []
+    for i, name in enumerate(names):
+        summary.append({"param": name,
+                        "accuracy": overall[evaluation.experiment_type][i]})
+        if evaluation.experiment_type == "joint":
+            summary[-1]["tonic_accuracy"] = overall["tonic"][i]
+            summary[-1]["mode_accuracy"] = overall["mode"][i]
+    return sorted(summary, key=lambda s: -s["accuracy"])
+
+
+def summarize_perfold(configs, evaluation):
+    """Lists the fold accuracies of the configurations in columns
+
+    Each row is a (configuration, fold) pair, as read by the statistical
+    significance scripts.
+
+    Args:
+        configs (list): dict of each configuration with the keys
+            "training", "distribution", "distance", "bin_size",
+            "kernel_width" and "k_neighbors"
+        evaluation (Evaluation): evaluation of the configurations
+
+    Returns:
+        dict -- the columns
+    """
+    correct = {"tonic": evaluation.tonic_correct,
+               "mode": evaluation.mode_correct,
+               "joint": evaluation.joint_correct}[evaluation.experiment_type]
+    fold_accuracy = accuracy(correct, evaluation.num_samples)[0]
+    num_folds = len(evaluation.num_samples)
+
+    def repeat(key):
+        return [c[key] for c in configs for _ in range(num_folds)]
+
+    return {
+        "accuracy": [[acc] for acc in fold_accuracy.ravel().tolist()],
+        "training": [repeat("training")],
+        "distribution": [repeat("distribution")],
+        "distance": [repeat("distance")],
+        "bin_size": [[val] for val in repeat("bin_size")],
+        "kernel_width": [[val] for val in repeat("kernel_width")],
+        "k_neighbors": [[val] for val in repeat("k_neighbors")]}
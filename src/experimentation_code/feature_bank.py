@@ -0,0 +1,289 @@
+"""Columnar feature bank: one matrix per distribution configuration
+
+A bank folder stores the distributions of all recordings computed with one
+(distribution_type, step_size, kernel_width) configuration:
+
+- ``meta.json``: the configuration and the bin centers
+- ``hist.f8``: (num_recordings x num_bins) histograms, row-major float64
+- ``pdf.f8``: the same histograms normalized to unit sum
+- ``records.jsonl``: one {"mbid", "mode", "tonic"} record per row
+
+The writer only appends. A row is committed when its record is written
+after the data, so the rows of an interrupted append are ignored and
+truncated by the next one. A recording, which is appended again, e.g. when
+its features are extracted again, keeps its row: the row is rewritten in
+place and committed by a record, which names it ({"mbid", "mode", "tonic",
+"row"}). Hence the matrices keep a row per recording and are mapped
+without copies. (A bank, which already has several rows of a recording, is
+read with the last one.)
+"""
+import fcntl
+import json
+import os
+
+import numpy as np
+
+from . import distribution, lru
+
+META_FILE = "meta.json"
+RECORD_FILE = "records.jsonl"
+LOCK_FILE = ".lock"
+MATRIX_FILES = {"hist": "hist.f8", "pdf": "pdf.f8"}
+DTYPE = np.dtype("<f8")
+MAX_OPEN_BANKS = 8  # per process
+
+_RECORD_CACHE = lru.LRUCache(MAX_OPEN_BANKS)
+
+
+def _read_records(bank_folder):
+    """Reads the committed records, the byte size they span and the last
+    row of each MBID
+
+    The records read before are cached per process, so that only the rows
+    appended since the last call are parsed.
+    """
+    record_file = os.path.join(bank_folder, RECORD_FILE)
+    if not os.path.exists(record_file):
+        return [], 0, {}
+
+    records, size, rows = _RECORD_CACHE.peek(record_file, ([], 0, {}))
+    if os.path.getsize(record_file) < size:  # the bank is rebuilt
+        records, size, rows = [], 0, {}
+    with open(record_file, "rb") as f:
+        f.seek(size)
+        lines = f.read().splitlines(keepends=True)
+
+    # an interrupted write may leave an incomplete last line
+    lines = [line for line in lines if line.endswith(b"\n")]
+    if lines:
+        records, rows = list(records), dict(rows)
+        for line in lines:
+            record = json.loads(line)
+            row = record.pop("row", None)
+            if row is None:  # a new row
+                rows[record["mbid"]] = len(records)
+                records.append(record)
+            else:  # a rewritten row
+                records[row] = record
+        size += sum(len(ll) for ll in lines)
+        _RECORD_CACHE.put(record_file, (records, size, rows))
+    return records, size, rows
+
+
+class FeatureBankWriter:
+    """Append-only writer of a feature bank
+
+    Appends from several processes are serialized by a lock file.
+
+    Examples:
+        >>> writer = FeatureBankWriter(folder, bins, "pcd", 7.5, 15.0)
+        >>> writer.append(mbid, "Hicaz", 220.0, hist)
+    """
+
+    def __init__(self, bank_folder, bins, distribution_type, step_size,
+                 kernel_width):
+        self.bank_folder = bank_folder
+        self.num_bins = len(bins)
+        if not os.path.exists(bank_folder):
+            os.makedirs(bank_folder, exist_ok=True)
+
+        meta = {"distribution_type": distribution_type,
+                "step_size": step_size, "kernel_width": kernel_width,
+                "bins": np.asarray(bins, dtype=float).tolist()}
+        meta_file = os.path.join(bank_folder, META_FILE)
+        with self._lock():
+            if os.path.exists(meta_file):
+                with open(meta_file) as f:
+                    if json.load(f) != meta:
+                        raise ValueError(u"{0:s} has another configuration."
+                                         .format(bank_folder))
+            else:
+                with open(meta_file + ".tmp", "w") as f:
+                    json.dump(meta, f)
+                os.replace(meta_file + ".tmp", meta_file)
+            # the rows, which exist when the writer is opened or are
+            # appended by it
+            self._rows = _read_records(bank_folder)[2]
+
+    def _lock(self):
+        return _FileLock(os.path.join(self.bank_folder, LOCK_FILE))
+
+    def __contains__(self, mbid):
+        return mbid in self._rows
+
+    def append(self, mbid, mode, tonic, hist):
+        """Appends the histogram of a recording to the bank
+
+        The row of a recording, which is already in the bank, is rewritten.
+
+        Args:
+            mbid (str): MBID of the recording
+            mode (str): annotated makam of the recording
+            tonic (float): annotated tonic frequency in Hz
+            hist (numpy.ndarray): histogram with num_bins values
+        """
+        hist = np.asarray(hist, dtype=DTYPE)
+        if hist.shape != (self.num_bins,):
+            raise ValueError("The histogram should have {0:d} bins.".format(
+                self.num_bins))
+        rows = {"hist": hist, "pdf": distribution.normalize(hist)}
+
+        with self._lock():
+            records, record_size, existing = _read_records(self.bank_folder)
+            num_rows = len(records)
+            row = existing.get(mbid)
+            record = {"mbid": mbid, "mode": mode, "tonic": tonic}
+            for key, filename in MATRIX_FILES.items():
+                matrix_file = os.path.join(self.bank_folder, filename)
+                if row is None:
+                    with open(matrix_file, "ab") as f:
+                        f.truncate(num_rows * self.num_bins * DTYPE.itemsize)
+                        f.write(rows[key].astype(DTYPE).tobytes())
+                else:
+                    with open(matrix_file, "r+b") as f:
+                        f.seek(row * self.num_bins * DTYPE.itemsize)
+                        f.write(rows[key].astype(DTYPE).tobytes())
+            if row is not None:
+                record["row"] = row
+
+            # commit the row
+            record_file = os.path.join(self.bank_folder, RECORD_FILE)
+            with open(record_file, "ab") as f:
+                f.truncate(record_size)
+                f.write((json.dumps(record) + "\n").encode())
+            self._rows = _read_records(self.bank_folder)[2]
+
+
+class _FileLock:
+    def __init__(self, lock_file):
+        self.lock_file = lock_file
+        self._f = None
+
+    def __enter__(self):
+        self._f = open(self.lock_file, "a")
+        fcntl.flock(self._f, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *args):
+        fcntl.flock(self._f, fcntl.LOCK_UN)
+        self._f.close()
+
+
+class FeatureBank:
+    """Read-only, memory-mapped access to a feature bank
+
+    The row i of the matrices ``hist`` and ``pdf`` belongs to the recording
+    ``mbids[i]``, annotated with ``modes[i]`` and ``tonics[i]``.
+
+    Examples:
+        >>> bank = FeatureBank(folder)
+        >>> training_pdfs = bank.pdf[bank.rows(fold['training']['sources'])]
+    """
+
+    def __init__(self, bank_folder):
+        self.bank_folder = bank_folder
+        meta_file = os.path.join(bank_folder, META_FILE)
+        if not os.path.exists(meta_file):
+            raise IOError(u"No feature bank found in {0:s}".format(
+                bank_folder))
+        with open(meta_file) as f:
+            meta = json.load(f)
+        self.distribution_type = meta["distribution_type"]
+        self.step_size = meta["step_size"]
+        self.kernel_width = meta["kernel_width"]
+        self.bins = np.array(meta["bins"])
+
+        records = _read_records(bank_folder)[0]
+        matrices = {key: self._map_matrix(filename, len(records))
+                    for key, filename in MATRIX_FILES.items()}
+
+        # keep the last row of the recordings, which are appended more than
+        # once by an older writer; the matrices are then copied
+        last_rows = {r["mbid"]: i for i, r in enumerate(records)}
+        if len(last_rows) < len(records):
+            rows = np.array(sorted(last_rows.values()), dtype=int)
+            matrices = {key: val[rows] for key, val in matrices.items()}
+            for val in matrices.values():  # used by the models without copy
+                val.setflags(write=False)
+            records = [records[i] for i in rows]
+
+        self.hist = matrices["hist"]
+        self.pdf = matrices["pdf"]
+        self.mbids = np.array([r["mbid"] for r in records], dtype=str)
+        self.modes = np.array([r["mode"] for r in records], dtype=str)
+        self.tonics = np.array([r["tonic"] for r in records], dtype=float)
+        self.index = {mbid: i for i, mbid in enumerate(self.mbids)}
+
+    def _map_matrix(self, filename, num_rows):
+        shape = (num_rows, len(self.bins))
+        if num_rows == 0:
+            return np.zeros(shape, dtype=DTYPE)
+        return np.memmap(os.path.join(self.bank_folder, filename),
+                         dtype=DTYPE, mode="r", shape=shape)
+
+    def __len__(self):
+        return len(self.mbids)
+
+    def __contains__(self, mbid):
+        return mbid in self.index
+
+    def rows(self, mbids):
+        """Looks up the rows of recordings
+
+        Args:
+            mbids (list): MBIDs of the recordings
+
+        Raises:
+            KeyError: if a recording is not in the bank
+
+        Returns:
+            numpy.ndarray -- row indices in the order of mbids
+        """
+        return np.array([self.index[mbid] for mbid in mbids], dtype=int)
+
+    def mask(self, mbids):
+        """Marks the rows of recordings
+
+        Args:
+            mbids (list): MBIDs of the recordings, e.g. the training set of
+                a fold
+
+        Raises:
+            KeyError: if a recording is not in the bank
+
+        Returns:
+            numpy.ndarray -- boolean mask of the rows
+        """
+        mask = np.zeros(len(self), dtype=bool)
+        mask[self.rows(mbids)] = True
+        return mask
+
+
+_OPEN_BANKS = lru.LRUCache(MAX_OPEN_BANKS)
+
+
+def load(bank_folder):
+    """Opens a feature bank once per process and reuses it in later calls
+
+    The bank is reopened only if rows are appended to it since it was
+    opened, which is detected by a single stat call. At most MAX_OPEN_BANKS
+    banks are kept open; the least recently used ones are closed.
+
+    Args:
+        bank_folder (str): folder of the bank
+
+    Returns:
+        FeatureBank -- the opened bank
+    """
+    bank_folder = os.path.abspath(bank_folder)
+    try:
+        stat = os.stat(os.path.join(bank_folder, RECORD_FILE))
+        version = (stat.st_size, stat.st_mtime_ns)
+    except OSError:  # no rows yet
+        version = None
+
+    cached = _OPEN_BANKS.peek(bank_folder)
+    if cached is not None and cached[0] != version:
+        _OPEN_BANKS.put(bank_folder, (version, FeatureBank(bank_folder)))
+    return _OPEN_BANKS.get(
+        bank_folder, lambda: (version, FeatureBank(bank_folder)))[1]
@@ -0,0 +1,308 @@
+"""Compact binary index of the cross-validation folds
+
+The folds are stored as integer row indices into a table of the recordings,
+instead of repeating the MBID, mode, tonic and pitch file of each recording
+in every fold as in ``folds.json``. A fold index file consists of:
+
+- the 8-byte magic ``MAGIC``
+- the 8-byte little-endian length of the header
+- the JSON header: the recording table (the MBIDs, modes, tonics and pitch
+  files) and the offset and the length of the training and the testing
+  rows of each fold, padded with spaces so that the rows are aligned to
+  ``ALIGNMENT`` bytes
+- the rows of all folds as int32, fold after fold
+
+The rows are memory-mapped, so a fold is read only when it is accessed.
+
+The folds are generated by repeated stratified k-fold: each repetition
+(seed) divides the recordings of each mode into k folds. In the nested
+scheme, the training rows of each (outer) fold are divided again into
+inner folds, e.g. to tune the parameters without the test data. The
+repetitions are independent, hence they can be generated in parallel.
+"""
+import collections
+import concurrent.futures
+import functools
+import json
+import os
+
+import numpy as np
+
+from . import pitch_store
+
+INDEX_FILE = "folds.idx"
+MAGIC = b"DLFMFLD1"
+ALIGNMENT = 64
+DTYPE = np.dtype("<i4")
+
+Fold = collections.namedtuple("Fold", [
+    "index", "repeat", "seed", "fold", "outer", "training", "testing"])
+Fold.__doc__ = """A fold of the index
+
+- index: position of the fold in the index, used as the fold_idx
+- repeat, seed: repetition of the k-fold and its random seed
+- fold: position of the fold in its k-fold
+- outer: index of the outer fold of an inner fold, None otherwise
+- training, testing: row indices into the recording table
+"""
+
+
+def stratified_k_fold(modes, n_folds, seed, rows=None):
+    """Divides the recordings of each mode into folds
+
+    The recordings of each mode are shuffled and dealt to the folds in turn,
+    continuing from the fold the previous mode ended with, so the folds are
+    balanced even if the number of recordings of a mode is not a multiple
+    of n_folds.
+
+    Args:
+        modes (numpy.ndarray): mode of each recording
+        n_folds (int): number of folds
+        seed (int): random seed
+        rows (numpy.ndarray, optional): the rows to divide. Defaults to
+            None, i.e. all
+
+    Returns:
+        list -- (training rows, testing rows) of each fold, sorted
+    """
+    rnd = np.random.RandomState(seed)
+    rows = np.arange(len(modes)) if rows is None else np.asarray(rows)
+    fold_of = np.empty(len(rows), dtype=int)
+    start = 0
+    for mode in np.unique(modes[rows]):
+        members = rnd.permutation(np.flatnonzero(modes[rows] == mode))
+        fold_of[members] = (start + np.arange(len(members))) % n_folds
+        start += len(members)
+    return [(rows[fold_of != k], rows[fold_of == k]) for k in range(n_folds)]
+
+
+def _repeat(modes, n_folds, nested_folds, seed):
+    # the outer folds of a repetition, each followed by its inner folds
+    splits = []
+    for k, (training, testing) in enumerate(
+            stratified_k_fold(modes, n_folds, seed)):
+        splits.append((k, None, training, testing))
+        if nested_folds:
+            splits += [(j, k, inner_training, inner_testing)
+                       for j, (inner_training, inner_testing) in enumerate(
+                           stratified_k_fold(modes, nested_folds, seed,
+                                             rows=training))]
+    return splits
+
+
+def recording_table(annotations, dataset_folder):
+    """Builds the recording table from the annotations
+
+    Args:
+        annotations (list): annotations of the recordings
+        dataset_folder (str): path to otmm_makam_recognition_dataset
+
+    Returns:
+        dict -- the "mbids", "modes", "tonics" and "pitches" (the pitch
+        files) lists
+    """
+    return {
+        "mbids": [pitch_store.get_mbid(anno) for anno in annotations],
+        "modes": [anno["makam"] for anno in annotations],
+        "tonics": [anno["tonic"] for anno in annotations],
+        "pitches": [pitch_store.get_pitch_file(anno, dataset_folder)
+                    for anno in annotations]}
+
+
+def generate(recordings, n_folds=10, seeds=(0,), nested_folds=None,
+             num_workers=0):
+    """Generates repeated, optionally nested, stratified k-folds
+
+    Args:
+        recordings (dict): the recording table
+        n_folds (int, optional): number of (outer) folds. Defaults to 10
+        seeds (iterable, optional): random seed of each repetition.
+            Defaults to (0,)
+        nested_folds (int, optional): number of inner folds of each outer
+            fold. Defaults to None, i.e. not nested
+        num_workers (int, optional): number of processes to generate the
+            repetitions with. Defaults to 0, i.e. in the calling process
+
+    Returns:
+        list -- the Folds, the outer folds of the first repetition first
+    """
+    modes = np.array(recordings["modes"])
+    repeat = functools.partial(_repeat, modes, n_folds, nested_folds)
+    seeds = list(seeds)
+    if num_workers == 0:
+        repeats = [repeat(seed) for seed in seeds]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(num_workers) as pool:
+            repeats = list(pool.map(repeat, seeds))
+
+    # index the outer folds first, so that the folds of a single k-fold are
+    # numbered as in folds.json
+    splits = [(r, seed) + split for r, (seed, splits) in enumerate(
+        zip(seeds, repeats)) for split in splits]
+    splits.sort(key=lambda s: s[3] is not None)
+    outer_index = {}
+    folds = []
+    for repeat_idx, seed, k, outer, training, testing in splits:
+        if outer is None:
+            outer_index[repeat_idx, k] = len(folds)
+        else:
+            outer = outer_index[repeat_idx, outer]
+        folds.append(Fold(len(folds), repeat_idx, seed, k, outer, training,
+                          testing))
+    return folds
+
+
+def from_legacy(folds):
+    """Converts the folds in the format of folds.json
+
+    Args:
+        folds (list): [fold_idx, {"training", "testing"}] of each fold
+
+    Returns:
+        tuple -- the recording table and the Folds
+    """
+    table = collections.OrderedDict()
+    for _, fold in folds:
+        for ts in fold["testing"]:
+            table.setdefault(ts["source"], (ts["mode"], ts["tonic"],
+                                            ts.get("pitch")))
+        training = fold["training"]
+        num_sources = len(training["sources"])
+        for mbid, mode, tonic, pitch in zip(
+                training["sources"], training["modes"],
+                training.get("tonics") or [None] * num_sources,
+                training.get("pitches") or [None] * num_sources):
+            table.setdefault(mbid, (mode, tonic, pitch))
+
+    row = {mbid: i for i, mbid in enumerate(table)}
+    modes, tonics, pitches = zip(*table.values()) if table else ([], [], [])
+    recordings = {"mbids": list(table), "modes": list(modes),
+                  "tonics": list(tonics), "pitches": list(pitches)}
+    index = []
+    for i, (fold_idx, fold) in enumerate(folds):
+        if fold_idx != i:
+            raise ValueError("The folds should be numbered 0, 1, ...")
+        index.append(Fold(
+            i, 0, None, i, None,
+            np.array([row[mbid] for mbid in fold["training"]["sources"]],
+                     dtype=int),
+            np.array([row[ts["source"]] for ts in fold["testing"]],
+                     dtype=int)))
+    return recordings, index
+
+
+def save(recordings, folds, path):
+    """Saves a fold index; the file is replaced once it is completely written
+
+    Args:
+        recordings (dict): the recording table
+        folds (list): the Folds
+        path (str): path to the index file
+    """
+    entries = []
+    offset = 0
+    for fold in folds:
+        entry = {"repeat": fold.repeat, "seed": fold.seed, "fold": fold.fold,
+                 "outer": fold.outer}
+        for part in ["training", "testing"]:
+            entry[part] = [offset, len(getattr(fold, part))]
+            offset += len(getattr(fold, part))
+        entries.append(entry)
+
+    header = json.dumps({"recordings": recordings, "folds": entries,
+                         "num_rows": offset}).encode()
+    data_offset = len(MAGIC) + 8 + len(header)
+    header += b" " * (-data_offset % ALIGNMENT)
+
+    tmp_file = "{0:s}.{1:d}.tmp".format(path, os.getpid())
+    with open(tmp_file, "wb") as f:
+        f.write(MAGIC)
+        f.write(np.array(len(header), dtype="<u8").tobytes())
+        f.write(header)
+        for fold in folds:
+            f.write(np.asarray(fold.training, dtype=DTYPE).tobytes())
+            f.write(np.asarray(fold.testing, dtype=DTYPE).tobytes())
+    os.replace(tmp_file, path)
+
+
+class FoldIndex:
+    """Lazy, read-only access to the folds in an index file
+
+    Examples:
+        >>> index = FoldIndex("./data/folds.idx")
+        >>> fold = index[3]  # rows are read on access
+        >>> index.mbids[fold.testing]
+        >>> index.to_legacy(3)  # {"training", "testing"} as in folds.json
+    """
+
+    def __init__(self, path):
+        """Reads the header of an index file
+
+        Args:
+            path (str): path to the index file
+
+        Raises:
+            IOError: if the file is not a fold index
+        """
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise IOError(u"{0:s} is not a fold index".format(path))
+            header_len = int(np.frombuffer(f.read(8), dtype="<u8")[0])
+            header = json.loads(f.read(header_len))
+
+        recordings = header["recordings"]
+        self.mbids = np.array(recordings["mbids"])
+        self.modes = np.array(recordings["modes"])
+        self.tonics = np.array(recordings["tonics"], dtype=float)
+        self.pitches = recordings["pitches"]
+        self._entries = header["folds"]
+        self._rows = np.memmap(path, dtype=DTYPE, mode="r",
+                               offset=len(MAGIC) + 8 + header_len,
+                               shape=(header["num_rows"],))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getitem__(self, fold_idx):
+        entry = self._entries[fold_idx]
+        parts = [self._rows[start:start + length] for start, length in
+                 (entry["training"], entry["testing"])]
+        return Fold(fold_idx, entry["repeat"], entry["seed"], entry["fold"],
+                    entry["outer"], *parts)
+
+    def fold_indices(self, outer=None):
+        """Returns the indices of the outer folds or the inner folds of one
+
+        Args:
+            outer (int, optional): index of an outer fold. Defaults to
+                None, i.e. the outer folds
+
+        Returns:
+            list -- the fold indices
+        """
+        return [i for i, entry in enumerate(self._entries)
+                if entry["outer"] == outer]
+
+    def testing(self, fold_idx):
+        """list -- the test samples of a fold as in folds.json"""
+        rows = self[fold_idx].testing
+        return [{"source": mbid, "mode": mode, "tonic": tonic,
+                 "pitch": self.pitches[r]} for r, mbid, mode, tonic in zip(
+                     rows.tolist(), self.mbids[rows].tolist(),
+                     self.modes[rows].tolist(), self.tonics[rows].tolist())]
+
+    def to_legacy(self, fold_idx):
+        """dict -- the {"training", "testing"} of a fold as in folds.json"""
+        training = self[fold_idx].training.tolist()
+        return {"training": {
+            "sources": self.mbids[training].tolist(),
+            "modes": self.modes[training].tolist(),
+            "tonics": self.tonics[training].tolist(),
+            "pitches": [self.pitches[r] for r in training]},
+            "testing": self.testing(fold_idx)}
+
+    def legacy_folds(self, outer=None):
+        """list -- the [fold_idx, fold] of the outer folds, or the inner
+        folds of one, as in folds.json"""
+        return [[i, self.to_legacy(i)] for i in self.fold_indices(outer)]
@@ -0,0 +1,410 @@
+"""Asynchronous ingestion of new recordings
+
+A recording is ingested from its annotation ({"mbid", "makam", "tonic"} as
+in annotations.json) and its .pitch file, which come in batches from an
+inbox folder (see watch) or an asyncio queue (see consume). The recordings
+of a batch are processed concurrently:
+
+1. the pitch file is read and hashed in a thread pool
+2. the distributions of all the configured parameter sets are computed in
+   one pass over the pitch track in a process pool
+3. the pitch file is copied into the dataset, and the distributions are
+   appended to the feature banks, one recording at a time
+
+so the file I/O of a recording overlaps the computation of the others. At
+the end of a batch, the pitch tracks are appended to the pitch store, the
+annotations are merged into annotations.json, and the rows of the affected
+modes of the all-data single models are summed again (see
+single_model.update). The models of the cross-validation folds are not
+updated, so that no recording joins the model of a fold, which tests it;
+instead, the feature slots of the recordings are invalidated in the cache
+manifest of the sweep (see cache.invalidate), which trains and tests the
+affected folds again.
+
+A recording with the same pitch file (by the content hash in the pitch
+store) and the same annotation is computed only for the parameter sets,
+which are missing from the banks.
+"""
+import asyncio
+import concurrent.futures
+import json
+import os
+import shutil
+
+from . import cache, distribution, feature_bank, instrument, pitch_store, \
+    single_model
+
+ANNOTATION_FILE = "annotations.json"
+PITCH_EXTENSION = ".pitch"
+FAILED_FOLDER = "failed"
+NUM_IO_THREADS = 4
+MAX_BATCH = 64
+
+
+def compute_histograms(pitch, tonic, params):
+    """Computes the histograms of a pitch track in one pass
+
+    Args:
+        pitch (numpy.ndarray): 1D pitch values in Hz
+        tonic (float): annotated tonic frequency in Hz
+        params (list): (distribution_type, step_size, kernel_width) tuples
+
+    Returns:
+        dict -- histogram (numpy.ndarray) per parameter tuple in params
+    """
+    accumulator = distribution.DistributionAccumulator(tonic, params)
+    for chunk in distribution.iter_pitch_chunks(pitch):
+        accumulator.update(chunk)
+    distributions = accumulator.distributions()
+    return {(dt, ss, kw): distributions[(dt, float(ss), float(kw))].vals
+            for dt, ss, kw in params}
+
+
+def _read_pitch(pitch_file):
+    return pitch_store.read_pitch_file(pitch_file), cache.hash_file(
+        pitch_file)
+
+
+def _load_bank(bank_folder):
+    if not os.path.exists(os.path.join(bank_folder, feature_bank.META_FILE)):
+        return None
+    return feature_bank.load(bank_folder)
+
+
+class Ingestor:
+    """Ingests batches of new or changed recordings
+
+    Examples:
+        >>> with Ingestor(dataset_folder, store_folder, banks) as ingestor:
+        ...     summary = asyncio.run(ingestor.ingest(
+        ...         [(anno, "/inbox/recording.pitch")]))
+    """
+
+    def __init__(self, dataset_folder, pitch_store_folder, bank_folders,
+                 model_files=None, num_workers=None, cache_folder=None):
+        """Creates an ingestor
+
+        Args:
+            dataset_folder (str): path to otmm_makam_recognition_dataset
+            pitch_store_folder (str): folder of the pitch store
+            bank_folders (dict): feature bank folder per
+                (distribution_type, step_size, kernel_width) tuple
+            model_files (dict, optional): file of the single model of all
+                the recordings in the bank to update per parameter tuple in
+                bank_folders; it is trained from the whole bank if it does
+                not exist. Defaults to None
+            num_workers (int, optional): number of processes to compute the
+                distributions with; 0 computes them in a thread of this
+                process. Defaults to None, i.e. the number of CPUs
+            cache_folder (str, optional): cache folder of the sweep, whose
+                features of the ingested recordings are invalidated.
+                Defaults to None
+        """
+        self.dataset_folder = dataset_folder
+        self.pitch_store_folder = pitch_store_folder
+        self.bank_folders = dict(bank_folders)
+        self.model_files = dict(model_files or {})
+        self.cache_folder = cache_folder
+        self._io_pool = concurrent.futures.ThreadPoolExecutor(
+            NUM_IO_THREADS)
+        if num_workers == 0:
+            self._compute_pool = concurrent.futures.ThreadPoolExecutor(1)
+        else:
+            self._compute_pool = concurrent.futures.ProcessPoolExecutor(
+                num_workers)
+        self._writers = {}
+
+    def close(self):
+        """Shuts the thread and the process pools down"""
+        self._io_pool.shutdown()
+        self._compute_pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _snapshot(self):
+        return (pitch_store.get_source_hashes(self.pitch_store_folder),
+                {params: _load_bank(folder)
+                 for params, folder in self.bank_folders.items()})
+
+    @staticmethod
+    def _stale_params(anno, source_hash, stored_hash, banks):
+        # all distributions of a changed pitch track are computed again
+        if source_hash != stored_hash:
+            return list(banks)
+
+        mbid = pitch_store.get_mbid(anno)
+        stale = []
+        for params, bank in banks.items():
+            if bank is None or mbid not in bank or \
+                    bank.modes[bank.index[mbid]] != anno["makam"] or \
+                    bank.tonics[bank.index[mbid]] != float(anno["tonic"]):
+                stale.append(params)
+        return stale
+
+    def _writer(self, params):
+        if params not in self._writers:
+            dt, ss, kw = params
+            self._writers[params] = feature_bank.FeatureBankWriter(
+                self.bank_folders[params], distribution.get_bins(ss, dt),
+                dt, ss, kw)
+        return self._writers[params]
+
+    def _write(self, anno, pitch_file, histograms):
+        target = pitch_store.get_pitch_file(anno, self.dataset_folder)
+        if os.path.abspath(pitch_file) != target:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            tmp_file = "{0:s}.{1:d}.tmp".format(target, os.getpid())
+            shutil.copyfile(pitch_file, tmp_file)
+            os.replace(tmp_file, target)
+
+        mbid = pitch_store.get_mbid(anno)
+        for params, hist in histograms.items():
+            self._writer(params).append(mbid, anno["makam"],
+                                        float(anno["tonic"]), hist)
+
+    async def _ingest_one(self, anno, pitch_file, stored_hashes, banks,
+                          write_lock):
+        loop = asyncio.get_event_loop()
+        pitch, source_hash = await loop.run_in_executor(
+            self._io_pool, _read_pitch, pitch_file)
+        mbid = pitch_store.get_mbid(anno)
+        params = self._stale_params(anno, source_hash,
+                                    stored_hashes.get(mbid), banks)
+        if not params:
+            return None
+
+        histograms = await loop.run_in_executor(
+            self._compute_pool, compute_histograms, pitch,
+            float(anno["tonic"]), params)
+        # the rows of a bank are appended one recording at a time
+        async with write_lock:
+            await loop.run_in_executor(self._io_pool, self._write, anno,
+                                       pitch_file, histograms)
+        return anno, pitch, source_hash, params
+
+    def _merge_annotations(self, annos):
+        annotation_file = os.path.join(self.dataset_folder, ANNOTATION_FILE)
+        annotations = []
+        if os.path.exists(annotation_file):
+            with open(annotation_file) as f:
+                annotations = json.load(f)
+
+        new_annos = {pitch_store.get_mbid(anno): anno for anno in annos}
+        merged = [new_annos.pop(pitch_store.get_mbid(anno), anno)
+                  for anno in annotations]
+        merged += list(new_annos.values())
+        cache.atomic_dump_json(merged, annotation_file, indent=4)
+
+    def _update_models(self, ingested):
+        num_models, num_modes = 0, 0
+        for params, model_file in self.model_files.items():
+            mbids = [pitch_store.get_mbid(anno)
+                     for anno, _, _, stale in ingested if params in stale]
+            if not mbids:
+                continue
+
+            bank = feature_bank.load(self.bank_folders[params])
+            if os.path.exists(model_file):
+                model, modes = single_model.update(
+                    single_model.load(model_file), bank, mbids)
+            else:
+                model, = single_model.train_folds(bank,
+                                                  [bank.mbids.tolist()])
+                modes = model.modes
+                os.makedirs(os.path.dirname(model_file), exist_ok=True)
+            single_model.save(model, model_file)
+            num_models += 1
+            num_modes += len(modes)
+        return num_models, num_modes
+
+    def _invalidate(self, ingested):
+        # the sweep computes the rows of the recordings again, and trains
+        # and tests the folds, which use them
+        if self.cache_folder is None or not os.path.isdir(self.cache_folder):
+            return
+        for anno, _, _, stale in ingested:
+            for dt, ss, kw in stale:
+                cache.invalidate(self.cache_folder, "features", {
+                    "distribution_type": dt, "step_size": ss,
+                    "kernel_width": kw, "mbid": pitch_store.get_mbid(anno)})
+
+    def _commit(self, ingested):
+        pitch_store.add_tracks(
+            self.pitch_store_folder,
+            {pitch_store.get_mbid(anno): pitch
+             for anno, pitch, _, _ in ingested},
+            {pitch_store.get_mbid(anno): source_hash
+             for anno, _, source_hash, _ in ingested})
+        self._merge_annotations([anno for anno, _, _, _ in ingested])
+        self._invalidate(ingested)
+        return self._update_models(ingested)
+
+    async def ingest(self, items):
+        """Ingests a batch of recordings
+
+        A recording, which fails, e.g. because its pitch file cannot be
+        read, does not stop the others.
+
+        Args:
+            items (list): (annotation, pitch file) tuples. If a recording
+                is given more than once, the last one is ingested
+
+        Returns:
+            dict -- the MBIDs, which are "ingested", "skipped" (i.e. up to
+            date) and "failed" (with the error), the number of
+            "distributions" computed, and the numbers of the single models
+            ("models_updated") and their modes ("modes_updated") updated
+        """
+        loop = asyncio.get_event_loop()
+        items = list({pitch_store.get_mbid(anno): (anno, pitch_file)
+                      for anno, pitch_file in items}.values())
+        summary = {"ingested": [], "skipped": [], "failed": {},
+                   "distributions": 0, "models_updated": 0,
+                   "modes_updated": 0}
+
+        with instrument.stage("ingest", batch_size=len(items)):
+            stored_hashes, banks = await loop.run_in_executor(
+                self._io_pool, self._snapshot)
+            write_lock = asyncio.Lock()
+            results = await asyncio.gather(
+                *[self._ingest_one(anno, pitch_file, stored_hashes, banks,
+                                   write_lock)
+                  for anno, pitch_file in items], return_exceptions=True)
+
+            ingested = []
+            for (anno, _), result in zip(items, results):
+                mbid = pitch_store.get_mbid(anno)
+                if isinstance(result, Exception):
+                    summary["failed"][mbid] = repr(result)
+                elif result is None:
+                    summary["skipped"].append(mbid)
+                else:
+                    summary["ingested"].append(mbid)
+                    summary["distributions"] += len(result[3])
+                    ingested.append(result)
+
+            if ingested:
+                summary["models_updated"], summary["modes_updated"] = \
+                    await loop.run_in_executor(self._io_pool, self._commit,
+                                               ingested)
+            instrument.add(
+                recordings=len(ingested), skipped=len(summary["skipped"]),
+                failed=len(summary["failed"]),
+                distributions=summary["distributions"],
+                models_written=summary["models_updated"])
+        return summary
+
+
+def scan(inbox):
+    """Lists the recordings, which are ready in an inbox folder
+
+    A recording is ready when both its annotation (``<name>.json``) and
+    its pitch file (``<name>.pitch``) are in the folder. The producers
+    should write the annotation last.
+
+    Args:
+        inbox (str): the inbox folder
+
+    Returns:
+        list -- (annotation file, pitch file) tuples, sorted by name
+    """
+    if not os.path.isdir(inbox):
+        return []
+    ready = []
+    for filename in sorted(os.listdir(inbox)):
+        name, ext = os.path.splitext(filename)
+        pitch_file = os.path.join(inbox, name + PITCH_EXTENSION)
+        if ext == ".json" and os.path.exists(pitch_file):
+            ready.append((os.path.join(inbox, filename), pitch_file))
+    return ready
+
+
+def _move_failed(inbox, files, error):
+    failed_folder = os.path.join(inbox, FAILED_FOLDER)
+    os.makedirs(failed_folder, exist_ok=True)
+    for path in files:
+        os.replace(path, os.path.join(failed_folder, os.path.basename(path)))
+    name = os.path.splitext(os.path.basename(files[0]))[0]
+    cache.atomic_write(os.path.join(failed_folder, name + ".error"),
+                       error + "\n")
+
+
+async def watch(ingestor, inbox, interval=1.0, once=False):
+    """Ingests the recordings put into an inbox folder
+
+    The files of the ingested and the skipped recordings are removed from
+    the inbox; the files of the failed ones are moved into its ``failed``
+    subfolder with the error (``<name>.error``).
+
+    Args:
+        ingestor (Ingestor): the ingestor
+        inbox (str): the inbox folder (see scan)
+        interval (float, optional): seconds to wait between the scans.
+            Defaults to 1.0
+        once (bool, optional): stop after the recordings, which are
+            ready, are ingested. Defaults to False
+
+    Yields:
+        dict -- the summary of each batch (see Ingestor.ingest)
+    """
+    while True:
+        ready = scan(inbox)[:MAX_BATCH]
+        items, files = [], {}
+        for anno_file, pitch_file in ready:
+            try:
+                with open(anno_file) as f:
+                    anno = json.load(f)
+                mbid = pitch_store.get_mbid(anno)
+            except (ValueError, KeyError, TypeError) as err:
+                _move_failed(inbox, [anno_file, pitch_file], repr(err))
+                continue
+            items.append((anno, pitch_file))
+            files[mbid] = [anno_file, pitch_file]
+
+        if items:
+            summary = await ingestor.ingest(items)
+            for mbid, error in summary["failed"].items():
+                _move_failed(inbox, files.pop(mbid), error)
+            for paths in files.values():
+                for path in paths:
+                    os.remove(path)
+            yield summary
+
+        if once and len(ready) < MAX_BATCH:
+            return
+        if len(ready) < MAX_BATCH:
+            await asyncio.sleep(interval)
+
+
+async def consume(ingestor, queue, max_batch=MAX_BATCH):
+    """Ingests the (annotation, pitch file) tuples put into a queue
+
+    The tuples, which are already in the queue, are ingested in one batch
+    of at most max_batch recordings. None in the queue stops the consumer.
+
+    Args:
+        ingestor (Ingestor): the ingestor
+        queue (asyncio.Queue): the queue
+        max_batch (int, optional): maximum number of recordings in a batch.
+            Defaults to MAX_BATCH
+
+    Yields:
+        dict -- the summary of each batch (see Ingestor.ingest)
+    """
+    stop = False
+    while not stop:
+        items = []
+        item = await queue.get()
+        while item is not None:
+            items.append(item)
+            if len(items) >= max_batch or queue.empty():
+                break
+            item = queue.get_nowait()
+        stop = item is None
+
+        if items:
+            yield await ingestor.ingest(items)
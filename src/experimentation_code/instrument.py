@@ -0,0 +1,486 @@
+"""Per-stage instrumentation and progress reporting of the experiments
+
+A stage, e.g. the training of a model or the testing of a fold, is measured
+by wrapping it in ``stage`` (or decorating it with ``staged``). When the
+instrumentation is enabled by ``configure``, each stage emits a structured
+event with its configuration and its:
+
+- wall and CPU times in seconds
+- bytes read and written by the process (the ``rchar`` and ``wchar`` of
+  /proc/self/io, so the page cache hits count but the pages of the memory
+  maps do not; None where /proc is not available)
+- counts added by the stage itself with ``add``, e.g. the files read and
+  written, the test samples
+
+The events are appended as JSON lines to an events file. The settings are
+passed to the worker processes in the ENV_VAR environment variable, so the
+stages run by the scheduler are recorded in the same file.
+
+If a profile interval is set, a sampling thread records the stack of each
+running stage at that interval. The most frequent stacks of a stage, wrt
+the function which entered it, are attached to its event in the collapsed
+"outer;inner" format of the flame graphs, so the dominating code paths can
+be found per stage and configuration.
+
+Progress follows the finished tasks of a run and reports the throughput and
+the estimated remaining time.
+"""
+import collections
+import contextlib
+import functools
+import inspect
+import json
+import os
+import sys
+import threading
+import time
+
+ENV_VAR = "DLFM_INSTRUMENT"
+IO_FILE = "/proc/self/io"
+MAX_STACKS = 20  # per stage event
+MAX_DEPTH = 64
+
+_LOCAL = threading.local()
+_LISTENERS = []
+_SETTINGS = {}
+_SAMPLER = None
+_SAMPLER_LOCK = threading.Lock()
+_SAMPLES_LOCK = threading.Lock()
+
+
+def configure(events_file=None, profile_interval=None):
+    """Enables the instrumentation in this and the child processes
+
+    Args:
+        events_file (str, optional): JSON lines file to append the events
+            to. Defaults to None, i.e. the events are only passed to the
+            listeners
+        profile_interval (float, optional): seconds between the stack
+            samples. Defaults to None, i.e. no profiling
+    """
+    os.environ[ENV_VAR] = json.dumps({
+        "events_file": None if events_file is None else os.path.abspath(
+            events_file), "profile_interval": profile_interval})
+
+
+def disable():
+    """Disables the instrumentation in this and the child processes"""
+    os.environ.pop(ENV_VAR, None)
+
+
+def _settings():
+    value = os.environ.get(ENV_VAR)
+    if value is None:
+        return None
+    if _SETTINGS.get("value") != value:
+        _SETTINGS.clear()
+        _SETTINGS.update(json.loads(value), value=value)
+    return _SETTINGS
+
+
+def enabled():
+    """bool -- True if the stages are measured"""
+    return ENV_VAR in os.environ
+
+
+def add_listener(listener):
+    """Passes the events of this process to a function
+
+    Args:
+        listener (callable): called with each event dict
+    """
+    _LISTENERS.append(listener)
+
+
+def remove_listener(listener):
+    """Stops passing the events to a function"""
+    _LISTENERS.remove(listener)
+
+
+def emit(event):
+    """Appends an event to the events file and passes it to the listeners
+
+    Args:
+        event (dict): JSON-serializable event
+    """
+    settings = _settings()
+    if settings is not None and settings["events_file"] is not None:
+        line = (json.dumps(event) + "\n").encode()
+        # a single write to a file opened for appending is not interleaved
+        # with the writes of the other processes
+        fd = os.open(settings["events_file"],
+                     os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+    for listener in _LISTENERS:
+        listener(event)
+
+
+def _io_counters():
+    try:
+        with open(IO_FILE) as f:
+            counters = dict(line.split(": ") for line in f.read().split("\n")
+                            if line)
+        return int(counters["rchar"]), int(counters["wchar"])
+    except (IOError, KeyError, ValueError):
+        return None, None
+
+
+def _stages():
+    if not hasattr(_LOCAL, "stages"):
+        _LOCAL.stages = []
+    return _LOCAL.stages
+
+
+class _Stage:
+    def __init__(self, name, config, frame):
+        self.name = name
+        self.config = config
+        self.frame = frame  # the caller, where the sampled stacks stop
+        self.counts = collections.Counter()
+        self.samples = collections.Counter()
+        self.start = time.time()
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        self.read, self.written = _io_counters()
+
+    def event(self, status):
+        read, written = _io_counters()
+        event = {
+            "event": "stage", "stage": self.name, "config": self.config,
+            "status": status, "pid": os.getpid(), "start": self.start,
+            "wall_time": time.perf_counter() - self.wall,
+            "cpu_time": time.process_time() - self.cpu,
+            "read_bytes": None if read is None else read - self.read,
+            "write_bytes": None if written is None else written -
+            self.written,
+            "counts": dict(self.counts)}
+        with _SAMPLES_LOCK:
+            if self.samples:
+                event["samples"] = dict(
+                    self.samples.most_common(MAX_STACKS))
+        return event
+
+
+@contextlib.contextmanager
+def stage(name, **config):
+    """Measures a stage; does nothing if the instrumentation is disabled
+
+    Args:
+        name (str): name of the stage, e.g. "train_multi"
+        **config: JSON-serializable parameters of the stage
+
+    Examples:
+        >>> with stage("test", fold=0, experiment_type="mode"):
+        ...     add(samples=len(test_fold))
+    """
+    settings = _settings()
+    if settings is None:
+        yield
+        return
+
+    # the frame of the function, which entered the stage
+    st = _Stage(name, config, sys._getframe(2))
+    if settings["profile_interval"]:
+        _start_sampler(settings["profile_interval"])
+    stages = _stages()
+    stages.append(st)
+    status = "failed"
+    try:
+        yield
+        status = "done"
+    finally:
+        stages.pop()
+        emit(st.event(status))
+
+
+def add(**counts):
+    """Adds to the counts of the running stages of the calling thread
+
+    Args:
+        **counts: numbers to add, e.g. files_read=1
+    """
+    for st in _stages():
+        st.counts.update(counts)
+
+
+def staged(name, *params, **derived):
+    """Decorates a function to run it as a stage
+
+    Args:
+        name (str): name of the stage
+        *params: names of the arguments, which are in the stage config
+        **derived: functions of the bound arguments dict, which compute the
+            other values in the stage config
+
+    Examples:
+        >>> @staged("train_multi", "step_size", fold=lambda a: a["fold"][0])
+        ... def train_multi(step_size, fold):
+        ...     pass
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled():
+                return func(*args, **kwargs)
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            config = {p: bound.arguments[p] for p in params}
+            config.update((key, derive(bound.arguments))
+                          for key, derive in derived.items())
+            with stage(name, **config):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _collapse(frame, stop):
+    # from the frame, which entered the stage, to the sampled one
+    names = []
+    while frame is not None and len(names) < MAX_DEPTH:
+        code = frame.f_code
+        names.append(u"{0:s} ({1:s}:{2:d})".format(
+            code.co_name, os.path.basename(code.co_filename),
+            code.co_firstlineno))
+        if frame is stop:
+            break
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class _Sampler(threading.Thread):
+    """Samples the stacks of the running stages of all threads"""
+
+    def __init__(self, interval):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.threads = {}  # thread id: stage stack
+        self.pid = os.getpid()
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            for thread_id, stages in list(self.threads.items()):
+                frame = frames.get(thread_id)
+                if frame is None or not stages:
+                    continue
+                st = stages[-1]
+                stack = _collapse(frame, st.frame)
+                with _SAMPLES_LOCK:
+                    st.samples[stack] += 1
+
+
+def _start_sampler(interval):
+    global _SAMPLER
+    with _SAMPLER_LOCK:
+        # a forked process does not have the thread of its parent
+        if _SAMPLER is None or _SAMPLER.pid != os.getpid():
+            _SAMPLER = _Sampler(interval)
+            _SAMPLER.start()
+        _SAMPLER.threads[threading.get_ident()] = _stages()
+
+
+class Progress:
+    """Throughput and remaining time of a run of tasks
+
+    The rate is the number of the tasks run per second. The skipped and
+    the cancelled tasks take no time, hence they are left out of the rate
+    and the remaining time, and the skipped ones are counted apart. A run,
+    in which all the tasks are skipped, has no rate.
+
+    Examples:
+        >>> progress = Progress(len(graph))
+        >>> scheduler.run(graph, callback=lambda key, result: print(
+        ...     progress.update(key, result.status)))
+    """
+
+    def __init__(self, total, instant_statuses=("skipped", "cancelled")):
+        """Starts the clock
+
+        Args:
+            total (int): number of tasks
+            instant_statuses (tuple, optional): statuses of the tasks, which
+                are not run. Defaults to ("skipped", "cancelled")
+        """
+        self.total = total
+        self.instant_statuses = instant_statuses
+        self.statuses = collections.Counter()
+        self.started = time.time()  # comparable to the start of the stages
+        self.start = time.perf_counter()
+
+    @property
+    def finished(self):
+        """int -- number of the finished tasks"""
+        return sum(self.statuses.values())
+
+    @property
+    def elapsed(self):
+        """float -- seconds since the start"""
+        return time.perf_counter() - self.start
+
+    @property
+    def num_run(self):
+        """int -- number of the finished tasks, which are run"""
+        return self.finished - sum(
+            self.statuses[status] for status in self.instant_statuses)
+
+    @property
+    def num_skipped(self):
+        """int -- number of the tasks, which are skipped, e.g. cached"""
+        return self.statuses["skipped"]
+
+    @property
+    def rate(self):
+        """float -- tasks run per second, None before the first one"""
+        num_run = self.num_run
+        return num_run / self.elapsed if num_run else None
+
+    @property
+    def eta(self):
+        """float -- estimated seconds to finish the remaining tasks"""
+        rate = self.rate
+        return None if rate is None else (self.total - self.finished) / rate
+
+    def update(self, key, status):
+        """Records a finished task, and emits a progress event
+
+        Args:
+            key (hashable): key of the task
+            status (str): status of the task
+
+        Returns:
+            str -- progress line of the task
+        """
+        self.statuses[status] += 1
+        if enabled():
+            emit({"event": "progress", "key": str(key), "status": status,
+                  "finished": self.finished, "total": self.total,
+                  "skipped": self.num_skipped, "elapsed": self.elapsed,
+                  "rate": self.rate,
+                  "eta": self.eta})
+        return self.format(key, status)
+
+    def format(self, key, status):
+        """str -- progress line of a finished task"""
+        if isinstance(key, tuple):
+            key = "--".join(str(k) for k in key)
+        rate = "-" if self.rate is None else "{0:.2f}/s".format(self.rate)
+        return (u"[{0:d}/{1:d} {2:.1f}%, {3:d} skipped, {4:s}, ETA {5:s}] "
+                u"{6:s} {7:s}".format(
+                    self.finished, self.total,
+                    100.0 * self.finished / self.total, self.num_skipped,
+                    rate, format_duration(self.eta), status, key))
+
+
+def format_duration(seconds):
+    """str -- the duration as e.g. 1d02h03m, 2h03m04s, 3m04s or 4.56s"""
+    if seconds is None:
+        return "-"
+    if seconds < 60:
+        return "{0:.2f}s".format(seconds)
+    seconds = int(round(seconds))
+    days, seconds = divmod(seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if days:
+        return "{0:d}d{1:02d}h{2:02d}m".format(days, hours, minutes)
+    if hours:
+        return "{0:d}h{1:02d}m{2:02d}s".format(hours, minutes, seconds)
+    return "{0:d}m{1:02d}s".format(minutes, seconds)
+
+
+def read_events(events_file):
+    """list -- the events in a file; an incomplete last line is ignored"""
+    with open(events_file, "rb") as f:
+        lines = f.read().splitlines(keepends=True)
+    return [json.loads(line) for line in lines if line.endswith(b"\n")]
+
+
+def _config_key(config):
+    return "--".join("{0:s}={1}".format(k, v)
+                     for k, v in sorted(config.items())
+                     if not isinstance(v, (dict, list)))
+
+
+def summarize(events, num_configs=5):
+    """Aggregates the stage events per stage
+
+    Args:
+        events (list): the events
+        num_configs (int, optional): number of the slowest configurations
+            to list per stage. Defaults to 5
+
+    Returns:
+        dict -- totals, counts, throughputs (counts per wall second), the
+        slowest configurations and the merged stack samples of each stage,
+        ordered by the total wall time
+    """
+    stages = collections.OrderedDict()
+    for event in events:
+        if event.get("event") != "stage":
+            continue
+        summary = stages.setdefault(event["stage"], {
+            "num_runs": 0, "num_failed": 0, "wall_time": 0.0,
+            "cpu_time": 0.0, "read_bytes": 0, "write_bytes": 0,
+            "counts": collections.Counter(),
+            "configs": collections.Counter(),
+            "samples": collections.Counter()})
+        summary["num_runs"] += 1
+        summary["num_failed"] += event["status"] != "done"
+        for metric in ["wall_time", "cpu_time", "read_bytes", "write_bytes"]:
+            summary[metric] += event[metric] or 0
+        summary["counts"].update(event["counts"])
+        summary["configs"][_config_key(event["config"])] += \
+            event["wall_time"]
+        summary["samples"].update(event.get("samples", {}))
+
+    for summary in stages.values():
+        summary["throughput"] = {
+            key: count / summary["wall_time"] if summary["wall_time"] else None
+            for key, count in summary["counts"].items()}
+        summary["counts"] = dict(summary["counts"])
+        summary["configs"] = summary["configs"].most_common(num_configs)
+        summary["samples"] = summary["samples"].most_common(MAX_STACKS)
+    return collections.OrderedDict(sorted(
+        stages.items(), key=lambda item: -item[1]["wall_time"]))
+
+
+def report(summary, num_stacks=3):
+    """Formats a summary as text
+
+    Args:
+        summary (dict): as returned by summarize
+        num_stacks (int, optional): number of the most sampled stacks to
+            list per stage. Defaults to 3
+
+    Returns:
+        str -- the report
+    """
+    lines = []
+    for name, st in summary.items():
+        lines.append(
+            u"{0:s}: {1:d} runs ({2:d} failed), wall {3:s}, cpu {4:s}, "
+            u"read {5:.1f} MiB, written {6:.1f} MiB".format(
+                name, st["num_runs"], st["num_failed"],
+                format_duration(st["wall_time"]),
+                format_duration(st["cpu_time"]),
+                st["read_bytes"] / float(1 << 20),
+                st["write_bytes"] / float(1 << 20)))
+        for key, count in sorted(st["counts"].items()):
+            throughput = st["throughput"][key]
+            lines.append(u"    {0:s}: {1:g}{2:s}".format(
+                key, count, "" if throughput is None else
+                " ({0:.2f}/s)".format(throughput)))
+        for config, wall_time in st["configs"]:
+            lines.append(u"    {0:s} {1:s}".format(
+                format_duration(wall_time), config))
+        total = sum(count for _, count in st["samples"])
+        for stack, count in st["samples"][:num_stacks]:
+            lines.append(u"    {0:.0%} {1:s}".format(
+                count / float(total), stack.split(";")[-1]))
+    return "\n".join(lines)
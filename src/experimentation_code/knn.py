@@ -0,0 +1,700 @@
+"""k-nearest neighbor mode recognition and tonic identification
+
+The model is loaded once into read-only arrays: one distribution per row
+with its mode and source. Instead of copying the model per test recording,
+a recording is left out of the model by masking its rows.
+
+The folds of a cross-validation share a single model of all the recordings:
+the model of a fold is a view, which masks the rows out of its training set
+(see KNNModel.masked). A model of a feature bank uses the memory map of the
+bank instead of a copy, so all the worker processes on a node read the same
+pages of the page cache.
+
+A model may search its rows through an approximate nearest neighbor index
+(see KNNModel.with_ann and the ann module): only the candidate rows of the
+index are compared with a query, and the other rows are left out of the
+vote.
+
+The tonic and the joint estimates may be searched coarse-to-fine (see
+KNNModel.with_coarse_search and tonic_search.prune): the hypotheses are
+pruned on downsampled distributions, and only the surviving ones are
+compared at the full resolution. The number of hypotheses, the surviving
+hypotheses and the distances computed are added to the counts of the
+running instrument stage.
+
+The estimates are returned as a list of [estimate, distance] pairs, sorted
+by the number of votes among the k nearest neighbors and then by the
+distance of the nearest neighbor voting for the estimate. The estimate is
+the mode name, the tonic frequency in Hz or a [tonic, mode] pair.
+"""
+import copy
+
+import numpy as np
+
+from . import ann, distance, distribution, instrument, tonic_search
+
+
+def _read_only(arr):
+    arr.setflags(write=False)
+    return arr
+
+
+def _attach(vals):
+    """Uses a read-only float matrix, e.g. a memory map of the feature bank,
+    without copying; copies the other inputs into a read-only matrix"""
+    if (isinstance(vals, np.ndarray) and vals.dtype == float and
+            not vals.flags.writeable):
+        return vals
+    return _read_only(np.array(vals, dtype=float))
+
+
+class KNNModel:
+    """Immutable, array-backed k-nearest neighbor model
+
+    Examples:
+        >>> model = KNNModel.from_bank(bank).masked(bank.mask(training_mbids))
+        >>> model.estimate_mode(pitch, tonic, "bhat", 15, exclude=mbid)
+    """
+
+    def __init__(self, vals, modes, sources, bins, distribution_type,
+                 step_size, kernel_width, shift_table=False):
+        """Creates a model from its distributions
+
+        Args:
+            vals (numpy.ndarray): (num_rows, num_bins) normalized
+                distributions. A read-only float64 array, e.g. a memory
+                map, is used without a copy, so the worker processes share
+                its pages
+            modes (list): mode of each row
+            sources (list): source (e.g. MBID) of each row, used to leave
+                recordings out of the model
+            bins (numpy.ndarray): bin centers in cents
+            distribution_type (str): "pd" or "pcd"
+            step_size (float): bin size in cents
+            kernel_width (float): standard deviation of the Gaussian kernel
+            shift_table (bool, optional): compute the distances of the
+                tonic candidates of PCDs from a table of all circular shifts
+                (see tonic_search). Defaults to False
+        """
+        self.vals = _attach(vals)
+        self.modes = _read_only(np.array(modes, dtype=str))
+        self.sources = _read_only(np.array(sources, dtype=str))
+        self.bins = _read_only(np.array(bins, dtype=float))
+        self.distribution_type = distribution_type
+        self.step_size = step_size
+        self.kernel_width = kernel_width
+        self.shift_table = shift_table
+        self._shift_tables = {}
+        self.row_mask = None
+        self.ann_index = None
+        self.nprobe = ann.DEFAULT_NPROBE
+        self.coarse_step = None
+        self.top_n = tonic_search.TOP_N
+        self._coarse_vals = {}
+
+        self.mode_labels = _read_only(np.unique(self.modes))
+        self.mode_idx = _read_only(
+            np.searchsorted(self.mode_labels, self.modes))
+
+    @classmethod
+    def from_bank(cls, bank, rows=None, **kwargs):
+        """Creates a model from the PDFs of rows in a feature bank
+
+        Args:
+            bank (feature_bank.FeatureBank): the feature bank
+            rows (numpy.ndarray, optional): rows of the training recordings.
+                Defaults to None, i.e. all the rows
+            **kwargs: other arguments of the KNNModel constructor
+
+        Returns:
+            KNNModel -- the model
+        """
+        if rows is None:
+            rows = slice(None)
+        return cls(bank.pdf[rows], bank.modes[rows], bank.mbids[rows],
+                   bank.bins, bank.distribution_type, bank.step_size,
+                   bank.kernel_width, **kwargs)
+
+    def masked(self, row_mask):
+        """Returns a view of the model, which uses only some of its rows
+
+        The arrays and the shift tables are shared with the model, hence a
+        view per fold costs no copies.
+
+        Args:
+            row_mask (numpy.ndarray): boolean mask of the rows to use, e.g.
+                the training recordings of a fold
+
+        Returns:
+            KNNModel -- the view
+        """
+        row_mask = np.asarray(row_mask, dtype=bool)
+        if row_mask.shape != (len(self),):
+            raise ValueError("The mask should have {0:d} rows".format(
+                len(self)))
+        view = copy.copy(self)
+        view.row_mask = _read_only(row_mask.copy())
+        return view
+
+    def with_ann(self, index, nprobe=ann.DEFAULT_NPROBE):
+        """Returns a view of the model, which searches an ANN index
+
+        The index is used only for its distance measure; the other distance
+        measures are computed exactly. The shift tables are not used with
+        the index.
+
+        Args:
+            index (ann.IVFIndex): index of the rows of the model
+            nprobe (int, optional): number of lists to probe, which trades
+                the recall for the speed. Defaults to ann.DEFAULT_NPROBE
+
+        Returns:
+            KNNModel -- the view
+        """
+        if index.num_rows != len(self):
+            raise ValueError("The index should have {0:d} rows".format(
+                len(self)))
+        view = copy.copy(self)
+        view.ann_index = index
+        view.nprobe = nprobe
+        return view
+
+    def with_coarse_search(self, coarse_step=tonic_search.COARSE_STEP,
+                           top_n=tonic_search.TOP_N):
+        """Returns a view of the model, which searches the tonic and the
+        joint hypotheses coarse-to-fine
+
+        The surviving hypotheses are compared exactly, without the ANN index
+        or the shift tables.
+
+        Args:
+            coarse_step (float, optional): bin size of the downsampled
+                distributions in cents, rounded to a multiple of the step
+                size. Defaults to tonic_search.COARSE_STEP
+            top_n (int, optional): number of hypotheses to refine. Defaults
+                to tonic_search.TOP_N
+
+        Returns:
+            KNNModel -- the view
+        """
+        if coarse_step < self.step_size:
+            raise ValueError("The coarse step should be at least the step "
+                             "size, {0:g} cents".format(self.step_size))
+        view = copy.copy(self)
+        view.coarse_step = coarse_step
+        view.top_n = top_n
+        return view
+
+    def _get_coarse_vals(self, factor):
+        # shared by the views, like the shift tables
+        if factor not in self._coarse_vals:
+            self._coarse_vals[factor] = _read_only(
+                tonic_search.downsample(self.vals, factor))
+        return self._coarse_vals[factor]
+
+    def _coarse_to_fine(self, query, peak_idx, dis_measure, labels,
+                        num_labels, exclude, rows=None):
+        """Computes the distances of the surviving hypotheses of a query
+
+        Returns:
+            numpy.ndarray -- (num_peaks, num_rows) distances; NaN for the
+            rows of the pruned hypotheses
+        """
+        shifted = self.shift(query, peak_idx)
+        valid = ~self.get_excluded(exclude)
+        if rows is not None:
+            valid &= rows
+
+        factor = max(1, int(round(self.coarse_step / self.step_size)))
+        coarse = np.full((len(shifted), len(self)), np.inf)
+        coarse[:, valid] = distance.pairwise(
+            tonic_search.downsample(shifted, factor),
+            self._get_coarse_vals(factor)[valid], dis_measure)
+        kept, num_hypotheses = tonic_search.prune(coarse, labels,
+                                                  num_labels, self.top_n)
+
+        dists = np.full(coarse.shape, np.nan)
+        num_refined = 0
+        for peak in np.flatnonzero(kept.any(axis=1)):
+            cols = valid & kept[peak][labels]
+            dists[peak, cols] = distance.pairwise(
+                shifted[peak], self.vals[cols], dis_measure)[0]
+            num_refined += int(cols.sum())
+        instrument.add(hypotheses=num_hypotheses,
+                       refined_hypotheses=int(kept.sum()),
+                       coarse_distances=int(valid.sum()) * len(shifted),
+                       fine_distances=num_refined)
+        return dists
+
+    def _uses_ann(self, dis_measure):
+        return (self.ann_index is not None and
+                self.ann_index.dis_measure == dis_measure)
+
+    def _distances(self, queries, dis_measure, rows=None, k_neighbor=1):
+        """Computes the (num_queries, num_rows) distances of queries to the
+        model rows; NaN for the rows, which are not ANN candidates"""
+        if not self._uses_ann(dis_measure):
+            refs = self.vals if rows is None else self.vals[rows]
+            return distance.pairwise(queries, refs, dis_measure)
+
+        valid = ~self.get_excluded()
+        if rows is not None:
+            valid &= rows
+        # one more candidate than the neighbors for the left-out recording
+        dists = self.ann_index.distances(queries, self.vals, dis_measure,
+                                         self.nprobe, valid, k_neighbor + 1)
+        return dists if rows is None else dists[:, rows]
+
+    @property
+    def is_pcd(self):
+        """bool -- True if the model has pitch-class distributions"""
+        return self.distribution_type == "pcd"
+
+    def __len__(self):
+        return len(self.vals)
+
+    def get_query(self, hz_track, ref_freq):
+        """Computes the normalized distribution of a pitch track
+
+        Args:
+            hz_track (numpy.ndarray): pitch values in Hz
+            ref_freq (float): reference frequency in Hz
+
+        Returns:
+            numpy.ndarray -- the distribution with the bins of the model
+        """
+        dist = distribution.compute_distribution(
+            hz_track, ref_freq, self.step_size, self.kernel_width,
+            self.distribution_type)
+        return distribution.normalize(dist.vals)
+
+    def get_excluded(self, exclude=None):
+        """Returns the mask of the rows, which belong to a left-out source
+
+        Args:
+            exclude (str, optional): source to leave out. Defaults to None
+
+        Returns:
+            numpy.ndarray -- boolean mask of the excluded rows, including
+            the rows masked out of a view
+        """
+        excluded = (np.zeros(len(self), dtype=bool) if self.row_mask is None
+                    else ~self.row_mask)
+        if exclude is not None:
+            excluded = excluded | (self.sources == exclude)
+        return excluded
+
+    def shift(self, query, peak_idx):
+        """Shifts a distribution so that each peak moves to 0 cents
+
+        Args:
+            query (numpy.ndarray): the distribution
+            peak_idx (numpy.ndarray): bin indices of the peaks
+
+        Returns:
+            numpy.ndarray -- (num_peaks, num_bins) shifted distributions
+        """
+        num_bins = len(query)
+        shifts = np.asarray(peak_idx, dtype=int)
+        if not self.is_pcd:  # PD bins do not start from 0 cents
+            shifts = shifts - int(round(-self.bins[0] / self.step_size))
+
+        idx = np.arange(num_bins)[None, :] + shifts[:, None]
+        if self.is_pcd:
+            return query[np.mod(idx, num_bins)]
+        in_range = (idx >= 0) & (idx < num_bins)
+        return np.where(in_range, query[np.clip(idx, 0, num_bins - 1)], 0.0)
+
+    def get_tonic_candidates(self, hz_track, min_peak_ratio):
+        """Computes the distribution of a pitch track and its peaks
+
+        Since the tonic is unknown, the distribution is computed wrt the
+        median pitch. Each peak is a tonic candidate.
+
+        Args:
+            hz_track (numpy.ndarray): pitch values in Hz
+            min_peak_ratio (float): minimum ratio of a peak to the highest
+
+        Returns:
+            tuple -- the distribution, peak indices and peak frequencies
+        """
+        ref_freq = distribution.reference_frequency(hz_track)
+        return self.get_peaks(self.get_query(hz_track, ref_freq), ref_freq,
+                              min_peak_ratio)
+
+    def get_peaks(self, query, ref_freq, min_peak_ratio):
+        """Detects the tonic candidates of a precomputed distribution
+
+        Args:
+            query (numpy.ndarray): normalized distribution with the bins of
+                the model
+            ref_freq (float): reference frequency of the distribution in Hz
+            min_peak_ratio (float): minimum ratio of a peak to the highest
+
+        Returns:
+            tuple -- the distribution, peak indices and peak frequencies
+        """
+        query = np.asarray(query, dtype=float)
+        if query.shape != self.bins.shape:
+            raise ValueError("The distribution should have {0:d} bins".format(
+                len(self.bins)))
+        peak_idx = distribution.detect_peaks(
+            query, min_peak_ratio=min_peak_ratio, circular=self.is_pcd)
+        peak_freqs = distribution.cent_to_hz(self.bins[peak_idx], ref_freq)
+        return query, peak_idx, peak_freqs
+
+    def get_peak_distances(self, query, peak_idx, dis_measure, rows=None,
+                           k_neighbor=1):
+        """Computes the distances of the query shifted to each peak
+
+        Args:
+            query (numpy.ndarray): the distribution
+            peak_idx (numpy.ndarray): bin indices of the peaks
+            dis_measure (str): distance measure
+            rows (numpy.ndarray, optional): boolean mask of the model rows
+                to compare. Defaults to None, i.e. all rows
+            k_neighbor (int, optional): number of neighbors, the minimum
+                number of ANN candidates per peak. Defaults to 1
+
+        Returns:
+            numpy.ndarray -- (num_peaks, num_rows) distances
+        """
+        if self._use_table(dis_measure):
+            if dis_measure not in self._shift_tables:
+                self._shift_tables[dis_measure] = \
+                    tonic_search.CircularShiftTable(self.vals, dis_measure)
+            table = self._shift_tables[dis_measure].distances(query, rows)
+            return table[peak_idx]
+
+        return self._distances(self.shift(query, peak_idx), dis_measure,
+                               rows, k_neighbor)
+
+    def _use_table(self, dis_measure):
+        return (self.shift_table and self.is_pcd and
+                not self._uses_ann(dis_measure))
+
+    def _rank_modes(self, dists, exclude, k_neighbor, rank):
+        # candidate of each row is its mode
+        winners = vote(dists, self.mode_idx, self.get_excluded(exclude),
+                       k_neighbor, rank)
+        return [[str(self.mode_labels[i]), d] for i, d in winners]
+
+    def _rank_tonics(self, dists, in_mode, peak_freqs, exclude, k_neighbor,
+                     rank):
+        # candidate of each (peak, row in mode) pair is the peak
+        labels = np.repeat(np.arange(len(peak_freqs)), in_mode.sum())
+        excluded = np.tile(self.get_excluded(exclude)[in_mode],
+                           len(peak_freqs))
+        winners = vote(dists.ravel(), labels, excluded, k_neighbor, rank)
+        return [[float(peak_freqs[i]), d] for i, d in winners]
+
+    def _rank_joint(self, dists, peak_freqs, exclude, k_neighbor, rank):
+        # candidate of each (peak, row) pair is the (peak, mode of the row)
+        num_modes = len(self.mode_labels)
+        labels = (np.arange(len(peak_freqs))[:, None] * num_modes +
+                  self.mode_idx[None, :])
+        excluded = np.tile(self.get_excluded(exclude), len(peak_freqs))
+        winners = vote(dists.ravel(), labels.ravel(), excluded, k_neighbor,
+                       rank)
+        return [[[float(peak_freqs[i // num_modes]),
+                  str(self.mode_labels[i % num_modes])], d]
+                for i, d in winners]
+
+    def estimate_mode(self, hz_track, tonic, dis_measure="bhat",
+                      k_neighbor=1, rank=1, exclude=None):
+        """Estimates the mode of a recording with known tonic
+
+        Args:
+            hz_track (numpy.ndarray): pitch values in Hz
+            tonic (float): tonic frequency in Hz
+            dis_measure (str, optional): distance measure. Defaults to "bhat"
+            k_neighbor (int, optional): number of neighbors. Defaults to 1
+            rank (int, optional): number of estimates. Defaults to 1
+            exclude (str, optional): source to leave out. Defaults to None
+
+        Returns:
+            list -- [mode, distance] pairs
+        """
+        query = self.get_query(hz_track, tonic)
+        dists = self._distances(query[None, :], dis_measure,
+                                k_neighbor=k_neighbor)[0]
+        return self._rank_modes(dists, exclude, k_neighbor, rank)
+
+    def estimate_tonic(self, hz_track, mode, min_peak_ratio=0.15,
+                       dis_measure="bhat", k_neighbor=1, rank=1,
+                       exclude=None):
+        """Estimates the tonic of a recording with known mode
+
+        Args:
+            hz_track (numpy.ndarray): pitch values in Hz
+            mode (str): mode of the recording
+            min_peak_ratio (float, optional): minimum ratio of a tonic
+                candidate peak to the highest peak. Defaults to 0.15
+            dis_measure (str, optional): distance measure. Defaults to "bhat"
+            k_neighbor (int, optional): number of neighbors. Defaults to 1
+            rank (int, optional): number of estimates. Defaults to 1
+            exclude (str, optional): source to leave out. Defaults to None
+
+        Returns:
+            list -- [tonic, distance] pairs
+        """
+        query, peak_idx, peak_freqs = self.get_tonic_candidates(
+            hz_track, min_peak_ratio)
+        return self.score_tonics([(query, peak_idx, peak_freqs)], [mode],
+                                 dis_measure, k_neighbor, rank,
+                                 [exclude])[0]
+
+    def estimate_joint(self, hz_track, min_peak_ratio=0.15,
+                       dis_measure="bhat", k_neighbor=1, rank=1,
+                       exclude=None):
+        """Jointly estimates the tonic and the mode of a recording
+
+        Args:
+            hz_track (numpy.ndarray): pitch values in Hz
+            min_peak_ratio (float, optional): minimum ratio of a tonic
+                candidate peak to the highest peak. Defaults to 0.15
+            dis_measure (str, optional): distance measure. Defaults to "bhat"
+            k_neighbor (int, optional): number of neighbors. Defaults to 1
+            rank (int, optional): number of estimates. Defaults to 1
+            exclude (str, optional): source to leave out. Defaults to None
+
+        Returns:
+            list -- [[tonic, mode], distance] pairs
+        """
+        query, peak_idx, peak_freqs = self.get_tonic_candidates(
+            hz_track, min_peak_ratio)
+        return self.score_joint([(query, peak_idx, peak_freqs)],
+                                dis_measure, k_neighbor, rank, [exclude])[0]
+
+    def _batch_peak_distances(self, candidates, dis_measure, k_neighbor=1):
+        """Computes the distances of the tonic candidates of all recordings
+
+        The shifted distributions are stacked in a matrix and compared with
+        the model at once, unless they are picked from the shift table.
+
+        Returns:
+            tuple -- the (num_all_peaks, num_rows) distances, the peak
+            frequencies of each recording and the row bounds of each
+            recording in the distances
+        """
+        use_table = self._use_table(dis_measure)
+        shifted = [np.zeros((0, len(self) if use_table else len(self.bins)))]
+        peak_freqs = []
+        for query, peak_idx, freqs in candidates:
+            shifted.append(
+                self.get_peak_distances(query, peak_idx, dis_measure)
+                if use_table else self.shift(query, peak_idx))
+            peak_freqs.append(freqs)
+        bounds = np.cumsum([0] + [len(freqs) for freqs in peak_freqs])
+
+        dists = np.concatenate(shifted)
+        if not use_table:
+            dists = self._distances(dists, dis_measure,
+                                    k_neighbor=k_neighbor)
+        return dists, peak_freqs, bounds
+
+    def estimate_mode_batch(self, hz_tracks, tonics, dis_measure="bhat",
+                            k_neighbor=1, rank=1, excludes=None):
+        """Estimates the modes of recordings in a single distance pass
+
+        The results are identical to calling estimate_mode per recording.
+
+        Args:
+            hz_tracks (list): pitch values in Hz of each recording
+            tonics (list): tonic frequency in Hz of each recording
+            dis_measure (str, optional): distance measure. Defaults to "bhat"
+            k_neighbor (int, optional): number of neighbors. Defaults to 1
+            rank (int, optional): number of estimates. Defaults to 1
+            excludes (list, optional): source to leave out per recording.
+                Defaults to None
+
+        Returns:
+            list -- [mode, distance] pairs of each recording
+        """
+        queries = [self.get_query(hz_track, tonic)
+                   for hz_track, tonic in zip(hz_tracks, tonics)]
+        return self.score_modes(queries, dis_measure, k_neighbor, rank,
+                                excludes)
+
+    def estimate_tonic_batch(self, hz_tracks, modes, min_peak_ratio=0.15,
+                             dis_measure="bhat", k_neighbor=1, rank=1,
+                             excludes=None):
+        """Estimates the tonics of recordings in a single distance pass
+
+        All candidate shifts of all recordings are stacked into a query
+        matrix. The results are identical to calling estimate_tonic per
+        recording.
+
+        Args:
+            hz_tracks (list): pitch values in Hz of each recording
+            modes (list): mode of each recording
+            min_peak_ratio (float, optional): minimum ratio of a tonic
+                candidate peak to the highest peak. Defaults to 0.15
+            dis_measure (str, optional): distance measure. Defaults to "bhat"
+            k_neighbor (int, optional): number of neighbors. Defaults to 1
+            rank (int, optional): number of estimates. Defaults to 1
+            excludes (list, optional): source to leave out per recording.
+                Defaults to None
+
+        Returns:
+            list -- [tonic, distance] pairs of each recording
+        """
+        candidates = [self.get_tonic_candidates(hz_track, min_peak_ratio)
+                      for hz_track in hz_tracks]
+        return self.score_tonics(candidates, modes, dis_measure, k_neighbor,
+                                 rank, excludes)
+
+    def estimate_joint_batch(self, hz_tracks, min_peak_ratio=0.15,
+                             dis_measure="bhat", k_neighbor=1, rank=1,
+                             excludes=None):
+        """Jointly estimates tonics and modes in a single distance pass
+
+        The results are identical to calling estimate_joint per recording.
+
+        Args:
+            hz_tracks (list): pitch values in Hz of each recording
+            min_peak_ratio (float, optional): minimum ratio of a tonic
+                candidate peak to the highest peak. Defaults to 0.15
+            dis_measure (str, optional): distance measure. Defaults to "bhat"
+            k_neighbor (int, optional): number of neighbors. Defaults to 1
+            rank (int, optional): number of estimates. Defaults to 1
+            excludes (list, optional): source to leave out per recording.
+                Defaults to None
+
+        Returns:
+            list -- [[tonic, mode], distance] pairs of each recording
+        """
+        candidates = [self.get_tonic_candidates(hz_track, min_peak_ratio)
+                      for hz_track in hz_tracks]
+        return self.score_joint(candidates, dis_measure, k_neighbor, rank,
+                                excludes)
+
+    def score_modes(self, queries, dis_measure="bhat", k_neighbor=1, rank=1,
+                    excludes=None):
+        """Estimates the modes of distributions in a single distance pass
+
+        Args:
+            queries (list): normalized distribution of each recording wrt
+                its tonic, with the bins of the model
+            dis_measure (str, optional): distance measure. Defaults to "bhat"
+            k_neighbor (int, optional): number of neighbors. Defaults to 1
+            rank (int, optional): number of estimates. Defaults to 1
+            excludes (list, optional): source to leave out per recording.
+                Defaults to None
+
+        Returns:
+            list -- [mode, distance] pairs of each recording
+        """
+        excludes = excludes or [None] * len(queries)
+        queries = np.array(queries, dtype=float).reshape(-1, len(self.bins))
+        dists = self._distances(queries, dis_measure, k_neighbor=k_neighbor)
+        return [self._rank_modes(dd, exclude, k_neighbor, rank)
+                for dd, exclude in zip(dists, excludes)]
+
+    def score_tonics(self, candidates, modes, dis_measure="bhat",
+                     k_neighbor=1, rank=1, excludes=None):
+        """Estimates the tonics of distributions in a single distance pass
+
+        Args:
+            candidates (list): (distribution, peak indices, peak
+                frequencies) of each recording, see get_peaks
+            modes (list): mode of each recording
+            dis_measure (str, optional): distance measure. Defaults to "bhat"
+            k_neighbor (int, optional): number of neighbors. Defaults to 1
+            rank (int, optional): number of estimates. Defaults to 1
+            excludes (list, optional): source to leave out per recording.
+                Defaults to None
+
+        Returns:
+            list -- [tonic, distance] pairs of each recording
+        """
+        excludes = excludes or [None] * len(candidates)
+        if self.coarse_step is not None or self._uses_ann(dis_measure):
+            # the hypotheses (or the ANN candidates) of the peaks are
+            # searched among the rows of the mode of each recording
+            results = []
+            for (query, peak_idx, freqs), mode, exclude in zip(
+                    candidates, modes, excludes):
+                in_mode = self.modes == mode
+                if self.coarse_step is None:
+                    dists = self.get_peak_distances(
+                        query, peak_idx, dis_measure, in_mode, k_neighbor)
+                else:  # a single label: the hypotheses are the peaks
+                    dists = self._coarse_to_fine(
+                        query, peak_idx, dis_measure,
+                        np.zeros(len(self), dtype=int), 1, exclude,
+                        in_mode)[:, in_mode]
+                results.append(self._rank_tonics(
+                    dists, in_mode, freqs, exclude, k_neighbor, rank))
+            return results
+
+        dists, peak_freqs, bounds = self._batch_peak_distances(
+            candidates, dis_measure)
+
+        results = []
+        for i, (mode, exclude) in enumerate(zip(modes, excludes)):
+            in_mode = self.modes == mode
+            results.append(self._rank_tonics(
+                dists[bounds[i]:bounds[i + 1], in_mode], in_mode,
+                peak_freqs[i], exclude, k_neighbor, rank))
+        return results
+
+    def score_joint(self, candidates, dis_measure="bhat", k_neighbor=1,
+                    rank=1, excludes=None):
+        """Jointly estimates the tonics and modes of distributions at once
+
+        Args:
+            candidates (list): (distribution, peak indices, peak
+                frequencies) of each recording, see get_peaks
+            dis_measure (str, optional): distance measure. Defaults to "bhat"
+            k_neighbor (int, optional): number of neighbors. Defaults to 1
+            rank (int, optional): number of estimates. Defaults to 1
+            excludes (list, optional): source to leave out per recording.
+                Defaults to None
+
+        Returns:
+            list -- [[tonic, mode], distance] pairs of each recording
+        """
+        excludes = excludes or [None] * len(candidates)
+        if self.coarse_step is not None:
+            return [self._rank_joint(
+                self._coarse_to_fine(query, peak_idx, dis_measure,
+                                     self.mode_idx, len(self.mode_labels),
+                                     exclude),
+                freqs, exclude, k_neighbor, rank)
+                for (query, peak_idx, freqs), exclude in zip(candidates,
+                                                             excludes)]
+
+        dists, peak_freqs, bounds = self._batch_peak_distances(
+            candidates, dis_measure, k_neighbor)
+
+        return [self._rank_joint(dists[bounds[i]:bounds[i + 1]],
+                                 peak_freqs[i], exclude, k_neighbor, rank)
+                for i, exclude in enumerate(excludes)]
+
+
+def vote(dists, labels, excluded, k_neighbor, rank):
+    """Ranks the candidates by the votes of the k nearest neighbors
+
+    Args:
+        dists (numpy.ndarray): distance of each neighbor
+        labels (numpy.ndarray): candidate index, which each neighbor votes
+        excluded (numpy.ndarray): boolean mask of the left-out neighbors
+        k_neighbor (int): number of neighbors
+        rank (int): number of candidates to return
+
+    Returns:
+        list -- (candidate index, distance) pairs, sorted by decreasing votes
+        and increasing distance of the nearest voting neighbor
+    """
+    neighbors = np.flatnonzero(~excluded & ~np.isnan(dists))
+    nearest = neighbors[np.argsort(dists[neighbors], kind="stable")[
+        :k_neighbor]]
+
+    votes = np.bincount(labels[nearest])
+    min_dist = np.full(len(votes), np.inf)
+    np.minimum.at(min_dist, labels[nearest], dists[nearest])
+
+    voted = np.flatnonzero(votes)
+    order = voted[np.lexsort((min_dist[voted], -votes[voted]))]
+    return [(int(i), float(min_dist[i])) for i in order[:rank]]
@@ -0,0 +1,90 @@
+"""Bounded least-recently-used cache of loaded objects
+
+The per-process caches of the feature banks, pitch stores and models are
+bounded, so that a long-lived worker, which serves many configurations, does
+not keep all of them in memory.
+"""
+import collections
+import threading
+
+
+class LRUCache:
+    """Thread-safe least-recently-used cache
+
+    Examples:
+        >>> banks = LRUCache(capacity=4)
+        >>> bank = banks.get(bank_folder, lambda: FeatureBank(bank_folder))
+    """
+
+    def __init__(self, capacity):
+        """Creates an empty cache
+
+        Args:
+            capacity (int): maximum number of objects
+
+        Raises:
+            ValueError: if the capacity is less than 1
+        """
+        if capacity < 1:
+            raise ValueError("The capacity should be at least 1")
+        self.capacity = capacity
+        self._items = collections.OrderedDict()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def keys(self):
+        """list -- the keys, from the least recently used"""
+        with self._lock:
+            return list(self._items)
+
+    def get(self, key, load):
+        """Returns the object of a key, loading it on a miss
+
+        Args:
+            key (hashable): the key
+            load (callable): function without arguments, which loads the
+                object
+
+        Returns:
+            object -- the object
+        """
+        with self._lock:
+            if key in self._items:
+                self.hits += 1
+                self._items.move_to_end(key)
+                return self._items[key]
+            self.misses += 1
+            value = load()
+            self.put(key, value)
+            return value
+
+    def put(self, key, value):
+        """Stores an object, evicting the least recently used ones
+
+        Args:
+            key (hashable): the key
+            value (object): the object
+        """
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.capacity:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def peek(self, key, default=None):
+        """Returns the object of a key without marking it as used"""
+        return self._items.get(key, default)
+
+    def clear(self):
+        """Removes all the objects"""
+        with self._lock:
+            self._items.clear()
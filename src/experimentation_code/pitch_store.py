@@ -0,0 +1,238 @@
+"""Binary, memory-mapped store for the pitch tracks of the dataset
+
+The pitch tracks are converted once from the ``.pitch`` text files into a
+single float32 array (``pitch.f32``) and an index (``index.json``), which
+maps each MBID to the offset and the length of its track in the array.
+Reading a track is then a zero-copy slice of a memory map instead of a text
+parse.
+"""
+import json
+import os
+
+import numpy as np
+
+from . import lru
+
+DATA_FILE = "pitch.f32"
+INDEX_FILE = "index.json"
+DTYPE = np.dtype("<f4")
+
+PITCH_COLUMN = 1  # columns in the .pitch files: time, pitch (Hz), salience
+MAX_OPEN_STORES = 2  # per process
+
+
+def get_mbid(anno):
+    """Extracts the MBID from an annotation
+
+    Args:
+        anno (dict): annotation of a recording, as given in annotations.json
+
+    Returns:
+        str -- MBID of the recording
+    """
+    return os.path.split(anno["mbid"])[-1]
+
+
+def get_pitch_file(anno, dataset_folder):
+    """Returns the path of the pitch file of an annotated recording
+
+    Args:
+        anno (dict): annotation of a recording, as given in annotations.json
+        dataset_folder (str): path to otmm_makam_recognition_dataset
+
+    Returns:
+        str -- absolute path of the .pitch file
+    """
+    return os.path.abspath(os.path.join(
+        dataset_folder, "data", anno["makam"], get_mbid(anno) + ".pitch"))
+
+
+def read_pitch_file(pitch_file):
+    """Reads the pitch values (in Hz) from a .pitch text file
+
+    Args:
+        pitch_file (str): path to the .pitch file
+
+    Returns:
+        numpy.ndarray -- 1D float32 array of pitch values in Hz
+    """
+    pitch = np.loadtxt(pitch_file, ndmin=2)
+    return pitch[:, PITCH_COLUMN].astype(DTYPE)
+
+
+def _read_index(store_folder):
+    index_file = os.path.join(store_folder, INDEX_FILE)
+    if not os.path.exists(index_file):
+        return {}
+    with open(index_file) as f:
+        return json.load(f)
+
+
+def _write_index(store_folder, index):
+    index_file = os.path.join(store_folder, INDEX_FILE)
+    tmp_file = index_file + ".tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(index, f)
+    os.replace(tmp_file, index_file)
+
+
+def _num_frames(index):
+    # a re-converted track is appended, hence the data may have gaps
+    return max((entry["offset"] + entry["length"]
+                for entry in index.values()), default=0)
+
+
+def _is_stale(index, mbid, source_hashes):
+    if mbid not in index:
+        return True
+    return (mbid in source_hashes and
+            index[mbid].get("source_hash") != source_hashes[mbid])
+
+
+def build(annotations, dataset_folder, store_folder, overwrite=False,
+          source_hashes=None):
+    """Converts the pitch tracks of the annotated recordings into the store
+
+    The tracks are appended to the data file one at a time, hence the store
+    can be extended later with new recordings. The index is replaced
+    atomically after all tracks are written, so an interrupted build leaves
+    the previous store readable.
+
+    If the content hashes of the pitch files are given, a stored track is
+    converted again when the hash of its file changes.
+
+    Args:
+        annotations (list): annotations of the recordings to store
+        dataset_folder (str): path to otmm_makam_recognition_dataset
+        store_folder (str): folder to write the store into
+        overwrite (bool, optional): rebuild the store from scratch.
+            Defaults to False, i.e. only the new recordings are added
+        source_hashes (dict, optional): content hash of the pitch file of
+            each MBID. Defaults to None
+
+    Returns:
+        str -- status message
+    """
+    if not os.path.exists(store_folder):
+        os.makedirs(store_folder)
+
+    index = {} if overwrite else _read_index(store_folder)
+    source_hashes = source_hashes or {}
+
+    new_annos = [anno for anno in annotations
+                 if _is_stale(index, get_mbid(anno), source_hashes)]
+    if not new_annos:
+        return u"{0:s} skipped.".format(store_folder)
+
+    _append(store_folder, index, ((get_mbid(anno), read_pitch_file(
+        get_pitch_file(anno, dataset_folder))) for anno in new_annos),
+        source_hashes)
+
+    return u"{0:s} created.".format(store_folder)
+
+
+def _append(store_folder, index, tracks, source_hashes):
+    data_file = os.path.join(store_folder, DATA_FILE)
+    offset = _num_frames(index)
+    with open(data_file, "ab" if index else "wb") as f:
+        # drop any trailing data from an interrupted build
+        f.truncate(offset * DTYPE.itemsize)
+        for mbid, pitch in tracks:
+            pitch = np.asarray(pitch, dtype=DTYPE)
+            f.write(pitch.tobytes())
+
+            index[mbid] = {"offset": offset, "length": len(pitch)}
+            if mbid in source_hashes:
+                index[mbid]["source_hash"] = source_hashes[mbid]
+            offset += len(pitch)
+
+    _write_index(store_folder, index)
+
+
+def add_tracks(store_folder, tracks, source_hashes=None):
+    """Appends pitch tracks, which are already read, to the store
+
+    A track of a stored recording replaces it.
+
+    Args:
+        store_folder (str): folder of the store
+        tracks (dict): 1D pitch values in Hz of each MBID
+        source_hashes (dict, optional): content hash of the pitch file of
+            each MBID. Defaults to None
+    """
+    if not os.path.exists(store_folder):
+        os.makedirs(store_folder)
+    _append(store_folder, _read_index(store_folder), tracks.items(),
+            source_hashes or {})
+
+
+def get_source_hashes(store_folder):
+    """dict -- the content hash of the pitch file of each stored MBID, if
+    given when it is stored"""
+    return {mbid: entry["source_hash"] for mbid, entry in
+            _read_index(store_folder).items() if "source_hash" in entry}
+
+
+class PitchStore:
+    """Read-only access to the pitch tracks in a store
+
+    Examples:
+        >>> store = PitchStore("./data/pitch_store")
+        >>> pitch = store[mbid]  # read-only float32 view, no copy
+    """
+
+    def __init__(self, store_folder):
+        self.store_folder = store_folder
+        self.index = _read_index(store_folder)
+        if not self.index:
+            raise IOError(u"No pitch store found in {0:s}".format(
+                store_folder))
+
+        num_frames = _num_frames(self.index)
+        self.data = np.memmap(os.path.join(store_folder, DATA_FILE),
+                              dtype=DTYPE, mode="r", shape=(num_frames,))
+
+    def __getitem__(self, mbid):
+        entry = self.index[mbid]
+        start = entry["offset"]
+        return self.data[start:start + entry["length"]]
+
+    def __contains__(self, mbid):
+        return mbid in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def mbids(self):
+        """list -- MBIDs of the stored recordings"""
+        return list(self.index.keys())
+
+
+_OPEN_STORES = lru.LRUCache(MAX_OPEN_STORES)
+
+
+def load(store_folder):
+    """Opens a pitch store once per process and reuses it in later calls
+
+    The store is reopened only if tracks are added to it since it was
+    opened (see add_tracks). At most MAX_OPEN_STORES stores are kept open.
+
+    Args:
+        store_folder (str): folder of the store
+
+    Returns:
+        PitchStore -- the opened store
+    """
+    store_folder = os.path.abspath(store_folder)
+    try:
+        stat = os.stat(os.path.join(store_folder, INDEX_FILE))
+        version = (stat.st_size, stat.st_mtime_ns)
+    except OSError:
+        version = None
+
+    cached = _OPEN_STORES.peek(store_folder)
+    if cached is not None and cached[0] != version:
+        _OPEN_STORES.put(store_folder, (version, PitchStore(store_folder)))
+    return _OPEN_STORES.get(
+        store_folder, lambda: (version, PitchStore(store_folder)))[1]
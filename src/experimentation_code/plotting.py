@@ -0,0 +1,51 @@
+"""Plots of the experiments
+
+This is the only module importing matplotlib. It is not imported by the
+other modules, so that the workers, which only compute, do not pay for the
+import; import it only to plot.
+"""
+from matplotlib import pyplot as plt
+
+
+def plot_min_peak_ratio(min_peak_ratios, ratio_tonic, num_peak,
+                        prob_tonic=None, num_exps=None):
+    """Plots the ratio of the tonic among the peaks and the number of peaks
+
+    Args:
+        min_peak_ratios (list): minimum peak ratios
+        ratio_tonic (list): ratio of the distributions with the tonic among
+            their peaks, per minimum peak ratio
+        num_peak (list): total number of peaks per minimum peak ratio
+        prob_tonic (list, optional): prior probability of the tonic per
+            minimum peak ratio. Defaults to None
+        num_exps (int, optional): number of experiments, shown in the
+            title. Defaults to None
+    """
+    fig, ax1 = plt.subplots()
+    ax1.plot(min_peak_ratios, ratio_tonic, "bd-",
+             label="Ratio of the tests with the tonic")
+    if prob_tonic is not None:
+        ax1.plot(min_peak_ratios, prob_tonic, "b*-",
+                 label="Prior probability of tonic")
+    ax1.set_ylabel("Probability of getting the tonic\namong the "
+                   "detected peaks", color="b")
+    ax1.set_ylim([0, 1])
+    for tl in ax1.get_yticklabels():
+        tl.set_color("b")
+    plt.setp(ax1, xticks=[])
+
+    ax2 = ax1.twinx()
+    ax2.plot(min_peak_ratios, num_peak, "r.-", label="Total number of peaks")
+    ax2.set_ylabel("# peaks", color="r")
+    for tl in ax2.get_yticklabels():
+        tl.set_color("r")
+
+    plt.setp(ax2, xticks=min_peak_ratios)
+    ax1.set_xticklabels(min_peak_ratios, rotation=-60)
+    ax1.set_xlabel("Minimum Peak Ratio")
+
+    if num_exps is not None:
+        plt.title(
+            "Results wrt minimum_peak_ratio values computed\nusing "
+            "{0:d} recordings in {1:d} experiments".format(1000 * num_exps,
+                                                           num_exps))
@@ -0,0 +1,161 @@
+"""Append-only log of the test results of a fold
+
+The ranked estimates of each test sample are appended as one JSON line to
+``results.log.jsonl`` as soon as they are computed, instead of a file per
+sample. A restarted test reads the log to skip the saved samples and to
+retry the failed ones. When all samples are saved, the log is finalized into
+a compact ``results.json``, which maps each MBID to its estimates, and
+removed. The records are streamed in both steps, so the memory does not
+grow with the size of the results.
+
+As in the feature bank, a record is committed once its line is complete;
+the partial line of an interrupted append is truncated by the next one.
+
+The log may be keyed on the inputs of the test, e.g. the cache key of the
+task (``results.key``). The saved results of other inputs, e.g. of a model
+trained again, are dropped when the log is opened; the results of the same
+inputs are kept, so an interrupted test resumes.
+"""
+import json
+import os
+
+LOG_FILE = "results.log.jsonl"
+RESULTS_FILE = "results.json"
+KEY_FILE = "results.key"
+SAVED = "saved"
+FAILED = "failed"
+
+
+def _committed_lines(log_file):
+    """Yields the end offset and the record of each complete line"""
+    if not os.path.exists(log_file):
+        return
+    offset = 0
+    with open(log_file, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):  # interrupted append
+                return
+            offset += len(line)
+            yield offset, json.loads(line)
+
+
+class ResultsLog:
+    """Streaming sink of the results of a fold
+
+    Examples:
+        >>> log = ResultsLog(test_folder)
+        >>> pending = [s for s in samples if s["source"] not in log.saved]
+        >>> log.append(mbid, estimates)
+        >>> if len(log.saved) == len(samples):
+        ...     log.finalize()
+    """
+
+    def __init__(self, test_folder, key=None):
+        """Opens the log of a fold
+
+        Args:
+            test_folder (str): folder of the results of the fold
+            key (str, optional): key of the inputs of the test. Defaults to
+                None, i.e. the saved results are always kept
+        """
+        self.test_folder = test_folder
+        self.log_file = os.path.join(test_folder, LOG_FILE)
+        self.results_file = os.path.join(test_folder, RESULTS_FILE)
+        if key is not None:
+            self._check_key(key)
+
+        # the last record of an MBID is its status
+        self.status = {}
+        self._size = 0
+        for self._size, record in _committed_lines(self.log_file):
+            self.status[record["mbid"]] = record["status"]
+
+    def _check_key(self, key):
+        key_file = os.path.join(self.test_folder, KEY_FILE)
+        stored = None
+        if os.path.exists(key_file):
+            with open(key_file) as f:
+                stored = f.read().strip()
+        if stored == key:
+            return
+
+        # the results of other inputs
+        for path in [self.log_file, self.results_file]:
+            if os.path.exists(path):
+                os.remove(path)
+        tmp_file = key_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            f.write(key + "\n")
+        os.replace(tmp_file, key_file)
+
+    @property
+    def saved(self):
+        """set -- MBIDs of the saved samples"""
+        return {mbid for mbid, s in self.status.items() if s == SAVED}
+
+    @property
+    def failed(self):
+        """set -- MBIDs of the samples, which failed in their last try"""
+        return {mbid for mbid, s in self.status.items() if s == FAILED}
+
+    def _write(self, record):
+        with open(self.log_file, "ab") as f:
+            f.truncate(self._size)
+            line = (json.dumps(record) + "\n").encode()
+            f.write(line)
+            f.flush()
+        self._size += len(line)
+        self.status[record["mbid"]] = record["status"]
+
+    def append(self, mbid, results):
+        """Appends the ranked estimates of a sample
+
+        Args:
+            mbid (str): MBID of the test sample
+            results (list): JSON-serializable estimates of the sample
+        """
+        self._write({"mbid": mbid, "status": SAVED, "results": results})
+
+    def append_failure(self, mbid, error=None):
+        """Records that a sample failed
+
+        Args:
+            mbid (str): MBID of the test sample
+            error (str, optional): description of the error. Defaults to
+                None
+        """
+        self._write({"mbid": mbid, "status": FAILED, "error": error})
+
+    def finalize(self):
+        """Writes the saved results into the results file and removes the log
+
+        The results file is written into a temporary file first and then
+        renamed, so it is either complete or absent.
+
+        Returns:
+            str -- path of the results file
+        """
+        # the offset of the last saved record of each MBID
+        last = {}
+        for offset, record in _committed_lines(self.log_file):
+            if record["status"] == SAVED:
+                last[record["mbid"]] = offset
+        keep = set(last.values())
+
+        tmp_file = self.results_file + ".tmp"
+        with open(tmp_file, "w") as out:
+            out.write("{")
+            sep = ""
+            for offset, record in _committed_lines(self.log_file):
+                if offset in keep:
+                    out.write("{0:s}{1:s}:{2:s}".format(
+                        sep, json.dumps(record["mbid"]),
+                        json.dumps(record["results"],
+                                   separators=(",", ":"))))
+                    sep = ","
+            out.write("}")
+        os.replace(tmp_file, self.results_file)
+        os.remove(self.log_file)
+        self.status = {}
+        self._size = 0
+        return self.results_file
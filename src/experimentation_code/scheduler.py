@@ -0,0 +1,229 @@
+"""Runs a dependency graph of tasks on a local process pool
+
+A task is submitted as soon as all the tasks it depends on have finished, so
+a slow task only delays its own dependents instead of a whole phase of the
+experiments. Before it is submitted, the optional is_done check of a task is
+called in the scheduling process to skip the work that is already saved.
+If a task fails, its dependents are cancelled while the rest of the graph
+continues to run.
+
+The tasks run on long-lived worker processes. The tasks of the same group,
+e.g. the tests of a configuration, which differ only in cheap parameters,
+are routed to the same worker, so that the inputs cached by the worker are
+loaded once. An idle worker takes the queued tasks of a busy one instead of
+waiting.
+"""
+import collections
+import concurrent.futures
+import os
+
+DONE = "done"
+SKIPPED = "skipped"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+PREFETCH = 2  # tasks submitted to a worker at a time
+
+Task = collections.namedtuple("Task", ["func", "args", "kwargs", "deps",
+                                       "is_done", "group"])
+TaskResult = collections.namedtuple("TaskResult", ["status", "value"])
+
+
+class TaskGraph:
+    """Directed acyclic graph of tasks
+
+    The dependencies of a task must be added before the task itself, hence
+    the graph cannot have cycles and the insertion order is a topological
+    order.
+
+    Examples:
+        >>> graph = TaskGraph()
+        >>> graph.add("features", compute_features, (anno,))
+        >>> graph.add("training", train, (fold,), deps=["features"],
+        ...           is_done=functools.partial(os.path.exists, model_file))
+        >>> results = run(graph, num_workers=8)
+    """
+
+    def __init__(self):
+        self.tasks = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def __contains__(self, key):
+        return key in self.tasks
+
+    def add(self, key, func, args=(), kwargs=None, deps=(), is_done=None,
+            group=None):
+        """Adds a task to the graph
+
+        Args:
+            key (hashable): unique key of the task
+            func (callable): picklable function to run, i.e. a function
+                defined at the top level of a module
+            args (tuple, optional): positional arguments of func.
+                Defaults to ()
+            kwargs (dict, optional): keyword arguments of func.
+                Defaults to None
+            deps (iterable, optional): keys of the tasks, which should finish
+                before the task starts. Defaults to ()
+            is_done (callable, optional): function without arguments, which
+                returns True if the output of the task already exists.
+                Defaults to None, i.e. the task always runs
+            group (hashable, optional): key of the expensive inputs, which
+                the task shares with other tasks; the tasks of a group run
+                on the same worker if possible. Defaults to None
+
+        Raises:
+            ValueError: if the key is already in the graph or a dependency
+                is not
+
+        Returns:
+            hashable -- the key
+        """
+        if key in self.tasks:
+            raise ValueError("Duplicate task: {0!r}".format(key))
+        deps = tuple(deps)
+        unknown = [dep for dep in deps if dep not in self.tasks]
+        if unknown:
+            raise ValueError("Unknown dependencies of {0!r}: {1!r}".format(
+                key, unknown))
+
+        self.tasks[key] = Task(func, tuple(args), kwargs or {}, deps, is_done,
+                               group)
+        return key
+
+
+def run(graph, num_workers=None, callback=None):
+    """Runs the tasks in a graph as soon as their dependencies finish
+
+    Args:
+        graph (TaskGraph): the tasks
+        num_workers (int, optional): number of worker processes. 0 runs the
+            tasks in the calling process one by one. Defaults to None, i.e.
+            the number of CPUs
+        callback (callable, optional): called with the key and the
+            TaskResult of each task, when it is finished. Defaults to None
+
+    Returns:
+        dict -- TaskResult of each task key. The value is the return value of
+        a done task, the exception of a failed task and None otherwise
+    """
+    dependents = collections.defaultdict(list)
+    num_pending_deps = {}
+    for key, task in graph.tasks.items():
+        num_pending_deps[key] = len(set(task.deps))
+        for dep in set(task.deps):
+            dependents[dep].append(key)
+
+    results = {}
+    ready = collections.deque(
+        key for key, num in num_pending_deps.items() if num == 0)
+
+    def finish(key, status, value=None):
+        results[key] = TaskResult(status, value)
+        if callback is not None:
+            callback(key, results[key])
+
+        if status in (DONE, SKIPPED):
+            for dependent in dependents[key]:
+                num_pending_deps[dependent] -= 1
+                if num_pending_deps[dependent] == 0:
+                    ready.append(dependent)
+        else:  # the dependents never become ready; cancel them
+            stack = list(dependents[key])
+            while stack:
+                dependent = stack.pop()
+                if dependent not in results:
+                    finish(dependent, CANCELLED)
+
+    if num_workers == 0:
+        while ready:
+            key = ready.popleft()
+            task = graph.tasks[key]
+            if task.is_done is not None and task.is_done():
+                finish(key, SKIPPED)
+                continue
+            try:
+                value = task.func(*task.args, **task.kwargs)
+            except Exception as err:  # pylint: disable=broad-except
+                finish(key, FAILED, err)
+            else:
+                finish(key, DONE, value)
+        return results
+
+    workers = [_Worker() for _ in range(num_workers or os.cpu_count())]
+    affinity = {}
+    running = {}
+    try:
+        # the tasks queued on the workers are submitted as the running ones
+        # finish
+        while ready or running or any(w.queue for w in workers):
+            while ready:
+                key = ready.popleft()
+                task = graph.tasks[key]
+                if task.is_done is not None and task.is_done():
+                    finish(key, SKIPPED)
+                    continue
+                worker = affinity.get(task.group)
+                if worker is None:
+                    worker = min(workers, key=lambda w: w.load)
+                    if task.group is not None:
+                        affinity[task.group] = worker
+                worker.queue.append(key)
+
+            for worker in workers:
+                for key in worker.take(workers):
+                    task = graph.tasks[key]
+                    try:
+                        running[worker.executor.submit(
+                            task.func, *task.args, **task.kwargs)] = \
+                            key, worker
+                    except Exception as err:  # e.g. a broken worker
+                        worker.num_submitted -= 1
+                        finish(key, FAILED, err)
+
+            if running:
+                finished, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    key, worker = running.pop(future)
+                    worker.num_submitted -= 1
+                    err = future.exception()
+                    if err is None:
+                        finish(key, DONE, future.result())
+                    else:
+                        finish(key, FAILED, err)
+    finally:
+        for worker in workers:
+            worker.executor.shutdown(wait=True)
+
+    return results
+
+
+class _Worker:
+    """A long-lived process, which runs its queued tasks one by one"""
+
+    def __init__(self):
+        self.executor = concurrent.futures.ProcessPoolExecutor(1)
+        self.queue = collections.deque()
+        self.num_submitted = 0
+
+    @property
+    def load(self):
+        """int -- number of the queued and the submitted tasks"""
+        return len(self.queue) + self.num_submitted
+
+    def take(self, workers):
+        """Takes the tasks to submit, stealing one from the longest queue of
+        the other workers when idle"""
+        keys = []
+        while self.num_submitted < PREFETCH and self.queue:
+            keys.append(self.queue.popleft())
+            self.num_submitted += 1
+        if self.num_submitted == 0:
+            busiest = max(workers, key=lambda w: len(w.queue))
+            if busiest.queue:  # the most recently queued task
+                keys.append(busiest.queue.pop())
+                self.num_submitted += 1
+        return keys
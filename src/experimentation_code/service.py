@@ -0,0 +1,447 @@
+"""Long-running recognition service with a warm model cache
+
+The trained models are kept in memory in a least-recently-used cache, so a
+request only pays for loading its model once. Requests arriving within a
+short window are grouped by their model and parameters, and each group is
+scored in a single distance pass (see KNNModel.score_modes).
+
+A request is a JSON object::
+
+    {"model": {...},  # passed to the loader, e.g. the training config
+     "experiment_type": "mode" | "tonic" | "joint",
+     "pitch": [...],  # pitch values in Hz, or
+     "distribution": [...], "ref_freq": 220.0,  # precomputed distribution
+     "tonic": 220.0,  # known tonic of a mode request with a pitch track
+     "mode": "Hicaz",  # known mode of a tonic request
+     "dis_measure": "bhat", "k_neighbor": 1, "rank": 1,
+     "min_peak_ratio": 0.15, "exclude": null}
+
+The distribution of a mode request is wrt the tonic, hence it does not need
+a reference frequency. The service speaks HTTP over TCP or a Unix socket:
+``POST /recognize`` with a request or ``{"requests": [...]}``, and
+``GET /status``.
+"""
+import collections
+import concurrent.futures
+import http.server
+import json
+import numbers
+import os
+import queue
+import socketserver
+import threading
+import time
+
+import numpy as np
+
+from . import distance, distribution, evaluation, lru
+
+DEFAULTS = {"dis_measure": "bhat", "k_neighbor": 1, "rank": 1,
+            "min_peak_ratio": 0.15, "exclude": None}
+
+
+class ModelCache:
+    """Least-recently-used cache of the loaded models
+
+    Examples:
+        >>> models = ModelCache(loader, capacity=4)
+        >>> model = models.get(config)
+    """
+
+    def __init__(self, loader, capacity=4):
+        """Creates an empty cache
+
+        Args:
+            loader (callable): loads the model of a config dict
+            capacity (int, optional): maximum number of models in memory.
+                Defaults to 4
+        """
+        self.loader = loader
+        self._models = lru.LRUCache(capacity)
+
+    @staticmethod
+    def key(config):
+        """Hashable key of a config dict"""
+        return tuple(sorted(config.items()))
+
+    def __contains__(self, config):
+        return self.key(config) in self._models
+
+    def __len__(self):
+        return len(self._models)
+
+    @property
+    def capacity(self):
+        """int -- maximum number of models in memory"""
+        return self._models.capacity
+
+    @property
+    def hits(self):
+        """int -- number of requests served by a loaded model"""
+        return self._models.hits
+
+    @property
+    def misses(self):
+        """int -- number of model loads"""
+        return self._models.misses
+
+    @property
+    def evictions(self):
+        """int -- number of models evicted to load others"""
+        return self._models.evictions
+
+    def get(self, config):
+        """Returns the model of a config, loading it on a miss
+
+        Args:
+            config (dict): config of the model
+
+        Returns:
+            object -- the model
+        """
+        return self._models.get(self.key(config),
+                                lambda: self.loader(config))
+
+    def status(self):
+        """dict -- the loaded configs, from the least recently used, and the
+        hit and miss counts"""
+        return {"models": [dict(key) for key in self._models.keys()],
+                "capacity": self.capacity, "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions}
+
+
+def parse_request(request):
+    """Validates a request and fills in the default parameters
+
+    Args:
+        request (dict): the request
+
+    Raises:
+        ValueError: if the request is invalid
+
+    Returns:
+        dict -- the request with the default parameters
+    """
+    if not isinstance(request, dict):
+        raise ValueError("The request should be a JSON object")
+    request = dict(DEFAULTS, **request)
+
+    if not isinstance(request.get("model"), dict):
+        raise ValueError("The request should have a model config")
+    try:
+        hash(ModelCache.key(request["model"]))
+    except TypeError:
+        raise ValueError("The model config should have scalar values")
+    experiment_type = request.get("experiment_type")
+    if experiment_type not in evaluation.EXPERIMENT_TYPES:
+        raise ValueError("Unknown experiment_type: {0!r}".format(
+            experiment_type))
+    if request["dis_measure"] not in distance.DISTANCE_MEASURES:
+        raise ValueError("Unknown dis_measure: {0!r}".format(
+            request["dis_measure"]))
+    for name in ["k_neighbor", "rank"]:
+        if not isinstance(request[name], numbers.Integral) or \
+                isinstance(request[name], bool) or request[name] < 1:
+            raise ValueError("{0:s} should be a positive integer".format(
+                name))
+    if not isinstance(request["min_peak_ratio"], numbers.Real) or \
+            isinstance(request["min_peak_ratio"], bool):
+        raise ValueError("min_peak_ratio should be a number")
+
+    if ("pitch" in request) == ("distribution" in request):
+        raise ValueError("The request should have either a pitch track or "
+                         "a distribution")
+    if "pitch" in request:
+        request["pitch"] = np.asarray(request["pitch"], dtype=float)
+        if experiment_type == "mode" and "tonic" not in request:
+            raise ValueError("Mode recognition needs the tonic")
+    else:
+        request["distribution"] = np.asarray(request["distribution"],
+                                             dtype=float)
+        if experiment_type != "mode" and "ref_freq" not in request:
+            raise ValueError("Tonic identification needs the reference "
+                             "frequency of the distribution")
+    if experiment_type == "tonic" and "mode" not in request:
+        raise ValueError("Tonic identification needs the mode")
+    return request
+
+
+def _group_key(request):
+    return (ModelCache.key(request["model"]), request["experiment_type"],
+            request["dis_measure"], request["k_neighbor"], request["rank"],
+            request["min_peak_ratio"])
+
+
+def _prepare(model, request):
+    # the normalized query of mode requests, the tonic candidates otherwise
+    if request["experiment_type"] == "mode":
+        if "pitch" in request:
+            return model.get_query(request["pitch"], request["tonic"])
+        query = request["distribution"]
+        if query.shape != model.bins.shape:
+            raise ValueError("The distribution should have {0:d} bins".format(
+                len(model.bins)))
+        return distribution.normalize(query)
+
+    if "pitch" in request:
+        return model.get_tonic_candidates(request["pitch"],
+                                          request["min_peak_ratio"])
+    return model.get_peaks(distribution.normalize(request["distribution"]),
+                           request["ref_freq"], request["min_peak_ratio"])
+
+
+def score(model, requests):
+    """Scores requests with the same model and parameters at once
+
+    Args:
+        model (knn.KNNModel): the model
+        requests (list): parsed requests
+
+    Returns:
+        list -- the estimates of each request
+    """
+    first = requests[0]
+    kwargs = {"dis_measure": first["dis_measure"],
+              "k_neighbor": first["k_neighbor"], "rank": first["rank"],
+              "excludes": [r["exclude"] for r in requests]}
+    prepared = [_prepare(model, r) for r in requests]
+
+    if first["experiment_type"] == "mode":
+        return model.score_modes(prepared, **kwargs)
+    if first["experiment_type"] == "tonic":
+        return model.score_tonics(prepared, [r["mode"] for r in requests],
+                                  **kwargs)
+    return model.score_joint(prepared, **kwargs)
+
+
+class Recognizer:
+    """Batches the concurrent requests into vectorized scoring
+
+    A single scoring thread takes the queued requests, waits up to
+    max_delay seconds for more, and scores each group of requests with the
+    same model and parameters at once. A model, which fails to load, fails
+    all the requests of the round without loading it again.
+
+    Examples:
+        >>> recognizer = Recognizer(loader, capacity=4)
+        >>> recognizer.recognize({"model": config, "experiment_type": "joint",
+        ...                       "pitch": pitch.tolist()})
+        >>> recognizer.close()
+    """
+
+    def __init__(self, loader, capacity=4, max_batch=64, max_delay=0.002):
+        """Starts the scoring thread
+
+        Args:
+            loader (callable): loads the model of a config dict
+            capacity (int, optional): maximum number of models in memory.
+                Defaults to 4
+            max_batch (int, optional): maximum number of requests scored in
+                a round. Defaults to 64
+            max_delay (float, optional): seconds to wait for more requests
+                after the first one. Defaults to 0.002
+        """
+        self.models = ModelCache(loader, capacity)
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.num_requests = 0
+        self.num_batches = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def warm(self, configs):
+        """Loads models into the cache before the first request
+
+        Args:
+            configs (list): config dicts of the models
+        """
+        for config in configs:
+            self.models.get(config)
+
+    def submit(self, request):
+        """Queues a request
+
+        Args:
+            request (dict): the request
+
+        Raises:
+            ValueError: if the request is invalid
+
+        Returns:
+            concurrent.futures.Future -- the future estimates
+        """
+        request = parse_request(request)
+        future = concurrent.futures.Future()
+        self._queue.put((request, future))
+        return future
+
+    def recognize(self, request, timeout=None):
+        """Scores a request and waits for its estimates
+
+        Args:
+            request (dict): the request
+            timeout (float, optional): seconds to wait. Defaults to None
+
+        Returns:
+            list -- [estimate, distance] pairs
+        """
+        return self.submit(request).result(timeout)
+
+    def status(self):
+        """dict -- the model cache and batching statistics"""
+        return dict(self.models.status(), requests=self.num_requests,
+                    batches=self.num_batches)
+
+    def close(self):
+        """Stops the scoring thread after the queued requests"""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _take(self):
+        item = self._queue.get()
+        if item is None:
+            return None
+        items = [item]
+        deadline = time.monotonic() + self.max_delay
+        while len(items) < self.max_batch:
+            try:
+                item = self._queue.get(
+                    timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if item is None:  # score the taken requests before stopping
+                self._queue.put(None)
+                break
+            items.append(item)
+        return items
+
+    def _run(self):
+        while True:
+            items = self._take()
+            if items is None:
+                return
+
+            # a failing request only fails its future; the thread keeps
+            # serving the others
+            groups = collections.OrderedDict()
+            for request, future in items:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    key = _group_key(request)
+                    groups.setdefault(key, []).append((request, future))
+                except Exception as err:
+                    future.set_exception(err)
+            load_errors = {}  # of the models of this round
+            for group in groups.values():
+                self._score_group(group, load_errors)
+                self.num_batches += 1
+            self.num_requests += len(items)
+
+    def _load(self, config, load_errors):
+        key = ModelCache.key(config)
+        if key in load_errors:
+            raise load_errors[key]
+        try:
+            return self.models.get(config)
+        except Exception as err:
+            load_errors[key] = err
+            raise
+
+    def _score_group(self, group, load_errors):
+        requests, futures = zip(*group)
+        try:
+            model = self._load(requests[0]["model"], load_errors)
+        except Exception as err:
+            for future in futures:
+                future.set_exception(err)
+            return
+        try:
+            estimates = score(model, requests)
+        except Exception as err:
+            if len(group) == 1:
+                futures[0].set_exception(err)
+                return
+            # isolate the failing requests
+            for item in group:
+                self._score_group([item], load_errors)
+            return
+        for future, est in zip(futures, estimates):
+            future.set_result(est)
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep the connections alive
+
+    def _send(self, code, obj):
+        body = json.dumps(obj).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/status":
+            return self._send(404, {"error": "Not found"})
+        self._send(200, self.server.recognizer.status())
+
+    def do_POST(self):
+        if self.path != "/recognize":
+            return self._send(404, {"error": "Not found"})
+        recognizer = self.server.recognizer
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"null")
+            if isinstance(body, dict) and "requests" in body:
+                futures = [recognizer.submit(r) for r in body["requests"]]
+                return self._send(200, {"results": [
+                    f.result(self.server.request_timeout) for f in futures]})
+            self._send(200, {"estimates": recognizer.recognize(
+                body, self.server.request_timeout)})
+        except (ValueError, KeyError, TypeError) as err:
+            self._send(400, {"error": repr(err)})
+        except FileNotFoundError as err:
+            self._send(404, {"error": repr(err)})
+        except Exception as err:
+            self._send(500, {"error": repr(err)})
+
+    def address_string(self):
+        # the client of a Unix socket has no address
+        return str(self.client_address[0]) if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn,
+                      socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(recognizer, address, timeout=None, verbose=False):
+    """Creates the HTTP server of a recognizer
+
+    Args:
+        recognizer (Recognizer): the recognizer
+        address (tuple or str): (host, port) to serve over TCP, or the path
+            of a Unix socket
+        timeout (float, optional): seconds to wait for the estimates of a
+            request. Defaults to None
+        verbose (bool, optional): log the requests. Defaults to False
+
+    Returns:
+        socketserver.BaseServer -- the server; call serve_forever to start
+    """
+    if isinstance(address, str):
+        if os.path.exists(address):  # left over from a stopped server
+            os.remove(address)
+        server = _UnixHTTPServer(address, _Handler)
+    else:
+        server = http.server.ThreadingHTTPServer(tuple(address), _Handler)
+    server.recognizer = recognizer
+    server.request_timeout = timeout
+    server.verbose = verbose
+    return server
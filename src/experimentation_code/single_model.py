@@ -0,0 +1,168 @@
+"""Single-distribution-per-mode models in a compact binary format
+
+The "single" model of a mode is the sum of the histograms of its training
+recordings, normalized to unit sum. The models of all folds are computed
+from the feature bank in one group-by-mode reduction, i.e. a single matrix
+product of the (num_folds x num_modes x num_recordings) fold and mode
+memberships with the (num_recordings x num_bins) histograms. When
+recordings are added to a model later, or their histograms change, only the
+rows of their modes are summed again (see update).
+
+A model file is read with one array read, which is memory-mapped, so the
+worker processes share the pages of the same model. It consists of:
+
+- the 8-byte magic ``MAGIC``
+- the 8-byte little-endian length of the header
+- the JSON header: the configuration, the bins and the mode and the
+  training sources of each row, padded with spaces so that the matrix is
+  aligned to ``ALIGNMENT`` bytes
+- the (num_modes x num_bins) float64 distributions, row-major
+"""
+import collections
+import json
+import os
+
+import numpy as np
+
+MAGIC = b"DLFMSGL1"
+ALIGNMENT = 64
+DTYPE = np.dtype("<f8")
+
+SingleModel = collections.namedtuple(
+    "SingleModel", ["vals", "modes", "sources", "bins", "distribution_type",
+                    "step_size", "kernel_width"])
+
+
+def train_folds(bank, training_sources):
+    """Trains the single models of several folds at once
+
+    Args:
+        bank (feature_bank.FeatureBank): the feature bank
+        training_sources (list): MBIDs of the training recordings of each
+            fold
+
+    Returns:
+        list -- SingleModel of each fold. The modes without any training
+        recording in a fold are left out of its model
+    """
+    mbids = sorted(set(mbid for sources in training_sources
+                       for mbid in sources))
+    rows = bank.rows(mbids)
+    mode_labels, mode_idx = np.unique(bank.modes[rows], return_inverse=True)
+    column = {mbid: i for i, mbid in enumerate(mbids)}
+
+    # (num_folds, num_modes, num_recordings) memberships
+    weights = np.zeros((len(training_sources), len(mode_labels), len(mbids)))
+    for f, sources in enumerate(training_sources):
+        cols = np.array([column[mbid] for mbid in sources], dtype=int)
+        weights[f, mode_idx[cols], cols] = 1.0
+    sums = weights @ bank.hist[rows]  # (num_folds, num_modes, num_bins)
+
+    models = []
+    for fold_weights, fold_sums in zip(weights, sums):
+        in_fold = fold_weights.any(axis=1)
+        totals = fold_sums[in_fold].sum(axis=1, keepdims=True)
+        models.append(SingleModel(
+            fold_sums[in_fold] / totals, mode_labels[in_fold].tolist(),
+            [[mbids[c] for c in np.flatnonzero(w)]
+             for w in fold_weights[in_fold]],
+            bank.bins, bank.distribution_type, bank.step_size,
+            bank.kernel_width))
+    return models
+
+
+def update(model, bank, mbids):
+    """Adds recordings to the training set of a model, or updates them
+
+    The recordings join the row of their mode in the bank, and leave the
+    row of another mode, e.g. if their annotation is corrected. Only the
+    rows of these modes are summed again from the bank; the other rows are
+    kept as they are.
+
+    Args:
+        model (SingleModel): the model, with the bins of the bank
+        bank (feature_bank.FeatureBank): the feature bank
+        mbids (list): MBIDs of the new or the changed recordings in the bank
+
+    Returns:
+        tuple -- the updated SingleModel and the sorted modes of the rows,
+        which are summed again
+    """
+    sources = collections.OrderedDict(
+        (mode, list(srcs)) for mode, srcs in zip(model.modes, model.sources))
+    changed = set()
+    for mbid in mbids:
+        mode = str(bank.modes[bank.index[mbid]])
+        for other, srcs in sources.items():
+            if other != mode and mbid in srcs:
+                srcs.remove(mbid)
+                changed.add(other)
+        srcs = sources.setdefault(mode, [])
+        if mbid not in srcs:
+            srcs.append(mbid)
+        changed.add(mode)  # the histogram of the recording may change
+
+    rows = dict(zip(model.modes, model.vals))
+    modes = sorted(mode for mode, srcs in sources.items() if srcs)
+    vals = []
+    for mode in modes:
+        if mode in changed:
+            hist = bank.hist[bank.rows(sources[mode])].sum(axis=0)
+            vals.append(hist / hist.sum())
+        else:
+            vals.append(rows[mode])
+    updated = model._replace(
+        vals=np.array(vals, dtype=DTYPE).reshape(-1, len(model.bins)),
+        modes=modes, sources=[sorted(sources[mode]) for mode in modes])
+    return updated, sorted(changed)
+
+
+def save(model, path):
+    """Saves a model; the file is replaced once it is completely written
+
+    Args:
+        model (SingleModel): the model
+        path (str): path to the model file
+    """
+    header = json.dumps({
+        "modes": list(model.modes), "sources": model.sources,
+        "bins": np.asarray(model.bins).tolist(),
+        "distribution_type": model.distribution_type,
+        "step_size": model.step_size, "kernel_width": model.kernel_width,
+        "shape": list(np.shape(model.vals))}).encode()
+    offset = len(MAGIC) + 8 + len(header)
+    header += b" " * (-offset % ALIGNMENT)
+
+    tmp_file = "{0:s}.{1:d}.tmp".format(path, os.getpid())
+    with open(tmp_file, "wb") as f:
+        f.write(MAGIC)
+        f.write(np.array(len(header), dtype="<u8").tobytes())
+        f.write(header)
+        f.write(np.ascontiguousarray(model.vals, dtype=DTYPE).tobytes())
+    os.replace(tmp_file, path)
+
+
+def load(path):
+    """Loads a model
+
+    Args:
+        path (str): path to the model file
+
+    Raises:
+        IOError: if the file is not a single model file
+
+    Returns:
+        SingleModel -- the model
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise IOError(u"{0:s} is not a single model file".format(path))
+        header_len = int(np.frombuffer(f.read(8), dtype="<u8")[0])
+        header = json.loads(f.read(header_len))
+    # read-only memory map, which the worker processes share
+    vals = np.memmap(path, dtype=DTYPE, mode="r",
+                     offset=len(MAGIC) + 8 + header_len,
+                     shape=tuple(header["shape"]))
+    return SingleModel(vals, header["modes"], header["sources"],
+                       np.array(header["bins"]), header["distribution_type"],
+                       header["step_size"], header["kernel_width"])
@@ -0,0 +1,189 @@
+"""Synthetic dataset with the shape of the OTMM makam recognition dataset
+
+The dataset has NUM_RECORDINGS recordings of each of the MAKAMS, i.e. the
+same 20 modes x 50 recordings as the OTMM dataset, and it is divided into
+stratified folds as in the experiments. Hence the hardcoded checks of the
+training and testing steps (e.g. 100 test samples per fold, 45 training
+recordings per mode) pass, and the pipeline can be run offline, e.g. by the
+benchmarks.
+
+The pitch track of a recording is drawn from a random scale of its mode on
+the 53-TET (Holdrian comma) grid, with vibrato-like noise, octave jumps and
+unvoiced frames. The folder layout is the same as the OTMM dataset:
+
+- ``annotations.json``: one {"mbid", "makam", "tonic"} object per recording
+- ``data/<makam>/<mbid>.pitch``: (time, pitch in Hz, salience) per frame
+"""
+import os
+
+import numpy as np
+
+from . import cache, pitch_store
+
+MAKAMS = ("Acemasiran", "Acemkurdi", "Bestenigar", "Beyati", "Hicaz",
+          "Hicazkar", "Huseyni", "Huzzam", "Karcigar", "Kurdilihicazkar",
+          "Mahur", "Muhayyerkurdi", "Neva", "Nihavent", "Rast", "Saba",
+          "Segah", "Sultaniyegah", "Suzinak", "Ussak")
+NUM_RECORDINGS = 50  # per makam
+NUM_FOLDS = 10
+NUM_FRAMES = 5000
+HOP_SIZE = 128 / 44100.0  # seconds, the hop size of the OTMM pitch tracks
+COMMA = 1200.0 / 53  # cents
+MBID_PREFIX = "http://musicbrainz.org/recording/"
+
+
+def make_scales(num_modes, seed=0):
+    """Draws a scale per mode
+
+    Args:
+        num_modes (int): number of modes
+        seed (int, optional): random seed. Defaults to 0
+
+    Returns:
+        list -- (degrees in cents wrt the tonic, probabilities) of each
+        mode. The tonic is the most probable degree
+    """
+    rnd = np.random.RandomState(seed)
+    scales = []
+    for _ in range(num_modes):
+        steps = rnd.choice([4, 5, 8, 9], 6)  # in commas, 53 per octave
+        degrees = np.concatenate([[0], np.cumsum(steps)]) * COMMA
+        weights = rnd.uniform(1, 4, len(degrees))
+        weights[0] = 6
+        scales.append((degrees, weights / weights.sum()))
+    return scales
+
+
+def make_pitch(scale, tonic, num_frames=NUM_FRAMES, seed=0):
+    """Synthesizes a pitch track from a scale
+
+    Args:
+        scale (tuple): (degrees in cents wrt the tonic, probabilities)
+        tonic (float): tonic frequency in Hz
+        num_frames (int, optional): number of frames. Defaults to NUM_FRAMES
+        seed (int, optional): random seed. Defaults to 0
+
+    Returns:
+        numpy.array -- (num_frames, 3) time, pitch in Hz and salience; the
+        pitch of the unvoiced frames is 0
+    """
+    rnd = np.random.RandomState(seed)
+    degrees, probs = scale
+    # notes of a few frames each
+    num_notes = num_frames // 10 + 1
+    notes = rnd.choice(degrees, num_notes, p=probs) + 1200 * rnd.choice(
+        [-1, 0, 1], num_notes, p=[0.15, 0.6, 0.25])
+    cents = np.repeat(notes, 10)[:num_frames] + rnd.normal(0, 8, num_frames)
+
+    hz = tonic * 2 ** (cents / 1200)
+    salience = rnd.uniform(0.2, 1.0, num_frames)
+    unvoiced = rnd.rand(num_frames) < 0.1
+    hz[unvoiced] = 0
+    salience[unvoiced] = 0
+    return np.column_stack([np.arange(num_frames) * HOP_SIZE, hz, salience])
+
+
+def make_annotations(makams=MAKAMS, num_recordings=NUM_RECORDINGS, seed=0):
+    """Creates the annotations
+
+    Args:
+        makams (tuple, optional): the modes. Defaults to MAKAMS
+        num_recordings (int, optional): number of recordings per mode.
+            Defaults to NUM_RECORDINGS
+        seed (int, optional): random seed. Defaults to 0
+
+    Returns:
+        list -- {"mbid", "makam", "tonic"} of each recording
+    """
+    rnd = np.random.RandomState(seed)
+    annotations = []
+    for makam in makams:
+        for _ in range(num_recordings):
+            mbid = "{0:08x}-0000-4000-8000-{1:012x}".format(
+                rnd.randint(2 ** 31), rnd.randint(2 ** 47))
+            annotations.append({
+                "mbid": MBID_PREFIX + mbid, "makam": makam,
+                "tonic": round(float(rnd.uniform(100, 400)), 2)})
+    return annotations
+
+
+def stratified_folds(annotations, dataset_folder, n_folds=NUM_FOLDS,
+                     seed=0):
+    """Divides the recordings into stratified folds
+
+    Each fold tests 1 / n_folds of the recordings of each mode and is
+    trained on the rest.
+
+    Args:
+        annotations (list): the annotations
+        dataset_folder (str): the dataset folder
+        n_folds (int, optional): number of folds. Defaults to NUM_FOLDS
+        seed (int, optional): random seed. Defaults to 0
+
+    Returns:
+        list -- [fold_idx, {"training", "testing"}] of each fold, in the
+        format of the folds.json of the experiments
+    """
+    rnd = np.random.RandomState(seed)
+    fold_of = {}
+    for makam in sorted(set(anno["makam"] for anno in annotations)):
+        rows = [i for i, anno in enumerate(annotations)
+                if anno["makam"] == makam]
+        for rank, i in enumerate(rnd.permutation(rows)):
+            fold_of[i] = rank % n_folds
+
+    folds = []
+    for fold_idx in range(n_folds):
+        training = {"sources": [], "modes": [], "tonics": [], "pitches": []}
+        testing = []
+        for i, anno in enumerate(annotations):
+            mbid = pitch_store.get_mbid(anno)
+            pitch_file = pitch_store.get_pitch_file(anno, dataset_folder)
+            if fold_of[i] == fold_idx:
+                testing.append({"source": mbid, "mode": anno["makam"],
+                                "tonic": anno["tonic"], "pitch": pitch_file})
+            else:
+                training["sources"].append(mbid)
+                training["modes"].append(anno["makam"])
+                training["tonics"].append(anno["tonic"])
+                training["pitches"].append(pitch_file)
+        folds.append([fold_idx, {"training": training, "testing": testing}])
+    return folds
+
+
+def generate(dataset_folder, makams=MAKAMS, num_recordings=NUM_RECORDINGS,
+             num_frames=NUM_FRAMES, n_folds=NUM_FOLDS, seed=0,
+             folds_file=None):
+    """Writes a synthetic dataset
+
+    Args:
+        dataset_folder (str): folder to write the annotations and the pitch
+            tracks
+        makams (tuple, optional): the modes. Defaults to MAKAMS
+        num_recordings (int, optional): number of recordings per mode.
+            Defaults to NUM_RECORDINGS
+        num_frames (int, optional): number of frames per pitch track.
+            Defaults to NUM_FRAMES
+        n_folds (int, optional): number of folds. Defaults to NUM_FOLDS
+        seed (int, optional): random seed. Defaults to 0
+        folds_file (str, optional): path to save the folds. Defaults to
+            None, i.e. not saved
+
+    Returns:
+        tuple -- the annotations and the folds
+    """
+    annotations = make_annotations(makams, num_recordings, seed)
+    scales = dict(zip(makams, make_scales(len(makams), seed)))
+    for i, anno in enumerate(annotations):
+        pitch_file = pitch_store.get_pitch_file(anno, dataset_folder)
+        os.makedirs(os.path.dirname(pitch_file), exist_ok=True)
+        np.savetxt(pitch_file, make_pitch(
+            scales[anno["makam"]], anno["tonic"], num_frames, seed + i),
+            fmt="%.6f", delimiter="\t")
+    cache.atomic_dump_json(annotations, os.path.join(
+        dataset_folder, "annotations.json"), indent=4)
+
+    folds = stratified_folds(annotations, dataset_folder, n_folds, seed)
+    if folds_file is not None:
+        cache.atomic_dump_json(folds, folds_file, indent=4)
+    return annotations, folds
@@ -0,0 +1,161 @@
+"""Distances of all circular shifts of a PCD query to the model in one pass
+
+In tonic identification, the query PCD is shifted to each candidate peak
+and compared with the model. Instead, the distances of all the circular
+shifts of the query to all the model distributions are computed in a table
+once, and the candidates of the detected peaks are picked from it. The cost
+is thus independent of the number of peaks, i.e. of min_peak_ratio.
+
+For "bhat", "l2" and "dis_corr", the table is a circular cross-correlation
+computed by FFT in O(num_refs x num_bins x log(num_bins)). The other
+measures are computed on the matrix of all shifts of the query.
+
+The coarse-to-fine search scores the tonic (or [tonic, mode]) hypotheses of
+the candidate peaks on downsampled distributions first, e.g. with 50-cent
+bins, by the distance of their nearest coarse neighbor. Only the top
+hypotheses are compared at the full resolution, so the cost of the full
+resolution distances scales with the number of surviving hypotheses instead
+of the number of peaks times the model rows.
+"""
+import numpy as np
+
+from . import distance
+
+FFT_MEASURES = ("bhat", "l2", "dis_corr")
+COARSE_STEP = 50.0  # cents
+TOP_N = 5
+
+
+def all_shifts(query):
+    """Stacks all circular shifts of a distribution
+
+    Args:
+        query (numpy.ndarray): the distribution
+
+    Returns:
+        numpy.ndarray -- (num_bins, num_bins) matrix, whose row s is the
+        distribution shifted such that the bin s moves to the bin 0
+    """
+    num_bins = len(query)
+    idx = np.arange(num_bins)
+    return query[np.mod(idx[:, None] + idx[None, :], num_bins)]
+
+
+class CircularShiftTable:
+    """Computes the distances of all circular shifts of queries to refs
+
+    The transforms of the reference distributions are computed once and
+    reused for every query.
+
+    Examples:
+        >>> table = CircularShiftTable(model_pcds, "bhat")
+        >>> dists = table.distances(query)[peak_idx]  # (num_peaks, num_refs)
+    """
+
+    def __init__(self, refs, dis_measure):
+        if dis_measure not in distance.DISTANCE_MEASURES:
+            raise ValueError("Unknown dis_measure: {0:s}".format(dis_measure))
+        self.refs = np.atleast_2d(np.asarray(refs, dtype=float))
+        self.dis_measure = dis_measure
+        self.num_bins = self.refs.shape[1]
+
+        if dis_measure == "bhat":
+            self._spectra = self._conj_spectra(np.sqrt(self.refs))
+        elif dis_measure == "l2":
+            self._spectra = self._conj_spectra(self.refs)
+            self._sq_norms = (self.refs ** 2).sum(axis=-1)
+        elif dis_measure == "dis_corr":
+            centered = self.refs - self.refs.mean(axis=-1, keepdims=True)
+            self._spectra = self._conj_spectra(centered)
+            self._norms = np.sqrt((centered ** 2).sum(axis=-1))
+
+    @staticmethod
+    def _conj_spectra(vals):
+        return np.conj(np.fft.rfft(vals, axis=-1))
+
+    def _xcorr(self, vals, rows):
+        """c[s, i] = sum_j vals[(j + s) % num_bins] * refs[i, j]"""
+        spectra = self._spectra if rows is None else self._spectra[rows]
+        return np.fft.irfft(np.fft.rfft(vals)[None, :] * spectra,
+                            n=self.num_bins, axis=-1).T
+
+    def distances(self, query, rows=None):
+        """Computes the distances of all circular shifts of a query
+
+        Args:
+            query (numpy.ndarray): the query distribution
+            rows (numpy.ndarray, optional): mask or indices of the refs to
+                compare. Defaults to None, i.e. all refs
+
+        Returns:
+            numpy.ndarray -- (num_bins, num_refs) table, whose element
+            [s, i] is the distance of the query shifted by s bins to ref i
+        """
+        query = np.asarray(query, dtype=float)
+        if self.dis_measure == "bhat":
+            coeff = self._xcorr(np.sqrt(query), rows)
+            with np.errstate(divide="ignore"):
+                return -np.log(np.maximum(coeff, 0.0))
+        if self.dis_measure == "l2":
+            sq_norms = (self._sq_norms if rows is None
+                        else self._sq_norms[rows])
+            sq_dists = ((query ** 2).sum() + sq_norms[None, :] -
+                        2 * self._xcorr(query, rows))
+            return np.sqrt(np.maximum(sq_dists, 0.0))
+        if self.dis_measure == "dis_corr":
+            # the mean is invariant to circular shifts
+            centered = query - query.mean()
+            norms = self._norms if rows is None else self._norms[rows]
+            den = np.sqrt((centered ** 2).sum()) * norms[None, :]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                return 1.0 - self._xcorr(centered, rows) / den
+
+        refs = self.refs if rows is None else self.refs[rows]
+        return distance.pairwise(all_shifts(query), refs, self.dis_measure)
+
+
+def downsample(vals, factor):
+    """Sums each factor adjacent bins of distributions
+
+    Args:
+        vals (numpy.ndarray): (..., num_bins) distributions
+        factor (int): number of bins to sum; the last coarse bin sums the
+            remaining bins
+
+    Returns:
+        numpy.ndarray -- (..., ceil(num_bins / factor)) distributions
+    """
+    vals = np.asarray(vals, dtype=float)
+    return np.add.reduceat(vals, np.arange(0, vals.shape[-1], factor),
+                           axis=-1)
+
+
+def prune(coarse_dists, labels, num_labels, top_n=TOP_N):
+    """Selects the hypotheses with the nearest coarse neighbors
+
+    A hypothesis is a (peak, label) pair, e.g. a tonic candidate and a mode.
+    It is scored by the distance of the nearest row with its label to the
+    query shifted to its peak.
+
+    Args:
+        coarse_dists (numpy.ndarray): (num_peaks, num_rows) distances of the
+            shifted queries to the rows; inf for the rows left out
+        labels (numpy.ndarray): label index of each row
+        num_labels (int): number of labels
+        top_n (int, optional): number of hypotheses to keep. Defaults to
+            TOP_N
+
+    Returns:
+        tuple -- (num_peaks, num_labels) boolean mask of the kept
+        hypotheses, and the number of the hypotheses with a row to compare
+    """
+    scores = np.full((len(coarse_dists), num_labels), np.inf)
+    for label in range(num_labels):
+        cols = labels == label
+        if cols.any():
+            scores[:, label] = coarse_dists[:, cols].min(axis=1)
+
+    finite = np.isfinite(scores)
+    kept = np.zeros(scores.size, dtype=bool)
+    kept[np.argsort(scores, axis=None, kind="stable")[:top_n]] = True
+    return kept.reshape(scores.shape) & finite, int(finite.sum())
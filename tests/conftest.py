@@ -0,0 +1,53 @@
+import importlib
+import os
+import sys
+
+import numpy as np
+import pytest
+
+OLD_CODE = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "old_code")
+
+# scale degrees (in cents wrt tonic) and their weights of toy modes
+TOY_MODES = {
+    "Hicaz": ([0, 113, 384, 498, 702, 792, 1018], [5, 2, 3, 2, 4, 2, 1]),
+    "Rast": ([0, 204, 384, 498, 702, 906, 1086], [5, 2, 2, 3, 4, 1, 1]),
+    "Ussak": ([0, 180, 294, 498, 702, 792, 996], [5, 2, 3, 4, 3, 1, 1]),
+}
+
+
+def synthesize_pitch(mode, tonic, seed, num_frames=3000):
+    """toy pitch track in Hz with the scale degrees of a mode"""
+    rnd = np.random.RandomState(seed)
+    degrees, weights = TOY_MODES[mode]
+    weights = np.array(weights, dtype=float) / np.sum(weights)
+    cents = rnd.choice(degrees, num_frames, p=weights) + rnd.normal(
+        0, 10, num_frames)
+    cents += 1200 * rnd.choice([0, 1], num_frames, p=[0.7, 0.3])
+    hz = tonic * 2 ** (cents / 1200)
+    hz[rnd.rand(num_frames) < 0.05] = 0  # unvoiced
+    return hz
+
+
+@pytest.fixture
+def toy_recordings():
+    """(mbid, mode, tonic, pitch) tuples of toy recordings"""
+    recordings = []
+    for i in range(12):
+        mode = sorted(TOY_MODES)[i % len(TOY_MODES)]
+        tonic = 150.0 * 2 ** ((i * 37 % 500) / 1200.0)
+        recordings.append(("mbid-{0:d}".format(i), mode, tonic,
+                           synthesize_pitch(mode, tonic, i)))
+    return recordings
+
+
+@pytest.fixture
+def dlfm_code(tmp_path, monkeypatch):
+    """imports the modules of the legacy package, e.g. dlfm_code("sweep")"""
+    package_folder = tmp_path / "packages"
+    package_folder.mkdir()
+    os.symlink(OLD_CODE, str(package_folder / "dlfm_code"))
+    monkeypatch.syspath_prepend(str(package_folder))
+    for name in [n for n in sys.modules if n.split(".")[0] == "dlfm_code"]:
+        monkeypatch.delitem(sys.modules, name)
+    return lambda name: importlib.import_module("dlfm_code." + name)
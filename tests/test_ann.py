@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+
+from experimentation_code import ann, distance
+
+from .test_knn import _model
+
+
+def _distributions(num_rows, num_bins=48, seed=0):
+    rnd = np.random.RandomState(seed)
+    vals = rnd.gamma(0.5, size=(num_rows, num_bins))
+    return vals / vals.sum(axis=1, keepdims=True)
+
+
+def test_bhat_neighbors_are_euclidean_neighbors_of_square_roots():
+    vals = _distributions(200)
+    queries = _distributions(10, seed=1)
+    bhat = distance.pairwise(queries, vals, "bhat")
+    euclidean = distance.pairwise(np.sqrt(queries), np.sqrt(vals), "l2")
+    assert np.array_equal(np.argsort(bhat, axis=1)[:, :5],
+                          np.argsort(euclidean, axis=1)[:, :5])
+
+
+def test_recall_increases_with_nprobe():
+    vals = _distributions(400)
+    queries = _distributions(40, seed=1)
+    index = ann.IVFIndex.build(vals, "bhat", num_lists=20)
+    assert sorted(index.rows.tolist()) == list(range(400))
+
+    recalls, compared = zip(*[ann.recall(index, vals, queries, 5, nprobe)
+                              for nprobe in [1, 4, 20]])
+    assert recalls[0] <= recalls[1] <= recalls[2] == 1.0
+    assert compared[0] < compared[1] < compared[2] == 1.0
+
+
+def test_candidates_reach_the_minimum():
+    vals = _distributions(300)
+    index = ann.IVFIndex.build(vals, "l2", num_lists=30)
+    valid = np.zeros(300, dtype=bool)
+    valid[::25] = True
+    for rows in index.candidates(_distributions(5, seed=1), 1, valid, 6):
+        assert len(rows) >= 6
+        assert valid[rows].all()
+
+
+@pytest.mark.parametrize("dis_measure", ["bhat", "l1"])
+def test_probing_all_lists_is_exact(toy_recordings, dis_measure):
+    model = _model(toy_recordings)
+    view = model.masked(np.arange(len(model)) < 9)
+    index = ann.IVFIndex.build(model.vals, "bhat", num_lists=4)
+    approx = view.with_ann(index, nprobe=4)
+    pitches = [r[3] for r in toy_recordings]
+    excludes = [r[0] for r in toy_recordings]
+
+    assert approx.estimate_mode_batch(
+        pitches, [r[2] for r in toy_recordings], dis_measure, 3, 2,
+        excludes) == view.estimate_mode_batch(
+            pitches, [r[2] for r in toy_recordings], dis_measure, 3, 2,
+            excludes)
+    assert approx.estimate_tonic_batch(
+        pitches, [r[1] for r in toy_recordings], 0.1, dis_measure, 3, 2,
+        excludes) == view.estimate_tonic_batch(
+            pitches, [r[1] for r in toy_recordings], 0.1, dis_measure, 3, 2,
+            excludes)
+    assert approx.estimate_joint_batch(
+        pitches, 0.1, dis_measure, 3, 2, excludes) == \
+        view.estimate_joint_batch(pitches, 0.1, dis_measure, 3, 2, excludes)
+
+
+def test_single_probe_finds_the_neighbors(toy_recordings):
+    model = _model(toy_recordings)
+    approx = model.with_ann(ann.IVFIndex.build(model.vals, num_lists=4),
+                            nprobe=1)
+    for mbid, mode, tonic, pitch in toy_recordings:
+        estimates = approx.estimate_mode(pitch, tonic, k_neighbor=3,
+                                         exclude=mbid)
+        assert len(estimates) == 1
+
+    with pytest.raises(ValueError):
+        model.with_ann(ann.IVFIndex.build(model.vals[:5]))
+
+
+def test_save_load(tmp_path):
+    index = ann.IVFIndex.build(_distributions(100), "bhat")
+    path = str(tmp_path / "ann.idx")
+    index.save(path)
+    loaded = ann.IVFIndex.load(path)
+    assert loaded.dis_measure == "bhat"
+    for attr in ["centroids", "offsets", "rows"]:
+        assert np.array_equal(getattr(loaded, attr), getattr(index, attr))
+
+    with open(path, "r+b") as f:
+        f.write(b"NOTANIDX")
+    with pytest.raises(IOError):
+        ann.IVFIndex.load(path)
+    with pytest.raises(ValueError):
+        ann.IVFIndex(index.centroids, index.offsets, index.rows, "l1")
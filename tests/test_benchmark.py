@@ -0,0 +1,70 @@
+import time
+
+import numpy as np
+
+from experimentation_code import benchmark
+
+
+def _allocate(num_bytes):
+    return np.ones(num_bytes // 8).sum()
+
+
+def test_recorder():
+    recorder = benchmark.Recorder()
+    for run in range(3):
+        recorder.trace_memory = run == 2
+        assert recorder.run("sleep", time.sleep, 0.01) is None
+        recorder.run("allocate", _allocate, 8 << 20)
+    results = recorder.results({"seed": 0})
+
+    assert results["metadata"] == {"seed": 0}
+    assert list(results["benchmarks"]) == ["sleep", "allocate"]
+    sleep = results["benchmarks"]["sleep"]
+    assert len(sleep["wall_times"]) == 2
+    assert sleep["wall_time"] == min(sleep["wall_times"]) >= 0.01
+    assert results["benchmarks"]["allocate"]["peak_memory"] >= 8 << 20
+
+
+def _results(**benchmarks):
+    return {"metadata": {}, "benchmarks": {
+        name: {"wall_time": wall_time, "peak_memory": peak_memory}
+        for name, (wall_time, peak_memory) in benchmarks.items()}}
+
+
+def test_compare():
+    baseline = _results(train=(1.0, 100 << 20), test=(0.001, 1 << 20),
+                        removed=(1.0, 1 << 20))
+    results = _results(train=(1.5, 110 << 20), test=(0.004, 1 << 20),
+                       added=(1.0, 1 << 20))
+
+    # the test step is 4x slower, but within the noise
+    assert benchmark.compare(results, baseline) == [
+        benchmark.Regression("train", "wall_time", 1.0, 1.5)]
+    assert benchmark.compare(results, baseline, tolerance=0.05) == [
+        benchmark.Regression("train", "wall_time", 1.0, 1.5),
+        benchmark.Regression("train", "peak_memory", 100 << 20, 110 << 20)]
+    assert benchmark.compare(results, baseline, tolerance=1.0) == []
+
+
+def test_save_load(tmp_path):
+    results = _results(train=(1.0, None))
+    results["metadata"] = benchmark.metadata(seed=0)
+    path = str(tmp_path / "results.json")
+    benchmark.save(results, path)
+
+    assert benchmark.load(path) == results
+    assert "train" in benchmark.report(results, results)
+
+
+def test_measure_startup():
+    wall_time, max_rss, modules = benchmark.measure_startup(
+        "experimentation_code.knn")
+    assert wall_time > 0 and max_rss > 0
+    assert "numpy" in modules and "experimentation_code" in modules
+    assert not set(modules) & set(benchmark.HEAVY_MODULES)
+
+    recorder = benchmark.Recorder()
+    recorder.add("startup", wall_time, max_rss)
+    assert recorder.results()["benchmarks"]["startup"] == {
+        "wall_time": wall_time, "wall_times": [wall_time],
+        "peak_memory": max_rss}
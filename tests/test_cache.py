@@ -0,0 +1,113 @@
+import os
+
+import pytest
+
+from experimentation_code import cache
+
+
+def test_artifact_key():
+    key = cache.artifact_key("training", {"step_size": 7.5, "fold": 0},
+                             ["a", "b"])
+    assert key == cache.artifact_key(
+        "training", {"fold": 0, "step_size": 7.5}, ["a", "b"])
+    assert key != cache.artifact_key(
+        "training", {"fold": 0, "step_size": 7.5}, ["a", "c"])
+    assert key != cache.artifact_key(
+        "testing", {"fold": 0, "step_size": 7.5}, ["a", "b"])
+
+
+def test_put_and_get(tmp_path):
+    cache_folder = str(tmp_path / "cache")
+    result_cache = cache.ResultCache(cache_folder)
+    result_cache.put("k1", "training", {"fold": 0})
+    result_cache.put("k2", "evaluation", value={"accuracy": 0.9})
+
+    # the manifest is read by a new instance, e.g. in a resumed run
+    result_cache = cache.ResultCache(cache_folder)
+    assert "k1" in result_cache
+    assert "k3" not in result_cache
+    assert result_cache.get("k2") == {"accuracy": 0.9}
+    with pytest.raises(KeyError):
+        result_cache.get("k1")  # no stored value
+
+
+def test_interrupted_manifest_write(tmp_path):
+    cache_folder = str(tmp_path / "cache")
+    cache.ResultCache(cache_folder).put("k1", "training")
+    with open(os.path.join(cache_folder, cache.MANIFEST_FILE), "a") as f:
+        f.write('{"key": "k2", "ki')
+
+    assert len(cache.ResultCache(cache_folder)) == 1
+
+
+def test_hash_input(tmp_path):
+    input_file = str(tmp_path / "input.pitch")
+    with open(input_file, "w") as f:
+        f.write("1 2 3\n")
+
+    result_cache = cache.ResultCache(str(tmp_path / "cache"))
+    file_hash = result_cache.hash_input(input_file)
+    assert file_hash == cache.hash_file(input_file)
+    assert cache.ResultCache(str(tmp_path / "cache")).input_hashes[
+        os.path.abspath(input_file)]["hash"] == file_hash
+
+    with open(input_file, "w") as f:
+        f.write("1 2 4 5\n")
+    assert result_cache.hash_input(input_file) != file_hash
+
+
+def test_compact(tmp_path):
+    cache_folder = str(tmp_path / "cache")
+    result_cache = cache.ResultCache(cache_folder)
+    for _ in range(3):
+        result_cache.put("k1", "training")
+    result_cache.compact()
+
+    with open(os.path.join(cache_folder, cache.MANIFEST_FILE)) as f:
+        assert len(f.readlines()) == 1
+    assert "k1" in cache.ResultCache(cache_folder)
+
+
+def test_atomic_dump_json(tmp_path):
+    path = str(tmp_path / "results.json")
+    cache.atomic_dump_json({"a": 1}, path)
+    assert os.listdir(str(tmp_path)) == ["results.json"]
+
+
+def test_record(tmp_path):
+    cache_folder = str(tmp_path / "cache")
+    result_cache = cache.ResultCache(cache_folder)
+    cache.record(cache_folder, "k1", "features")
+
+    assert "k1" not in result_cache  # read once
+    assert "k1" in cache.ResultCache(cache_folder)
+
+
+def test_superseded_keys_are_invalid(tmp_path):
+    cache_folder = str(tmp_path / "cache")
+    cache.ResultCache(cache_folder)
+    params = {"mbid": "m1", "step_size": 7.5}
+    cache.record(cache_folder, "k1", "features", params)
+    cache.record(cache_folder, "k2", "features", params)
+    cache.record(cache_folder, "k3", "features", dict(params, mbid="m2"))
+    cache.record(cache_folder, "k4", "features")  # no slot
+
+    result_cache = cache.ResultCache(cache_folder)
+    assert "k1" not in result_cache
+    assert "k2" in result_cache and "k3" in result_cache
+    assert "k4" in result_cache
+
+    # an interrupted task leaves its slot invalid
+    cache.invalidate(cache_folder, "features", params)
+    cache.record(cache_folder, "k1", "features", dict(params, mbid="m2"))
+    result_cache = cache.ResultCache(cache_folder)
+    assert "k2" not in result_cache and "k3" not in result_cache
+    assert len(result_cache) == 2
+
+    result_cache.compact()
+    with open(os.path.join(cache_folder, cache.MANIFEST_FILE)) as f:
+        assert len(f.readlines()) == 3
+    result_cache = cache.ResultCache(cache_folder)
+    assert len(result_cache) == 2 and "k2" not in result_cache
+    cache.record(cache_folder, "k2", "features", params)
+    assert "k2" in cache.ResultCache(cache_folder)
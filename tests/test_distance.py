@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from experimentation_code import distance
+
+
+@pytest.fixture
+def pdfs():
+    vals = np.random.RandomState(0).rand(7, 24)
+    return vals / vals.sum(axis=1, keepdims=True)
+
+
+@pytest.mark.parametrize("dis_measure", distance.DISTANCE_MEASURES)
+def test_identical_distributions(pdfs, dis_measure):
+    dists = distance.pairwise(pdfs, pdfs, dis_measure)
+
+    assert dists.shape == (7, 7)
+    np.testing.assert_allclose(np.diag(dists), 0, atol=1e-12)
+    assert np.all(np.argmin(dists, axis=1) == np.arange(7))
+
+
+@pytest.mark.parametrize("dis_measure", distance.DISTANCE_MEASURES)
+def test_batch_equals_single_queries(pdfs, dis_measure, monkeypatch):
+    monkeypatch.setattr(distance, "MAX_ELEMENTS", 100)  # force chunks
+    batch = distance.pairwise(pdfs, pdfs[::-1], dis_measure)
+    for query, expected in zip(pdfs, batch):
+        single = distance.pairwise(query, pdfs[::-1], dis_measure)[0]
+        assert np.array_equal(single, expected)
+
+
+def test_known_values():
+    p = np.array([0.5, 0.5, 0.0])
+    q = np.array([0.0, 0.5, 0.5])
+
+    assert distance.pairwise(p, q, "l1")[0, 0] == pytest.approx(1.0)
+    assert distance.pairwise(p, q, "l2")[0, 0] == pytest.approx(np.sqrt(0.5))
+    assert distance.pairwise(p, q, "bhat")[0, 0] == pytest.approx(np.log(2))
+    assert distance.pairwise(p, q, "dis_intersect")[0, 0] == \
+        pytest.approx(0.5)
+    with pytest.raises(ValueError):
+        distance.pairwise(p, q, "cosine")
@@ -0,0 +1,119 @@
+import numpy as np
+import pytest
+
+from experimentation_code import distribution
+from .test_knn import _model
+
+STEP_SIZES = [7.5, 15.0, 25.0, 50.0, 100.0]
+KERNEL_WIDTHS = [0, 7.5, 15.0, 25.0, 50.0, 100.0]
+
+
+def _reference(hz_track, ref_freq, step_size, kernel_width,
+               distribution_type):
+    """straightforward, per-combination computation for comparison"""
+    cents = distribution.hz_to_cent(hz_track, ref_freq)
+    if distribution_type == "pcd":
+        cents = np.mod(cents + step_size / 2, 1200) - step_size / 2
+        lo, hi = 0, 1200
+    else:
+        lo, hi = distribution.PD_RANGE
+    edges = np.arange(lo - step_size / 2, hi, step_size)
+    vals = np.histogram(cents, edges)[0].astype(float)
+
+    if kernel_width > 0:
+        half_len = int(np.ceil(3 * kernel_width / step_size))
+        offsets = step_size * np.arange(-half_len, half_len + 1)
+        kernel = np.exp(-0.5 * (offsets / kernel_width) ** 2)
+        kernel /= kernel.sum()
+        if distribution_type == "pcd":
+            vals = np.convolve(np.tile(vals, 3), kernel, mode="same")[
+                len(vals):2 * len(vals)]
+        else:
+            vals = np.convolve(vals, kernel, mode="same")
+    return vals
+
+
+@pytest.fixture
+def hz_track():
+    rnd = np.random.RandomState(1916)
+    hz = 220.0 * 2 ** (rnd.normal(0.3, 0.6, 20000))
+    hz[rnd.rand(len(hz)) < 0.1] = 0  # unvoiced frames
+    return hz
+
+
+def test_param_grid():
+    grid = distribution.get_param_grid(STEP_SIZES, KERNEL_WIDTHS)
+
+    assert ("pcd", 7.5, 0) in grid
+    assert ("pd", 100.0, 25.0) not in grid  # kernel too narrow
+    assert len(grid) == len(set(grid))
+
+
+def test_grid_matches_single_combinations(hz_track):
+    grid = distribution.get_param_grid(STEP_SIZES, KERNEL_WIDTHS)
+    distributions = distribution.compute_distributions(
+        hz_track, 220.0, grid)
+
+    assert sorted(distributions.keys()) == sorted(grid)
+    for (dt, ss, kw), dist in distributions.items():
+        expected = _reference(hz_track, 220.0, ss, kw, dt)
+        np.testing.assert_allclose(dist.vals, expected, atol=1e-9)
+        np.testing.assert_array_equal(
+            dist.bins, distribution.get_bins(ss, dt))
+
+
+def test_single_distribution(hz_track):
+    dist = distribution.compute_distribution(hz_track, 220.0, 25, 0, "pcd")
+
+    assert dist.vals.sum() == np.sum(hz_track > distribution.MIN_FREQ)
+    assert len(dist.bins) == 48
+    assert distribution.normalize(dist.vals).sum() == pytest.approx(1.0)
+
+
+@pytest.mark.parametrize("distribution_type", ["pd", "pcd"])
+def test_dict_round_trip(hz_track, distribution_type):
+    dist = distribution.compute_distribution(hz_track, 220.0, 25.0, 15.0,
+                                             distribution_type)
+    pdict = distribution.to_dict(dist)
+    assert sorted(pdict) == ["bins", "kernel_width", "ref_freq", "step_size",
+                             "vals"]
+
+    loaded = distribution.from_dict(pdict)
+    np.testing.assert_array_equal(loaded.bins, dist.bins)
+    np.testing.assert_array_equal(loaded.vals, dist.vals)
+    assert loaded[2:] == (distribution_type, 25.0, 15.0)
+
+
+def test_accumulator_matches_whole_track(hz_track, tmp_path):
+    grid = [("pd", 25.0, 15.0), ("pcd", 7.5, 7.5), ("pcd", 25.0, 0)]
+    expected = distribution.compute_distributions(hz_track, 220.0, grid)
+
+    pitch_file = str(tmp_path / "recording.pitch")
+    np.savetxt(pitch_file, np.column_stack(
+        [np.arange(len(hz_track)), hz_track]))
+    for source in [hz_track, pitch_file]:
+        accumulator = distribution.DistributionAccumulator(220.0, grid)
+        for chunk in distribution.iter_pitch_chunks(source, 3000):
+            accumulator.update(chunk)
+
+        assert accumulator.num_frames == np.sum(
+            hz_track > distribution.MIN_FREQ)
+        for key, dist in accumulator.distributions().items():
+            np.testing.assert_allclose(dist.vals, expected[key].vals,
+                                       atol=1e-9)
+
+
+def test_accumulator_estimates(toy_recordings):
+    model = _model(toy_recordings)
+    mbid, mode, tonic, pitch = toy_recordings[0]
+    accumulator = distribution.DistributionAccumulator(
+        tonic, [("pcd", model.step_size, model.kernel_width)])
+    for chunk in distribution.iter_pitch_chunks(pitch, 500):
+        accumulator.update(chunk)
+
+    assert accumulator.estimate_mode(model, excludes=[mbid]) == \
+        model.estimate_mode(pitch, tonic, exclude=mbid)
+    assert accumulator.estimate_joint(model, excludes=[mbid])[0][0][1] == \
+        mode
+    with pytest.raises(ValueError):
+        accumulator.query(_model(toy_recordings, "pd"))
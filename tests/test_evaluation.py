@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+from experimentation_code import distribution, evaluation
+
+
+@pytest.fixture
+def index():
+    annotations = [
+        {"mbid": "http://musicbrainz.org/recording/m{0:d}".format(i),
+         "makam": makam, "tonic": 200.0 + i}
+        for i, makam in enumerate(["Rast", "Hicaz", "Rast", "Ussak"])]
+    return evaluation.AnnotationIndex(annotations)
+
+
+def test_cent_deviation():
+    deviations = evaluation.cent_deviation(
+        np.array([200.0, 400.0, 100 * 2 ** (-10 / 1200), 2 ** 0.5 * 100]),
+        100.0)
+    np.testing.assert_allclose(deviations, [0, 0, -10, -600], atol=1e-9)
+
+
+def test_deviation_histogram():
+    deviations = np.array([[0, -10, 590, 610, np.nan],
+                           [25, 25, 1190, -590, 300]])
+    hist = evaluation.deviation_histogram(deviations, 25)
+
+    assert hist.shape == (2, 48)
+    assert hist[0].sum() == 4
+    assert hist[0, 0] == 2 and hist[0, 24] == 2
+    assert hist[1].tolist() == np.bincount([1, 1, 0, 24, 12],
+                                           minlength=48).tolist()
+
+
+def test_evaluate_joint(index):
+    mbids = ["m0", "m1", "m2", "m3"]
+    fold_idx = [0, 0, 1, 1]
+    tonics = np.array([[400.0, 201.0, 300.0, np.nan],
+                       [200.0, 201.0, 202.0, 203.0]])
+    modes = np.array([["Rast", "Rast", "Rast", None],
+                      ["Rast", "Hicaz", "Rast", "Ussak"]], dtype=object)
+
+    ev = evaluation.evaluate(index, "joint", mbids, fold_idx, tonics, modes)
+
+    assert ev.num_samples.tolist() == [2, 2]
+    assert ev.tonic_correct.tolist() == [[2, 0], [2, 2]]
+    assert ev.mode_correct.tolist() == [[1, 1], [2, 2]]
+    assert ev.joint_correct.tolist() == [[1, 0], [2, 2]]
+    assert ev.confusion.shape == (2, 2, 3, 3)
+    assert ev.confusion[0].sum() == 3  # the missing mode is left out
+    labels = index.mode_labels.tolist()
+    assert ev.confusion[0, 0, labels.index("Hicaz"),
+                        labels.index("Rast")] == 1
+
+    overall = evaluation.summarize_overall(["a", "b"], ev)
+    assert overall[0] == {"param": "b", "accuracy": 1.0,
+                          "tonic_accuracy": 1.0, "mode_accuracy": 1.0}
+    assert overall[1]["accuracy"] == pytest.approx(0.25)
+
+    perfold = evaluation.summarize_perfold(
+        [{"training": t, "distribution": "pcd", "distance": "bhat",
+          "bin_size": 7.5, "kernel_width": 0, "k_neighbors": 1}
+         for t in ["single", "multi"]], ev)
+    assert perfold["accuracy"] == [[0.5], [0.0], [1.0], [1.0]]
+    assert perfold["training"] == [["single", "single", "multi", "multi"]]
+
+
+def test_evaluate_unknown_mbid(index):
+    with pytest.raises(KeyError):
+        evaluation.evaluate(index, "tonic", ["m9"], [0], [[100.0]])
+    with pytest.raises(ValueError):
+        evaluation.evaluate(index, "pitch", ["m0"], [0])
+
+
+@pytest.mark.parametrize("distribution_type", ["pd", "pcd"])
+def test_min_peak_ratio_curve(distribution_type):
+    bins = distribution.get_bins(25.0, distribution_type)
+    vals = np.random.RandomState(0).rand(30, len(bins)) ** 4
+    ratios = np.linspace(0, 1, 21)
+    circular = distribution_type == "pcd"
+    is_tonic = np.abs((bins + 600) % 1200 - 600) <= 20
+
+    num_tonic_in_peaks, num_peaks = evaluation.min_peak_ratio_curve(
+        vals, bins, ratios, circular)
+
+    for ratio, num_tonic, num in zip(ratios, num_tonic_in_peaks, num_peaks):
+        peaks = [distribution.detect_peaks(v, ratio, circular) for v in vals]
+        assert num == sum(len(p) for p in peaks)
+        assert num_tonic == sum(any(is_tonic[p]) for p in peaks)
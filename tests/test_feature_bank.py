@@ -0,0 +1,135 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from experimentation_code import feature_bank, knn
+
+BINS = np.arange(0, 1200, 100.0)
+
+
+def _writer(bank_folder):
+    return feature_bank.FeatureBankWriter(bank_folder, BINS, "pcd", 100.0, 0)
+
+
+def test_append_and_read(tmp_path):
+    writer = _writer(str(tmp_path))
+    hists = np.random.RandomState(0).rand(3, len(BINS))
+    for i, hist in enumerate(hists):
+        writer.append("mbid-{0:d}".format(i), "Hicaz", 220.0 + i, hist)
+
+    bank = feature_bank.FeatureBank(str(tmp_path))
+    assert len(bank) == 3
+    assert "mbid-1" in bank and "mbid-1" in writer
+    np.testing.assert_array_equal(bank.hist, hists)
+    np.testing.assert_allclose(bank.pdf.sum(axis=1), 1.0)
+    np.testing.assert_array_equal(bank.tonics, [220.0, 221.0, 222.0])
+
+    rows = bank.rows(["mbid-2", "mbid-0"])
+    np.testing.assert_array_equal(bank.hist[rows], hists[[2, 0]])
+    np.testing.assert_array_equal(bank.mask(["mbid-2", "mbid-0"]),
+                                  [True, False, True])
+    with pytest.raises(KeyError):
+        bank.rows(["mbid-3"])
+
+
+def test_contains_does_not_read_records(tmp_path, monkeypatch):
+    _writer(str(tmp_path)).append("mbid-0", "Rast", 220.0, np.ones(len(BINS)))
+    writer = _writer(str(tmp_path))
+
+    def _fail(bank_folder):
+        raise AssertionError("records read again")
+
+    monkeypatch.setattr(feature_bank, "_read_records", _fail)
+    assert "mbid-0" in writer and "mbid-1" not in writer
+
+
+def test_load_reopens_grown_bank(tmp_path):
+    writer = _writer(str(tmp_path))
+    writer.append("mbid-0", "Rast", 220.0, np.ones(len(BINS)))
+
+    bank = feature_bank.load(str(tmp_path))
+    assert feature_bank.load(str(tmp_path)) is bank
+
+    writer.append("mbid-1", "Rast", 220.0, np.ones(len(BINS)))
+    assert "mbid-1" in feature_bank.load(str(tmp_path))
+
+
+def test_interrupted_append_is_ignored(tmp_path):
+    writer = _writer(str(tmp_path))
+    writer.append("mbid-0", "Rast", 220.0, np.ones(len(BINS)))
+
+    # simulate a crash after writing the data but before the record
+    with open(os.path.join(str(tmp_path), "hist.f8"), "ab") as f:
+        f.write(b"\x00" * 13)
+    with open(os.path.join(str(tmp_path), "records.jsonl"), "a") as f:
+        f.write('{"mbid": "mbid-')
+    assert len(feature_bank.FeatureBank(str(tmp_path))) == 1
+
+    writer.append("mbid-1", "Rast", 220.0, 2 * np.ones(len(BINS)))
+    bank = feature_bank.FeatureBank(str(tmp_path))
+    np.testing.assert_array_equal(bank.mbids, ["mbid-0", "mbid-1"])
+    np.testing.assert_array_equal(bank.hist[1], 2 * np.ones(len(BINS)))
+
+
+def test_appended_again_rewrites_row(tmp_path):
+    writer = _writer(str(tmp_path))
+    writer.append("mbid-0", "Rast", 220.0, np.ones(len(BINS)))
+    writer.append("mbid-1", "Rast", 220.0, np.ones(len(BINS)))
+    bank = feature_bank.load(str(tmp_path))
+    writer.append("mbid-0", "Hicaz", 230.0, 3 * np.ones(len(BINS)))
+
+    reopened = feature_bank.load(str(tmp_path))
+    assert reopened is not bank
+    for bank in [reopened, feature_bank.FeatureBank(str(tmp_path))]:
+        assert isinstance(bank.hist, np.memmap)
+        np.testing.assert_array_equal(bank.mbids, ["mbid-0", "mbid-1"])
+        np.testing.assert_array_equal(bank.modes, ["Hicaz", "Rast"])
+        np.testing.assert_array_equal(bank.tonics, [230.0, 220.0])
+        np.testing.assert_array_equal(bank.hist[0], 3 * np.ones(len(BINS)))
+    assert os.path.getsize(os.path.join(str(tmp_path), "hist.f8")) == \
+        2 * len(BINS) * 8
+
+
+def test_duplicate_rows_use_last_row(tmp_path):
+    # a bank, which an older writer appended a recording twice to
+    writer = _writer(str(tmp_path))
+    for i, mbid in enumerate(["mbid-0", "mbid-1", "mbid-0"]):
+        hist = (i + 1) * np.ones(len(BINS))
+        for filename, vals in [("hist.f8", hist), ("pdf.f8", hist / 12)]:
+            with open(os.path.join(str(tmp_path), filename), "ab") as f:
+                f.write(vals.tobytes())
+        with open(os.path.join(str(tmp_path), "records.jsonl"), "a") as f:
+            f.write(json.dumps({"mbid": mbid, "mode": "Rast",
+                                "tonic": 220.0 + i}) + "\n")
+
+    bank = feature_bank.FeatureBank(str(tmp_path))
+    np.testing.assert_array_equal(bank.mbids, ["mbid-1", "mbid-0"])
+    np.testing.assert_array_equal(bank.tonics, [221.0, 222.0])
+    np.testing.assert_array_equal(bank.hist[1], 3 * np.ones(len(BINS)))
+
+    # the last row is rewritten
+    writer.append("mbid-0", "Rast", 240.0, 5 * np.ones(len(BINS)))
+    bank = feature_bank.FeatureBank(str(tmp_path))
+    np.testing.assert_array_equal(bank.tonics, [221.0, 240.0])
+    np.testing.assert_array_equal(bank.hist[1], 5 * np.ones(len(BINS)))
+
+
+def test_configuration_mismatch(tmp_path):
+    _writer(str(tmp_path))
+    with pytest.raises(ValueError):
+        feature_bank.FeatureBankWriter(str(tmp_path), BINS, "pcd", 100.0, 25)
+
+
+def test_model_attaches_bank_without_copy(tmp_path):
+    writer = _writer(str(tmp_path))
+    for i in range(3):
+        writer.append("mbid-{0:d}".format(i), "Rast", 220.0,
+                      np.arange(len(BINS)) + i)
+    bank = feature_bank.FeatureBank(str(tmp_path))
+
+    model = knn.KNNModel.from_bank(bank)
+    assert np.shares_memory(model.vals, bank.pdf)
+    assert not np.shares_memory(
+        knn.KNNModel.from_bank(bank, [0, 2]).vals, bank.pdf)
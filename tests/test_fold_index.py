@@ -0,0 +1,99 @@
+import collections
+import os
+
+import numpy as np
+import pytest
+
+from experimentation_code import fold_index, synthetic
+
+
+@pytest.fixture
+def recordings():
+    annotations = synthetic.make_annotations(synthetic.MAKAMS[:4], 12)
+    return fold_index.recording_table(annotations, "dataset")
+
+
+def test_stratified_k_fold():
+    modes = np.array(["a"] * 7 + ["b"] * 5)
+    folds = fold_index.stratified_k_fold(modes, 3, seed=0)
+
+    tested = np.concatenate([testing for _, testing in folds])
+    assert sorted(tested) == list(range(12))
+    # 7 + 5 recordings are dealt to the folds in turn
+    assert [len(testing) for _, testing in folds] == [4, 4, 4]
+    for training, testing in folds:
+        assert not set(training).intersection(testing)
+        assert len(training) + len(testing) == 12
+        for mode in "ab":
+            assert abs(np.sum(modes[testing] == mode) -
+                       np.sum(modes == mode) / 3.0) < 1
+
+
+@pytest.mark.parametrize("num_workers", [0, 2])
+def test_generate(recordings, num_workers):
+    folds = fold_index.generate(recordings, n_folds=4, seeds=[1, 2],
+                                nested_folds=3, num_workers=num_workers)
+
+    outer = [f for f in folds if f.outer is None]
+    assert [f.index for f in outer] == list(range(8))
+    assert [(f.repeat, f.seed, f.fold) for f in outer[3:5]] == [
+        (0, 1, 3), (1, 2, 0)]
+    assert len(folds) == 8 + 8 * 3
+    for f in folds[8:]:
+        parent = folds[f.outer]
+        assert parent.outer is None and parent.repeat == f.repeat
+        assert set(f.training).union(f.testing) == set(parent.training)
+    # the repetitions differ
+    assert not np.array_equal(outer[0].testing, outer[4].testing)
+    # reproducible
+    for a, b in zip(folds, fold_index.generate(
+            recordings, n_folds=4, seeds=[1, 2], nested_folds=3)):
+        np.testing.assert_array_equal(a.testing, b.testing)
+
+
+def test_save_load(recordings, tmp_path):
+    folds = fold_index.generate(recordings, n_folds=4, seeds=[1],
+                                nested_folds=2)
+    path = str(tmp_path / fold_index.INDEX_FILE)
+    fold_index.save(recordings, folds, path)
+    index = fold_index.FoldIndex(path)
+
+    assert len(index) == len(folds)
+    assert index.fold_indices() == [0, 1, 2, 3]
+    assert index.fold_indices(outer=2) == [
+        f.index for f in folds if f.outer == 2]
+    for fold in folds:
+        loaded = index[fold.index]
+        assert isinstance(loaded.testing, np.memmap)
+        assert loaded[:5] == fold[:5]
+        np.testing.assert_array_equal(loaded.training, fold.training)
+        np.testing.assert_array_equal(loaded.testing, fold.testing)
+
+    legacy = index.to_legacy(1)
+    assert legacy["testing"][0] == {
+        "source": recordings["mbids"][folds[1].testing[0]],
+        "mode": recordings["modes"][folds[1].testing[0]],
+        "tonic": recordings["tonics"][folds[1].testing[0]],
+        "pitch": recordings["pitches"][folds[1].testing[0]]}
+    assert collections.Counter(legacy["training"]["modes"]) == \
+        collections.Counter(np.array(recordings["modes"])[
+            folds[1].training].tolist())
+    # smaller than the JSON folds, even with a few recordings
+    assert os.path.getsize(path) < len(str(index.legacy_folds())) / 2
+
+
+def test_legacy_round_trip(tmp_path):
+    annotations = synthetic.make_annotations(synthetic.MAKAMS[:3], 10)
+    folds = synthetic.stratified_folds(annotations, "dataset", n_folds=5)
+    recordings, index_folds = fold_index.from_legacy(folds)
+    path = str(tmp_path / fold_index.INDEX_FILE)
+    fold_index.save(recordings, index_folds, path)
+
+    assert fold_index.FoldIndex(path).legacy_folds() == folds
+
+
+def test_not_an_index(tmp_path):
+    path = tmp_path / "folds.json"
+    path.write_text("[]")
+    with pytest.raises(IOError):
+        fold_index.FoldIndex(str(path))
@@ -0,0 +1,170 @@
+import asyncio
+import json
+import os
+
+import numpy as np
+
+from experimentation_code import cache, distribution, feature_bank, \
+    ingest, pitch_store, single_model
+
+from .conftest import synthesize_pitch
+
+PARAMS = [("pcd", 25.0, 15.0), ("pd", 50.0, 25.0)]
+
+
+def _write_pitch(path, hz):
+    time = np.arange(len(hz)) * 0.0029
+    np.savetxt(path, np.column_stack([time, hz, np.ones_like(hz)]))
+
+
+def _recording(folder, i, mode, tonic=220.0, seed=None):
+    mbid = "mbid-{0:d}".format(i)
+    anno = {"mbid": "http://musicbrainz.org/recording/" + mbid,
+            "makam": mode, "tonic": tonic}
+    pitch_file = os.path.join(folder, mbid + ".pitch")
+    _write_pitch(pitch_file, synthesize_pitch(
+        mode, tonic, i if seed is None else seed, num_frames=500))
+    return anno, pitch_file
+
+
+def _ingestor(tmp_path, model_files=None, cache_folder=None):
+    return ingest.Ingestor(
+        str(tmp_path / "dataset"), str(tmp_path / "store"),
+        {params: str(tmp_path / "-".join(map(str, params)))
+         for params in PARAMS}, model_files, num_workers=0,
+        cache_folder=cache_folder)
+
+
+def test_compute_histograms():
+    pitch = synthesize_pitch("Rast", 220.0, 0)
+    histograms = ingest.compute_histograms(pitch, 220.0, PARAMS)
+    distributions = distribution.compute_distributions(pitch, 220.0, PARAMS)
+    for params in PARAMS:
+        np.testing.assert_allclose(histograms[params],
+                                   distributions[params].vals)
+
+
+def test_ingest_and_skip(tmp_path):
+    os.makedirs(str(tmp_path / "new"))
+    items = [_recording(str(tmp_path / "new"), i, mode)
+             for i, mode in enumerate(["Hicaz", "Rast", "Ussak"])]
+    items.append(({"mbid": "mbid-9", "makam": "Rast", "tonic": 220.0},
+                  str(tmp_path / "new" / "missing.pitch")))
+
+    with _ingestor(tmp_path) as ingestor:
+        summary = asyncio.run(ingestor.ingest(items))
+        assert summary["ingested"] == ["mbid-0", "mbid-1", "mbid-2"]
+        assert list(summary["failed"]) == ["mbid-9"]
+        assert summary["distributions"] == 6
+
+        store = pitch_store.PitchStore(str(tmp_path / "store"))
+        bank = feature_bank.FeatureBank(str(tmp_path / "pcd-25.0-15.0"))
+        for anno, pitch_file in items[:3]:
+            mbid = pitch_store.get_mbid(anno)
+            assert os.path.exists(pitch_store.get_pitch_file(
+                anno, str(tmp_path / "dataset")))
+            np.testing.assert_allclose(
+                store[mbid], pitch_store.read_pitch_file(pitch_file))
+            assert bank.modes[bank.index[mbid]] == anno["makam"]
+        with open(str(tmp_path / "dataset" / "annotations.json")) as f:
+            assert [a["makam"] for a in json.load(f)] == [
+                "Hicaz", "Rast", "Ussak"]
+
+        # unchanged recordings are skipped; a corrected tonic is computed
+        # again
+        items[1][0]["tonic"] = 230.0
+        summary = asyncio.run(ingestor.ingest(items[:3]))
+        assert summary["skipped"] == ["mbid-0", "mbid-2"]
+        assert summary["ingested"] == ["mbid-1"]
+        assert summary["distributions"] == 2
+
+
+def test_ingest_updates_single_models(tmp_path):
+    os.makedirs(str(tmp_path / "new"))
+    modes = ["Hicaz", "Rast", "Ussak"] * 2
+    items = [_recording(str(tmp_path / "new"), i, mode)
+             for i, mode in enumerate(modes)]
+    model_file = str(tmp_path / "training" / "all.model")
+    with _ingestor(tmp_path, {PARAMS[0]: model_file}) as ingestor:
+        summary = asyncio.run(ingestor.ingest(items))
+    assert (summary["models_updated"], summary["modes_updated"]) == (1, 3)
+    before = np.array(single_model.load(model_file).vals)
+
+    # a new Rast recording and another pitch track of a Hicaz recording
+    new_items = [_recording(str(tmp_path / "new"), 6, "Rast"),
+                 _recording(str(tmp_path / "new"), 0, "Hicaz", seed=10)]
+    with _ingestor(tmp_path, {PARAMS[0]: model_file}) as ingestor:
+        summary = asyncio.run(ingestor.ingest(new_items))
+    assert summary["models_updated"] == 1
+    assert summary["modes_updated"] == 2
+
+    model = single_model.load(model_file)
+    bank = feature_bank.load(str(tmp_path / "pcd-25.0-15.0"))
+    assert model.sources == [["mbid-0", "mbid-3"],
+                             ["mbid-1", "mbid-4", "mbid-6"],
+                             ["mbid-2", "mbid-5"]]
+    for sources, vals in zip(model.sources, model.vals):
+        hist = bank.hist[bank.rows(sources)].sum(axis=0)
+        np.testing.assert_allclose(vals, hist / hist.sum())
+    np.testing.assert_array_equal(model.vals[2], before[2])
+
+
+def test_ingest_invalidates_cached_features(tmp_path):
+    os.makedirs(str(tmp_path / "new"))
+    cache_folder = str(tmp_path / "cache")
+    cache.ResultCache(cache_folder)
+    params = [{"distribution_type": dt, "step_size": ss,
+               "kernel_width": kw, "mbid": mbid}
+              for mbid in ["mbid-0", "mbid-1"] for dt, ss, kw in PARAMS]
+    for i, param in enumerate(params):
+        cache.record(cache_folder, "key-{0:d}".format(i), "features", param)
+
+    with _ingestor(tmp_path, cache_folder=cache_folder) as ingestor:
+        asyncio.run(ingestor.ingest(
+            [_recording(str(tmp_path / "new"), 0, "Hicaz")]))
+    result_cache = cache.ResultCache(cache_folder)
+    assert [key for key in ["key-0", "key-1", "key-2", "key-3"]
+            if key in result_cache] == ["key-2", "key-3"]
+
+
+def test_watch(tmp_path):
+    inbox = str(tmp_path / "inbox")
+    os.makedirs(inbox)
+    for i, mode in enumerate(["Hicaz", "Rast"]):
+        anno, _ = _recording(inbox, i, mode)
+        with open(os.path.join(inbox, "mbid-{0:d}.json".format(i)),
+                  "w") as f:
+            json.dump(anno, f)
+    _recording(inbox, 2, "Ussak")  # not ready without its annotation
+    with open(os.path.join(inbox, "broken.json"), "w") as f:
+        f.write("{")
+    _write_pitch(os.path.join(inbox, "broken.pitch"), np.ones(10))
+
+    async def _run(ingestor):
+        return [summary async for summary in ingest.watch(
+            ingestor, inbox, once=True)]
+
+    with _ingestor(tmp_path) as ingestor:
+        summaries = asyncio.run(_run(ingestor))
+    assert [s["ingested"] for s in summaries] == [["mbid-0", "mbid-1"]]
+    assert sorted(os.listdir(inbox)) == ["failed", "mbid-2.pitch"]
+    assert sorted(os.listdir(os.path.join(inbox, "failed"))) == [
+        "broken.error", "broken.json", "broken.pitch"]
+
+
+def test_consume(tmp_path):
+    os.makedirs(str(tmp_path / "new"))
+    items = [_recording(str(tmp_path / "new"), i, "Hicaz")
+             for i in range(5)]
+
+    async def _run(ingestor):
+        queue = asyncio.Queue()
+        for item in items:
+            queue.put_nowait(item)
+        queue.put_nowait(None)
+        return [summary async for summary in ingest.consume(
+            ingestor, queue, max_batch=2)]
+
+    with _ingestor(tmp_path) as ingestor:
+        summaries = asyncio.run(_run(ingestor))
+    assert [len(s["ingested"]) for s in summaries] == [2, 2, 1]
@@ -0,0 +1,99 @@
+import json
+import time
+
+import numpy as np
+import pytest
+
+from experimentation_code import instrument
+
+
+@pytest.fixture
+def events(tmp_path):
+    events_file = str(tmp_path / "events.jsonl")
+    instrument.configure(events_file, profile_interval=0.001)
+    yield events_file
+    instrument.disable()
+
+
+@instrument.staged("square", "x", double=lambda args: 2 * args["x"])
+def _square(x, fail=False):
+    instrument.add(items=x)
+    if fail:
+        raise ValueError(x)
+    return x * x
+
+
+def _busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        np.sqrt(np.arange(1000.0))
+
+
+def test_disabled():
+    listened = []
+    instrument.add_listener(listened.append)
+    try:
+        assert _square(3) == 9
+        with instrument.stage("noop"):
+            instrument.add(items=1)
+    finally:
+        instrument.remove_listener(listened.append)
+    assert listened == []
+
+
+def test_stage_events(events):
+    assert _square(3) == 9
+    with pytest.raises(ValueError):
+        _square(2, fail=True)
+    with instrument.stage("outer", fold=1):
+        instrument.add(files_read=1)
+        _busy(0.05)
+        _square(4)
+
+    square, failed, inner, outer = instrument.read_events(events)
+    assert (square["stage"], square["status"]) == ("square", "done")
+    assert square["config"] == {"x": 3, "double": 6}
+    assert square["counts"] == {"items": 3}
+    assert failed["status"] == "failed"
+    assert outer["config"] == {"fold": 1}
+    # the counts of the inner stages add to the outer ones
+    assert outer["counts"] == {"items": 4, "files_read": 1}
+    assert outer["wall_time"] >= 0.05
+    assert outer["cpu_time"] > 0
+    assert any("_busy" in stack for stack in outer["samples"])
+
+    summary = instrument.summarize(instrument.read_events(events))
+    assert list(summary) == ["outer", "square"]
+    assert summary["square"]["num_runs"] == 3
+    assert summary["square"]["num_failed"] == 1
+    assert summary["square"]["counts"] == {"items": 9}
+    assert "outer" in instrument.report(summary)
+    json.dumps(summary)
+
+
+def test_progress():
+    progress = instrument.Progress(4)
+    assert progress.rate is None and progress.eta is None
+
+    progress.update(("features", "mbid"), "skipped")
+    assert progress.rate is None
+    time.sleep(0.01)
+    line = progress.update(("training", 0), "done")
+    assert line.startswith("[2/4 50.0%, 1 skipped,")
+    assert line.endswith("done training--0")
+    assert progress.eta == pytest.approx(2 / progress.rate, rel=0.1)
+
+
+def test_progress_of_skipped_tasks():
+    progress = instrument.Progress(3)
+    for i in range(3):
+        line = progress.update(("features", i), "skipped")
+    assert progress.rate is None and progress.eta is None
+    assert line == "[3/3 100.0%, 3 skipped, -, ETA -] skipped features--2"
+
+
+@pytest.mark.parametrize("seconds, formatted", [
+    (None, "-"), (5.4, "5.40s"), (65, "1m05s"), (3725, "1h02m05s"),
+    (90061, "1d01h01m")])
+def test_format_duration(seconds, formatted):
+    assert instrument.format_duration(seconds) == formatted
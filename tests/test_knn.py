@@ -0,0 +1,111 @@
+import numpy as np
+import pytest
+
+from experimentation_code import distribution, knn
+
+
+def _model(recordings, distribution_type="pcd", step_size=25.0,
+           kernel_width=25.0):
+    vals = [distribution.normalize(distribution.compute_distribution(
+        pitch, tonic, step_size, kernel_width, distribution_type).vals)
+        for _, _, tonic, pitch in recordings]
+    return knn.KNNModel(
+        vals, [r[1] for r in recordings], [r[0] for r in recordings],
+        distribution.get_bins(step_size, distribution_type),
+        distribution_type, step_size, kernel_width)
+
+
+def _cent_error(estimate, tonic):
+    """octave-wrapped deviation in cents"""
+    cents = 1200 * np.log2(estimate / tonic)
+    return abs((cents + 600) % 1200 - 600)
+
+
+def test_model_is_read_only(toy_recordings):
+    model = _model(toy_recordings)
+    with pytest.raises(ValueError):
+        model.vals[0, 0] = 1.0
+
+
+def test_leave_one_out(toy_recordings):
+    model = _model(toy_recordings)
+    mbid, mode, tonic, pitch = toy_recordings[0]
+
+    # the recording itself is the nearest neighbor, unless it is left out
+    assert model.estimate_mode(pitch, tonic, "l1")[0] == [mode, 0.0]
+    estimate, dist = model.estimate_mode(
+        pitch, tonic, "l1", k_neighbor=3, exclude=mbid)[0]
+    assert estimate == mode
+    assert dist > 0
+
+
+@pytest.mark.parametrize("distribution_type", ["pd", "pcd"])
+def test_estimate_tonic_and_joint(toy_recordings, distribution_type):
+    model = _model(toy_recordings, distribution_type)
+    for mbid, mode, tonic, pitch in toy_recordings[:4]:
+        estimates = model.estimate_tonic(pitch, mode, 0.15, "bhat", 3,
+                                         rank=2, exclude=mbid)
+        assert 1 <= len(estimates) <= 2
+        assert _cent_error(estimates[0][0], tonic) < 25
+
+        (joint_tonic, joint_mode), _ = model.estimate_joint(
+            pitch, 0.15, "bhat", 3, exclude=mbid)[0]
+        assert joint_mode == mode
+        assert _cent_error(joint_tonic, tonic) < 25
+
+
+def test_vote():
+    dists = np.array([0.1, 0.2, 0.3, 0.05, 0.4])
+    labels = np.array([0, 1, 1, 2, 1])
+    excluded = np.array([False, False, False, True, False])
+
+    # label 1 has two of the three nearest neighbors
+    assert knn.vote(dists, labels, excluded, 3, 2) == [(1, 0.2), (0, 0.1)]
+
+
+@pytest.mark.parametrize("dis_measure", ["bhat", "l1", "dis_corr"])
+def test_batch_equals_per_sample(toy_recordings, dis_measure):
+    model = _model(toy_recordings, "pd", 15.0, 15.0)
+    pitches = [r[3] for r in toy_recordings]
+    excludes = [r[0] for r in toy_recordings]
+
+    batch = model.estimate_mode_batch(
+        pitches, [r[2] for r in toy_recordings], dis_measure, 3, 2, excludes)
+    assert batch == [model.estimate_mode(
+        r[3], r[2], dis_measure, 3, 2, r[0]) for r in toy_recordings]
+
+    batch = model.estimate_tonic_batch(
+        pitches, [r[1] for r in toy_recordings], 0.1, dis_measure, 3, 2,
+        excludes)
+    assert batch == [model.estimate_tonic(
+        r[3], r[1], 0.1, dis_measure, 3, 2, r[0]) for r in toy_recordings]
+
+    batch = model.estimate_joint_batch(pitches, 0.1, dis_measure, 3, 2,
+                                       excludes)
+    assert batch == [model.estimate_joint(
+        r[3], 0.1, dis_measure, 3, 2, r[0]) for r in toy_recordings]
+
+
+@pytest.mark.parametrize("shift_table", [False, True])
+def test_masked_view_equals_subset_model(toy_recordings, shift_table):
+    model = _model(toy_recordings)
+    model.shift_table = shift_table
+    training, testing = toy_recordings[:8], toy_recordings[8:]
+    subset = _model(training)
+    subset.shift_table = shift_table
+    view = model.masked(np.isin(model.sources, [r[0] for r in training]))
+    assert view.vals is model.vals
+
+    pitches = [r[3] for r in testing]
+    assert view.estimate_mode_batch(pitches, [r[2] for r in testing],
+                                    k_neighbor=3, rank=2) == \
+        subset.estimate_mode_batch(pitches, [r[2] for r in testing],
+                                   k_neighbor=3, rank=2)
+    assert view.estimate_tonic_batch(pitches, [r[1] for r in testing],
+                                     k_neighbor=3) == \
+        subset.estimate_tonic_batch(pitches, [r[1] for r in testing],
+                                    k_neighbor=3)
+    assert view.estimate_joint_batch(pitches, k_neighbor=3, rank=3) == \
+        subset.estimate_joint_batch(pitches, k_neighbor=3, rank=3)
+    with pytest.raises(ValueError):
+        model.masked([True])
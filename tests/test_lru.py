@@ -0,0 +1,26 @@
+import pytest
+
+from experimentation_code import lru
+
+
+def test_evicts_least_recently_used():
+    cache = lru.LRUCache(2)
+    loads = []
+
+    def load(key):
+        return lambda: loads.append(key) or key.upper()
+
+    assert cache.get("a", load("a")) == "A"
+    cache.get("b", load("b"))
+    cache.get("a", load("a"))  # b is the least recently used now
+    cache.get("c", load("c"))
+
+    assert cache.keys() == ["a", "c"]
+    assert loads == ["a", "b", "c"]
+    assert (cache.hits, cache.misses, cache.evictions) == (1, 3, 1)
+    assert cache.peek("b") is None
+
+
+def test_invalid_capacity():
+    with pytest.raises(ValueError):
+        lru.LRUCache(0)
@@ -0,0 +1,83 @@
+import os
+
+import numpy as np
+
+from experimentation_code import pitch_store
+
+
+def _make_dataset(dataset_folder, num_recordings, num_frames=50):
+    annotations = []
+    tracks = {}
+    for i in range(num_recordings):
+        mbid = "mbid-{0:d}".format(i)
+        makam = "Hicaz" if i % 2 else "Rast"
+        anno = {"mbid": "http://musicbrainz.org/recording/" + mbid,
+                "makam": makam, "tonic": 220.0 + i}
+        pitch_folder = os.path.join(dataset_folder, "data", makam)
+        os.makedirs(pitch_folder, exist_ok=True)
+
+        time = np.arange(num_frames + i) * 0.0029
+        hz = np.random.RandomState(i).uniform(100, 800, num_frames + i)
+        hz[::7] = 0  # unvoiced frames
+        np.savetxt(os.path.join(pitch_folder, mbid + ".pitch"),
+                   np.column_stack([time, hz, np.ones_like(hz)]))
+
+        annotations.append(anno)
+        tracks[mbid] = hz
+    return annotations, tracks
+
+
+def test_build_and_read(tmp_path):
+    annotations, tracks = _make_dataset(str(tmp_path / "dataset"), 4)
+    store_folder = str(tmp_path / "store")
+
+    pitch_store.build(annotations, str(tmp_path / "dataset"), store_folder)
+    store = pitch_store.PitchStore(store_folder)
+
+    assert len(store) == 4
+    for mbid, hz in tracks.items():
+        pitch = store[mbid]
+        assert pitch.dtype == np.float32
+        assert isinstance(pitch, np.memmap)  # view into the mapped file
+        np.testing.assert_allclose(pitch, hz, rtol=1e-6)
+
+
+def test_build_appends_new_recordings(tmp_path):
+    dataset_folder = str(tmp_path / "dataset")
+    annotations, tracks = _make_dataset(dataset_folder, 5)
+    store_folder = str(tmp_path / "store")
+
+    pitch_store.build(annotations[:3], dataset_folder, store_folder)
+    assert pitch_store.build(
+        annotations[:3], dataset_folder, store_folder).endswith("skipped.")
+    pitch_store.build(annotations, dataset_folder, store_folder)
+
+    store = pitch_store.PitchStore(store_folder)
+    assert sorted(store.mbids) == sorted(tracks.keys())
+    for mbid, hz in tracks.items():
+        np.testing.assert_allclose(store[mbid], hz, rtol=1e-6)
+
+
+def test_build_reconverts_changed_recordings(tmp_path):
+    dataset_folder = str(tmp_path / "dataset")
+    annotations, tracks = _make_dataset(dataset_folder, 3)
+    store_folder = str(tmp_path / "store")
+    hashes = {mbid: "hash" for mbid in tracks}
+
+    pitch_store.build(annotations, dataset_folder, store_folder,
+                      source_hashes=hashes)
+
+    # change the pitch track of a recording
+    pitch_file = pitch_store.get_pitch_file(annotations[1], dataset_folder)
+    changed = np.loadtxt(pitch_file)
+    changed[:, 1] *= 2
+    np.savetxt(pitch_file, changed)
+    hashes["mbid-1"] = "new hash"
+
+    assert pitch_store.build(annotations, dataset_folder, store_folder,
+                             source_hashes=hashes).endswith("created.")
+    store = pitch_store.PitchStore(store_folder)
+    np.testing.assert_allclose(store["mbid-1"], tracks["mbid-1"] * 2,
+                               rtol=1e-6)
+    for mbid in ["mbid-0", "mbid-2"]:
+        np.testing.assert_allclose(store[mbid], tracks[mbid], rtol=1e-6)
@@ -0,0 +1,63 @@
+import json
+import os
+
+from experimentation_code import results_log
+
+
+def test_append_and_finalize(tmp_path):
+    test_folder = str(tmp_path)
+    log = results_log.ResultsLog(test_folder)
+    log.append("m1", [[220.0, 0.1]])
+    log.append_failure("m2", "ValueError")
+
+    # restart: the saved sample is skipped and the failed one is retried
+    log = results_log.ResultsLog(test_folder)
+    assert log.saved == {"m1"}
+    assert log.failed == {"m2"}
+    log.append("m2", [["Hicaz", 0.2], ["Rast", 0.3]])
+    log.append("m1", [[440.0, 0.1]])  # the last record wins
+    assert log.failed == set()
+
+    results_file = log.finalize()
+    assert not os.path.exists(os.path.join(test_folder,
+                                           results_log.LOG_FILE))
+    with open(results_file) as f:
+        assert json.load(f) == {"m1": [[440.0, 0.1]],
+                                "m2": [["Hicaz", 0.2], ["Rast", 0.3]]}
+
+
+def test_interrupted_append(tmp_path):
+    test_folder = str(tmp_path)
+    results_log.ResultsLog(test_folder).append("m1", [[220.0, 0.1]])
+    with open(os.path.join(test_folder, results_log.LOG_FILE), "a") as f:
+        f.write('{"mbid": "m2", "status": "sa')
+
+    log = results_log.ResultsLog(test_folder)
+    assert log.saved == {"m1"}
+    log.append("m3", [[110.0, 0.5]])
+
+    with open(log.finalize()) as f:
+        assert json.load(f) == {"m1": [[220.0, 0.1]], "m3": [[110.0, 0.5]]}
+
+
+def test_finalize_empty(tmp_path):
+    log = results_log.ResultsLog(str(tmp_path))
+    log.append_failure("m1")
+    with open(log.finalize()) as f:
+        assert json.load(f) == {}
+
+
+def test_key_drops_results_of_other_inputs(tmp_path):
+    test_folder = str(tmp_path)
+    results_log.ResultsLog(test_folder, "key-1").append("m1", [[220.0, 0.1]])
+
+    # the same inputs resume; an unkeyed log keeps the saved results
+    assert results_log.ResultsLog(test_folder, "key-1").saved == {"m1"}
+    assert results_log.ResultsLog(test_folder).saved == {"m1"}
+
+    log = results_log.ResultsLog(test_folder, "key-1")
+    log.finalize()
+    log = results_log.ResultsLog(test_folder, "key-2")
+    assert log.saved == set()
+    assert not os.path.exists(log.results_file)
+    assert results_log.ResultsLog(test_folder, "key-2").saved == set()
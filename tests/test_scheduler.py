@@ -0,0 +1,116 @@
+import os
+import time
+
+import pytest
+
+from experimentation_code import scheduler
+
+
+def _write(path, text):
+    with open(path, "w") as f:
+        f.write(text)
+    return text
+
+
+def _concat(out_path, *in_paths):
+    texts = []
+    for path in in_paths:
+        with open(path) as f:
+            texts.append(f.read())
+    return _write(out_path, "".join(texts))
+
+
+def _fail():
+    raise RuntimeError("failed")
+
+
+def _graph(tmp_path):
+    paths = {key: str(tmp_path / key) for key in ["a", "b", "ab", "abb"]}
+    graph = scheduler.TaskGraph()
+    graph.add("a", _write, (paths["a"], "a"))
+    graph.add("b", _write, (paths["b"], "b"),
+              is_done=lambda: os.path.exists(paths["b"]))
+    graph.add("ab", _concat, (paths["ab"], paths["a"], paths["b"]),
+              deps=["a", "b"])
+    graph.add("abb", _concat, (paths["abb"], paths["ab"], paths["b"]),
+              deps=["ab", "b"])
+    return graph, paths
+
+
+@pytest.mark.parametrize("num_workers", [0, 2])
+def test_run(tmp_path, num_workers):
+    graph, paths = _graph(tmp_path)
+    _write(paths["b"], "B")  # already done
+
+    finished = []
+    results = scheduler.run(graph, num_workers,
+                            callback=lambda key, _: finished.append(key))
+
+    assert results["b"].status == scheduler.SKIPPED
+    assert results["abb"] == scheduler.TaskResult(scheduler.DONE, "aBB")
+    assert finished.index("ab") < finished.index("abb")
+
+
+def test_failure_cancels_dependents(tmp_path):
+    graph, _ = _graph(tmp_path)
+    graph.add("fail", _fail, deps=["a"])
+    graph.add("after_fail", _write, (str(tmp_path / "c"), "c"),
+              deps=["fail", "b"])
+    graph.add("after_after_fail", _fail, deps=["after_fail"])
+
+    results = scheduler.run(graph, 0)
+
+    assert results["abb"].status == scheduler.DONE
+    assert results["fail"].status == scheduler.FAILED
+    assert isinstance(results["fail"].value, RuntimeError)
+    assert results["after_fail"].status == scheduler.CANCELLED
+    assert results["after_after_fail"].status == scheduler.CANCELLED
+
+
+def test_invalid_graph():
+    graph = scheduler.TaskGraph()
+    graph.add("a", _fail)
+    with pytest.raises(ValueError):
+        graph.add("a", _fail)
+    with pytest.raises(ValueError):
+        graph.add("b", _fail, deps=["c"])
+
+
+def _pid(seconds):
+    time.sleep(seconds)
+    return os.getpid()
+
+
+def test_groups_run_on_the_same_worker():
+    graph = scheduler.TaskGraph()
+    for group in ["a", "b"]:
+        for i in range(3):
+            graph.add((group, i), _pid, (0.2,), group=group)
+
+    results = scheduler.run(graph, 2)
+
+    pids = {group: {results[group, i].value for i in range(3)}
+            for group in ["a", "b"]}
+    assert len(pids["a"]) == len(pids["b"]) == 1
+    assert pids["a"] != pids["b"]
+
+
+def test_idle_worker_steals():
+    graph = scheduler.TaskGraph()
+    for i in range(4):
+        graph.add(i, _pid, (0.2,), group="a")
+
+    results = scheduler.run(graph, 2)
+
+    assert len({r.value for r in results.values()}) == 2
+
+
+def test_queued_tasks_run_after_the_running_ones_finish():
+    graph = scheduler.TaskGraph()
+    for i in range(20):
+        graph.add(i, abs, (-i,))
+
+    results = scheduler.run(graph, 2)
+
+    assert {key: r.value for key, r in results.items()} == {
+        i: i for i in range(20)}
@@ -0,0 +1,209 @@
+import concurrent.futures
+import http.client
+import json
+import os
+import socket
+import threading
+
+import pytest
+
+from experimentation_code import distribution, scheduler, service, synthetic
+from .test_knn import _model
+
+
+class _UnixConnection(http.client.HTTPConnection):
+    def __init__(self, path):
+        super().__init__("localhost")
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+
+def _post(conn, body):
+    conn.request("POST", "/recognize", json.dumps(body),
+                 {"Content-Type": "application/json"})
+    response = conn.getresponse()
+    return response.status, json.loads(response.read())
+
+
+@pytest.fixture
+def recognizer(toy_recordings):
+    loaded = []
+
+    def loader(config):
+        loaded.append(config)
+        return _model(toy_recordings, config["distribution_type"])
+
+    recognizer = service.Recognizer(loader, capacity=1, max_delay=0.05)
+    recognizer.loaded = loaded
+    yield recognizer
+    recognizer.close()
+
+
+def test_model_cache_evicts_least_recently_used():
+    models = service.ModelCache(lambda config: object(), capacity=2)
+    a, b, c = {"fold": 0}, {"fold": 1}, {"fold": 2}
+    model_a = models.get(a)
+    models.get(b)
+    assert models.get(a) is model_a  # b is the least recently used now
+    models.get(c)
+
+    assert a in models and c in models and b not in models
+    assert (models.hits, models.misses, models.evictions) == (1, 3, 1)
+
+
+def test_concurrent_requests_are_batched(recognizer, toy_recordings):
+    model = _model(toy_recordings, "pcd")
+    config = {"distribution_type": "pcd"}
+    requests = [{"model": config, "experiment_type": "joint",
+                 "pitch": pitch.tolist(), "k_neighbor": 3, "exclude": mbid}
+                for mbid, _, _, pitch in toy_recordings]
+    futures = [recognizer.submit(r) for r in requests]
+
+    assert [f.result() for f in futures] == model.estimate_joint_batch(
+        [r[3] for r in toy_recordings], k_neighbor=3,
+        excludes=[r[0] for r in toy_recordings])
+    assert recognizer.num_batches < len(requests)
+    assert recognizer.loaded == [config]
+
+
+def test_failed_load_is_not_retried_in_round(toy_recordings):
+    loaded = []
+
+    def loader(config):
+        loaded.append(config)
+        raise FileNotFoundError(config["fold"])
+
+    recognizer = service.Recognizer(loader, max_delay=0.05)
+    try:
+        pitch = toy_recordings[0][3].tolist()
+        futures = [recognizer.submit(
+            {"model": {"fold": 5}, "experiment_type": "joint",
+             "pitch": pitch, "k_neighbor": k}) for k in [1, 1, 3]]
+        for future in futures:
+            with pytest.raises(FileNotFoundError):
+                future.result(5)
+    finally:
+        recognizer.close()
+    assert loaded == [{"fold": 5}]
+
+
+def test_precomputed_distribution(recognizer, toy_recordings):
+    model = _model(toy_recordings, "pd")
+    mbid, mode, tonic, pitch = toy_recordings[0]
+    ref_freq = distribution.reference_frequency(pitch)
+    query = model.get_query(pitch, ref_freq)
+
+    for experiment_type, estimate in [
+            ("tonic", model.estimate_tonic(pitch, mode, exclude=mbid)),
+            ("joint", model.estimate_joint(pitch, exclude=mbid))]:
+        assert recognizer.recognize({
+            "model": {"distribution_type": "pd"},
+            "experiment_type": experiment_type, "mode": mode,
+            "distribution": query.tolist(), "ref_freq": ref_freq,
+            "exclude": mbid}) == estimate
+
+    assert recognizer.recognize({
+        "model": {"distribution_type": "pd"}, "experiment_type": "mode",
+        "distribution": model.get_query(pitch, tonic).tolist(),
+        "exclude": mbid}) == model.estimate_mode(pitch, tonic, exclude=mbid)
+
+
+@pytest.mark.parametrize("request_", [
+    {"experiment_type": "mode", "pitch": [], "tonic": 1.0},
+    {"model": {}, "experiment_type": "key", "pitch": []},
+    {"model": {}, "experiment_type": "mode", "pitch": []},
+    {"model": {}, "experiment_type": "joint", "distribution": []},
+    {"model": {}, "experiment_type": "joint", "pitch": [],
+     "distribution": []},
+    {"model": {}, "experiment_type": "joint", "pitch": [], "k_neighbor": [1]},
+    {"model": {}, "experiment_type": "joint", "pitch": [], "rank": 1.5},
+    {"model": {}, "experiment_type": "joint", "pitch": [], "k_neighbor": 0},
+    {"model": {}, "experiment_type": "joint", "pitch": [],
+     "min_peak_ratio": "0.15"}])
+def test_invalid_request(recognizer, request_):
+    with pytest.raises(ValueError):
+        recognizer.submit(request_)
+
+
+def test_bad_request_does_not_stop_scoring(recognizer, toy_recordings):
+    mbid, mode, tonic, pitch = toy_recordings[0]
+    request = {"model": {"distribution_type": "pcd"},
+               "experiment_type": "mode", "pitch": pitch.tolist(),
+               "tonic": tonic}
+
+    # a request, which passed the validation but cannot be grouped
+    bad = service.parse_request(request)
+    bad["k_neighbor"] = [1]
+    future = concurrent.futures.Future()
+    recognizer._queue.put((bad, future))
+    with pytest.raises(TypeError):
+        future.result(5)
+
+    assert recognizer.recognize(request, 5)[0][0] == mode
+    assert recognizer._thread.is_alive()
+
+
+@pytest.mark.parametrize("transport", ["tcp", "unix"])
+def test_http(recognizer, toy_recordings, tmp_path, transport):
+    if transport == "tcp":
+        server = service.make_server(recognizer, ("127.0.0.1", 0))
+        conn = http.client.HTTPConnection(*server.server_address)
+    else:
+        path = str(tmp_path / "service.sock")
+        server = service.make_server(recognizer, path)
+        conn = _UnixConnection(path)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    try:
+        mbid, mode, tonic, pitch = toy_recordings[0]
+        request = {"model": {"distribution_type": "pcd"},
+                   "experiment_type": "mode", "pitch": pitch.tolist(),
+                   "tonic": tonic}
+        status, body = _post(conn, request)
+        assert status == 200
+        assert body["estimates"][0][0] == mode
+
+        status, body = _post(conn, {"requests": [request, request]})
+        assert status == 200 and len(body["results"]) == 2
+
+        status, body = _post(conn, {"experiment_type": "mode"})
+        assert status == 400
+
+        # a bad request does not fail the next ones
+        status, body = _post(conn, dict(request, k_neighbor=[1]))
+        assert status == 400
+        status, body = _post(conn, request)
+        assert status == 200 and body["estimates"][0][0] == mode
+
+        conn.request("GET", "/status")
+        body = json.loads(conn.getresponse().read())
+        assert body["models"] == [{"distribution_type": "pcd"}]
+    finally:
+        conn.close()
+        server.shutdown()
+        server.server_close()
+
+
+def test_all_data_model(tmp_path, dlfm_code):
+    save_folder = str(tmp_path / "data")
+    dataset_folder = os.path.join(save_folder, "dataset")
+    annotations, folds = synthetic.generate(dataset_folder, num_frames=300)
+    scheduler.run(dlfm_code("sweep").build_graph(
+        annotations, folds, dataset_folder, save_folder, step_sizes=[100.0],
+        kernel_widths=[0], distribution_types=["pcd"],
+        model_types=["single"], experiment_types=[]), 0)
+
+    config = {"distribution_type": "pcd", "step_size": 100.0,
+              "kernel_width": 0}
+    load_model = dlfm_code("service").load_model
+    multi = load_model(save_folder, False, dict(config, model_type="multi"))
+    assert len(multi) == len(annotations)
+    single = load_model(save_folder, False, dict(
+        config, model_type="single", fold=None))
+    assert sorted(single.modes) == sorted(synthetic.MAKAMS)
+    with pytest.raises(FileNotFoundError):  # the multi models of the folds
+        load_model(save_folder, False, dict(config, model_type="multi",
+                                            fold=0))
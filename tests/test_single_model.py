@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from experimentation_code import feature_bank, single_model
+from .test_feature_bank import BINS, _writer
+
+MODES = ["Hicaz", "Rast", "Ussak"]
+
+
+@pytest.fixture
+def bank(tmp_path):
+    writer = _writer(str(tmp_path / "bank"))
+    rnd = np.random.RandomState(0)
+    for i in range(12):
+        writer.append("mbid-{0:d}".format(i), MODES[i % 3], 220.0,
+                      rnd.randint(0, 100, len(BINS)))
+    return feature_bank.FeatureBank(str(tmp_path / "bank"))
+
+
+def test_train_folds(bank):
+    folds = [["mbid-{0:d}".format(i) for i in range(12) if i % 4 != f]
+             for f in range(4)] + [["mbid-0", "mbid-3"]]
+    models = single_model.train_folds(bank, folds)
+
+    for sources, model in zip(folds, models):
+        rows = bank.rows(sources)
+        assert model.modes == sorted(set(bank.modes[rows]))
+        for mode, vals, mode_sources in zip(model.modes, model.vals,
+                                            model.sources):
+            in_mode = bank.modes[rows] == mode
+            assert mode_sources == sorted(bank.mbids[rows][in_mode])
+            expected = bank.hist[rows][in_mode].sum(axis=0)
+            np.testing.assert_allclose(vals, expected / expected.sum())
+    assert models[-1].modes == ["Hicaz"]
+
+
+def test_save_and_load(bank, tmp_path):
+    model = single_model.train_folds(bank, [list(bank.mbids)])[0]
+    path = str(tmp_path / "fold0.single")
+    single_model.save(model, path)
+
+    loaded = single_model.load(path)
+    np.testing.assert_array_equal(loaded.vals, model.vals)
+    assert isinstance(loaded.vals, np.memmap)
+    assert not loaded.vals.flags.writeable
+    np.testing.assert_array_equal(loaded.bins, BINS)
+    assert loaded.modes == model.modes and loaded.sources == model.sources
+    assert loaded[4:] == ("pcd", 100.0, 0)
+
+    with open(path, "r+b") as f:
+        f.write(b"X")
+    with pytest.raises(IOError):
+        single_model.load(path)
+
+
+def test_update(bank, tmp_path):
+    model = single_model.train_folds(bank, [["mbid-0", "mbid-1"]])[0]
+    writer = _writer(str(tmp_path / "bank"))
+    writer.append("mbid-0", "Rast", 220.0, np.arange(len(BINS)))
+    bank = feature_bank.FeatureBank(str(tmp_path / "bank"))
+
+    updated, modes = single_model.update(model, bank, ["mbid-0", "mbid-2"])
+    assert modes == ["Hicaz", "Rast", "Ussak"]
+    assert updated.modes == ["Rast", "Ussak"]
+    assert updated.sources == [["mbid-0", "mbid-1"], ["mbid-2"]]
+    expected = bank.hist[bank.rows(["mbid-0", "mbid-1"])].sum(axis=0)
+    np.testing.assert_allclose(updated.vals[0], expected / expected.sum())
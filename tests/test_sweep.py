@@ -0,0 +1,265 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from experimentation_code import feature_bank, fold_index, pitch_store, \
+    results_log, scheduler, synthetic
+
+
+@pytest.fixture
+def sweep(dlfm_code):
+    """the legacy sweep module"""
+    return dlfm_code("sweep")
+
+
+def _generate(tmp_path, **kwargs):
+    save_folder = str(tmp_path / "data")
+    dataset_folder = os.path.join(save_folder, "dataset")
+    annotations, folds = synthetic.generate(
+        dataset_folder, num_frames=300,
+        folds_file=os.path.join(save_folder, "folds.json"), **kwargs)
+    return save_folder, dataset_folder, annotations, folds
+
+
+def _build_graph(sweep, save_folder, dataset_folder, annotations, folds,
+                 **kwargs):
+    # a single cheap configuration
+    params = dict(step_sizes=[100.0], kernel_widths=[0],
+                  distribution_types=["pcd"], model_types=["single"],
+                  experiment_types=["mode"], dis_measures=["l1"],
+                  k_neighbors=[1])
+    params.update(kwargs)
+    return sweep.build_graph(annotations, folds, dataset_folder, save_folder,
+                             **params)
+
+
+def _fold_results(save_folder):
+    found = {}
+    for root, _, files in os.walk(os.path.join(save_folder, "testing")):
+        if results_log.RESULTS_FILE in files:
+            with open(os.path.join(root, results_log.RESULTS_FILE)) as f:
+                found[root] = json.load(f)
+    return found
+
+
+def test_interrupted_fold_resumes(tmp_path, monkeypatch, sweep):
+    dataset = _generate(tmp_path)
+    save_folder = dataset[0]
+
+    # kill the sweep in the middle of saving the results of a fold
+    append = results_log.ResultsLog.append
+    logged = []
+
+    def _append_until_killed(log, mbid, results):
+        if len(logged) == 150:
+            raise KeyboardInterrupt
+        append(log, mbid, results)
+        logged.append(mbid)
+
+    monkeypatch.setattr(results_log.ResultsLog, "append",
+                        _append_until_killed)
+    with pytest.raises(KeyboardInterrupt):
+        scheduler.run(_build_graph(sweep, *dataset), 0)
+    assert len(_fold_results(save_folder)) == 1
+    monkeypatch.setattr(results_log.ResultsLog, "append", append)
+
+    # the logged samples of the killed fold are not scored again
+    scored = []
+    estimate = sweep.tester._estimate
+
+    def _count_estimate(model, model_type, experiment_type, samples,
+                        *args):
+        scored.extend(ts["source"] for ts, _ in samples)
+        return estimate(model, model_type, experiment_type, samples, *args)
+
+    monkeypatch.setattr(sweep.tester, "_estimate", _count_estimate)
+    results = scheduler.run(_build_graph(sweep, *dataset), 0)
+    assert all(r.status in (scheduler.DONE, scheduler.SKIPPED)
+               for r in results.values())
+    assert not set(scored).intersection(logged)
+    assert len(scored) == 1000 - len(logged)
+
+    fold_results = _fold_results(save_folder)
+    assert len(fold_results) == 10
+    assert all(len(res) == 100 for res in fold_results.values())
+
+
+def test_summary_reports_approximate_searches_apart(tmp_path, sweep):
+    dataset = _generate(tmp_path)
+    save_folder, dataset_folder = dataset[:2]
+    results = scheduler.run(_build_graph(sweep, *dataset), 0)
+    assert all(r.status == scheduler.DONE for r in results.values())
+
+    # the results of an approximate search with and without an exact search
+    experiment_folder = os.path.join(save_folder, "testing", "mode")
+    exact, = os.listdir(experiment_folder)
+    params = exact.split("--", 1)[1]
+    for label in ["single-coarse50_0top5", "multi-ann8"]:
+        shutil.copytree(os.path.join(experiment_folder, exact),
+                        os.path.join(experiment_folder,
+                                     label + "--" + params))
+    sweep.tester.summarize(save_folder,
+                           os.path.join(dataset_folder, "annotations.json"))
+
+    testing_folder = os.path.join(save_folder, "testing")
+    with open(os.path.join(testing_folder, "evaluation_overall.json")) as f:
+        overall = json.load(f)
+    with open(os.path.join(testing_folder, "evaluation_search.json")) as f:
+        searches = json.load(f)
+    assert [s["param"] for s in overall["mode"]] == [exact]
+    with open(os.path.join(experiment_folder, exact,
+                           "overall_eval.json")) as f:  # in percent
+        assert json.load(f)["mode_accuracy"] == pytest.approx(
+            100 * overall["mode"][0]["accuracy"])
+    searches = {s["param"].split("--")[0]: s for s in searches["mode"]}
+    coarse = searches["single-coarse50_0top5"]
+    assert coarse["exact_param"] == exact
+    assert (coarse["accuracy"], coarse["accuracy_gap"],
+            coarse["num_changed"]) == (overall["mode"][0]["accuracy"], 0, 0)
+    assert searches["multi-ann8"]["exact_accuracy"] is None
+
+
+def test_failed_sample_logs_error(tmp_path, monkeypatch, sweep):
+    dataset = _generate(tmp_path)
+    save_folder, _, _, folds = dataset
+    failing = folds[0][1]["testing"][0]["source"]
+    estimate = sweep.tester._estimate
+
+    def _fail_sample(model, model_type, experiment_type, samples, *args):
+        if any(ts["source"] == failing for ts, _ in samples):
+            raise ValueError("bad pitch track")
+        return estimate(model, model_type, experiment_type, samples, *args)
+
+    monkeypatch.setattr(sweep.tester, "_estimate", _fail_sample)
+    results = scheduler.run(_build_graph(sweep, *dataset), 0)
+    failed = [key for key, r in results.items()
+              if r.status == scheduler.FAILED]
+    assert failed == [("testing", "mode", "single", "pcd", 100.0, 0, "l1", 1,
+                       0.15, folds[0][0])]
+
+    log_file, = [os.path.join(root, results_log.LOG_FILE)
+                 for root, _, files in os.walk(save_folder)
+                 if results_log.LOG_FILE in files]
+    with open(log_file) as f:
+        records = [json.loads(line) for line in f]
+    failure, = [r for r in records if r["status"] == results_log.FAILED]
+    assert failure["mbid"] == failing
+    assert "bad pitch track" in failure["error"]
+
+
+def test_repeated_folds_are_evaluated_per_fold(tmp_path, sweep):
+    save_folder, dataset_folder, annotations, _ = _generate(tmp_path)
+    index_file = os.path.join(save_folder, fold_index.INDEX_FILE)
+    recordings = fold_index.recording_table(annotations, dataset_folder)
+    fold_index.save(recordings, fold_index.generate(recordings, 10, [1, 2]),
+                    index_file)
+    folds = fold_index.FoldIndex(index_file).legacy_folds()
+    assert len(folds) == 20
+
+    results = scheduler.run(_build_graph(
+        sweep, save_folder, dataset_folder, annotations, folds), 0)
+    assert all(r.status == scheduler.DONE for r in results.values())
+
+    experiment_folder = os.path.join(save_folder, "testing", "mode")
+    exact, = os.listdir(experiment_folder)
+    with open(os.path.join(experiment_folder, exact,
+                           "overall_eval.json")) as f:
+        overall_eval = json.load(f)
+    # each recording is tested once per repetition
+    assert np.sum(overall_eval["confusion_matrix"]["matrix"]) == 2000
+    assert overall_eval["mode_accuracy"] == pytest.approx(
+        overall_eval["num_correct_mode"] / 20.0)
+    assert overall_eval["num_correct_mode"] > 1000
+
+
+def test_reverted_input_is_computed_again(tmp_path, sweep):
+    dataset = _generate(tmp_path)
+    save_folder, dataset_folder, annotations, _ = dataset
+    assert all(r.status == scheduler.DONE for r in scheduler.run(
+        _build_graph(sweep, *dataset), 0).values())
+
+    anno = annotations[0]
+    mbid = pitch_store.get_mbid(anno)
+    pitch_file = pitch_store.get_pitch_file(anno, dataset_folder)
+    with open(pitch_file, "rb") as f:
+        original = f.read()
+
+    def _bank_row():
+        bank = feature_bank.FeatureBank(sweep.trainer.get_feature_folder(
+            save_folder, 100.0, 0, "pcd"))
+        return bank.hist[bank.rows([mbid])[0]].copy()
+
+    def _rerun():
+        results = scheduler.run(_build_graph(sweep, *dataset), 0)
+        assert results[("features", mbid)].status == scheduler.DONE
+        return _bank_row()
+
+    original_row = _bank_row()
+    pitch = np.loadtxt(pitch_file)
+    pitch[:, 1] *= 1.1
+    np.savetxt(pitch_file, pitch, fmt="%.6f", delimiter="\t")
+    assert not np.array_equal(_rerun(), original_row)
+
+    # the keys of the original features are superseded
+    with open(pitch_file, "wb") as f:
+        f.write(original)
+    np.testing.assert_array_equal(_rerun(), original_row)
+
+    # the compacted manifest keeps only the valid keys
+    result_cache = sweep.io.get_cache(save_folder)
+    num_valid = len(result_cache)
+    result_cache.compact()
+    assert len(sweep.io.get_cache(save_folder).entries) == num_valid
+
+
+def test_ingested_test_recording_is_tested_again(tmp_path, dlfm_code, sweep):
+    dataset = _generate(tmp_path)
+    save_folder, dataset_folder, annotations, folds = dataset
+    assert all(r.status == scheduler.DONE for r in scheduler.run(
+        _build_graph(sweep, *dataset), 0).values())
+
+    # another pitch track of a test recording of the first fold
+    mbid = folds[0][1]["testing"][0]["source"]
+    anno, = [a for a in annotations if pitch_store.get_mbid(a) == mbid]
+    inbox = str(tmp_path / "inbox")
+    os.makedirs(inbox)
+    pitch = np.loadtxt(pitch_store.get_pitch_file(anno, dataset_folder))
+    pitch[:, 1] *= 1.1
+    np.savetxt(os.path.join(inbox, mbid + ".pitch"), pitch, fmt="%.6f",
+               delimiter="\t")
+    with open(os.path.join(inbox, mbid + ".json"), "w") as f:
+        json.dump(anno, f)
+    assert dlfm_code("ingest").main([
+        "--data-folder", save_folder, "--dataset-folder", dataset_folder,
+        "--pitch-store-folder", str(tmp_path / "store"), "--inbox", inbox,
+        "--workers", "0", "--step-sizes", "100.0", "--kernel-widths", "0",
+        "--distribution-types", "pcd", "--once"]) == 0
+
+    def _fold_sources():
+        return sweep.tester.load_model(save_folder, "single", "pcd", 100.0, 0,
+                                       folds[0][0])[1]
+
+    assert mbid not in _fold_sources()
+
+    # the model of all the recordings has the ingested pitch track
+    bank = feature_bank.load(sweep.trainer.get_feature_folder(
+        save_folder, 100.0, 0, "pcd"))
+    model, sources = sweep.tester.load_model(save_folder, "single", "pcd",
+                                             100.0, 0, None)
+    assert sources == set(bank.mbids)
+    row = list(model.modes).index(anno["makam"])
+    hist = bank.hist[bank.modes == anno["makam"]].sum(axis=0)
+    np.testing.assert_allclose(model.vals[row], hist / hist.sum())
+
+    # the folds are trained and tested again, none on its test recordings
+    results = scheduler.run(_build_graph(sweep, *dataset), 0)
+    assert results[("features", mbid)].status == scheduler.DONE
+    assert results[("training", "single", "pcd", 100.0, 0)].status == \
+        scheduler.DONE
+    assert all(results[("testing", "mode", "single", "pcd", 100.0, 0, "l1",
+                        1, 0.15, fold_idx)].status == scheduler.DONE
+               for fold_idx, _ in folds)
+    assert mbid not in _fold_sources()
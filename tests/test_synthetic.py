@@ -0,0 +1,47 @@
+import collections
+import json
+
+import numpy as np
+
+from experimentation_code import distribution, synthetic
+
+
+def test_otmm_shape():
+    annotations = synthetic.make_annotations()
+    folds = synthetic.stratified_folds(annotations, "dataset")
+
+    assert len(annotations) == 1000
+    assert len(set(anno["mbid"] for anno in annotations)) == 1000
+    assert len(folds) == 10
+    tested = []
+    for fold_idx, fold in folds:
+        # the checks of the training and testing steps
+        assert len(fold["testing"]) == 100
+        assert set(collections.Counter(
+            fold["training"]["modes"]).values()) == {45}
+        assert not set(fold["training"]["sources"]).intersection(
+            ts["source"] for ts in fold["testing"])
+        tested += [ts["source"] for ts in fold["testing"]]
+    assert len(set(tested)) == 1000
+
+
+def test_generate(tmp_path):
+    folds_file = str(tmp_path / "folds.json")
+    annotations, folds = synthetic.generate(
+        str(tmp_path / "dataset"), makams=synthetic.MAKAMS[:2],
+        num_recordings=5, num_frames=200, n_folds=5, seed=1,
+        folds_file=folds_file)
+
+    assert json.load(open(folds_file)) == folds
+    assert json.load(open(str(tmp_path / "dataset" /
+                              "annotations.json"))) == annotations
+    sample = folds[0][1]["testing"][0]
+    pitch = np.loadtxt(sample["pitch"])
+    assert pitch.shape == (200, 3)
+
+    # the tonic is the most frequent pitch class
+    pcd = distribution.compute_distributions(
+        pitch[:, 1], sample["tonic"], [("pcd", 7.5, 7.5)])[
+            ("pcd", 7.5, 7.5)]
+    cents = pcd.bins[np.argmax(pcd.vals)] % 1200
+    assert min(cents, 1200 - cents) < 30
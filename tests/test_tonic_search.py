@@ -0,0 +1,119 @@
+import numpy as np
+import pytest
+
+from experimentation_code import distance, instrument, tonic_search
+
+from .test_knn import _model
+
+
+@pytest.fixture
+def pcds():
+    vals = np.random.RandomState(1).rand(9, 48)
+    vals[2, :10] = 0  # empty bins
+    return vals / vals.sum(axis=1, keepdims=True)
+
+
+def test_all_shifts():
+    shifts = tonic_search.all_shifts(np.arange(4.0))
+    assert shifts.tolist() == [[0, 1, 2, 3], [1, 2, 3, 0], [2, 3, 0, 1],
+                               [3, 0, 1, 2]]
+
+
+@pytest.mark.parametrize("dis_measure", distance.DISTANCE_MEASURES)
+def test_table_equals_shifted_distances(pcds, dis_measure):
+    table = tonic_search.CircularShiftTable(pcds[1:], dis_measure)
+    expected = distance.pairwise(tonic_search.all_shifts(pcds[0]), pcds[1:],
+                                 dis_measure)
+    np.testing.assert_allclose(table.distances(pcds[0]), expected,
+                               rtol=1e-9, atol=1e-12)
+
+    rows = np.array([True, False] * 4)
+    np.testing.assert_allclose(table.distances(pcds[0], rows),
+                               expected[:, rows], rtol=1e-9, atol=1e-12)
+
+
+@pytest.mark.parametrize("dis_measure", ["bhat", "l1", "dis_corr"])
+def test_table_estimates(toy_recordings, dis_measure):
+    direct = _model(toy_recordings)
+    table = _model(toy_recordings)
+    table.shift_table = True
+
+    for mbid, mode, tonic, pitch in toy_recordings:
+        for (est, dist), (est_t, dist_t) in zip(
+                direct.estimate_tonic(pitch, mode, 0.1, dis_measure, 3, 2,
+                                      mbid),
+                table.estimate_tonic(pitch, mode, 0.1, dis_measure, 3, 2,
+                                     mbid)):
+            assert est == est_t
+            assert dist == pytest.approx(dist_t)
+
+        (est, dist), = direct.estimate_joint(pitch, 0.1, dis_measure, 3,
+                                             exclude=mbid)
+        (est_t, dist_t), = table.estimate_joint(pitch, 0.1, dis_measure, 3,
+                                                exclude=mbid)
+        assert est == est_t
+        assert dist == pytest.approx(dist_t)
+
+    pitches = [r[3] for r in toy_recordings]
+    excludes = [r[0] for r in toy_recordings]
+    assert table.estimate_joint_batch(pitches, 0.1, dis_measure, 3, 1,
+                                      excludes) == \
+        [table.estimate_joint(r[3], 0.1, dis_measure, 3, 1, r[0])
+         for r in toy_recordings]
+
+
+def test_downsample():
+    vals = np.arange(10.0)
+    assert tonic_search.downsample(vals, 3).tolist() == [3, 12, 21, 9]
+    assert tonic_search.downsample(vals[None, :], 5).tolist() == [[10, 35]]
+
+
+def test_prune():
+    coarse = np.array([[0.1, 0.5, np.inf, 0.3],
+                       [0.2, 0.05, 0.4, np.inf]])
+    labels = np.array([0, 1, 1, 2])
+    kept, num_hypotheses = tonic_search.prune(coarse, labels, 4, 3)
+    # the last label has no rows, the row of the label 2 is left out for
+    # the second peak, and (0, 1) is scored by its nearest row
+    assert num_hypotheses == 5
+    assert kept.tolist() == [[True, False, False, False],
+                             [True, True, False, False]]
+
+
+@pytest.mark.parametrize("dis_measure", ["bhat", "l1"])
+def test_coarse_to_fine(toy_recordings, dis_measure):
+    model = _model(toy_recordings, "pd", 15.0, 15.0)
+    pitches = [r[3] for r in toy_recordings]
+    modes = [r[1] for r in toy_recordings]
+    excludes = [r[0] for r in toy_recordings]
+
+    # nothing is pruned if all the hypotheses are refined
+    full = model.with_coarse_search(45.0, top_n=1000)
+    assert full.estimate_tonic_batch(pitches, modes, 0.1, dis_measure, 3, 2,
+                                     excludes) == \
+        model.estimate_tonic_batch(pitches, modes, 0.1, dis_measure, 3, 2,
+                                   excludes)
+    assert full.estimate_joint_batch(pitches, 0.1, dis_measure, 3, 2,
+                                     excludes) == \
+        model.estimate_joint_batch(pitches, 0.1, dis_measure, 3, 2, excludes)
+
+    events = []
+    instrument.configure()
+    instrument.add_listener(events.append)
+    try:
+        with instrument.stage("test"):
+            pruned = model.with_coarse_search(45.0, top_n=2)
+            estimates = pruned.estimate_joint_batch(pitches, 0.1,
+                                                    dis_measure, 3, 2,
+                                                    excludes)
+    finally:
+        instrument.remove_listener(events.append)
+        instrument.disable()
+    assert [e[0][0][1] for e in estimates] == modes
+    counts = events[0]["counts"]
+    assert counts["refined_hypotheses"] == 2 * len(toy_recordings)
+    assert counts["hypotheses"] > counts["refined_hypotheses"]
+    assert counts["fine_distances"] < counts["coarse_distances"]
+
+    with pytest.raises(ValueError):
+        model.with_coarse_search(5.0)